@@ -0,0 +1,124 @@
+"""Замер холодного старта бота: каждый запуск - отдельный процесс.
+
+Для каждого запуска выводятся время импорта bot, время до готовности принимать
+сообщения (post_init), ответ на /start, готовность индекса и тяжелые модули,
+загруженные уже при импорте. Первый запуск с пустым --workdir собирает индекс
+с нуля, следующие загружают его с диска.
+
+    python -m benchmarks.cold_start --runs 5
+"""
+
+import argparse
+import asyncio
+import pathlib
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import orjson
+
+HEAVY_MODULES = (
+    "langchain_community.document_loaders",
+    "langchain_community.vectorstores.faiss",
+    "langchain.chains.retrieval_qa",
+    "langchain_community.chat_models.gigachat",
+    "langchain_community.embeddings.gigachat",
+    "gigachat",
+    "faiss",
+    "pypdf",
+    "bs4",
+    "docx2txt",
+)
+
+
+def child(workdir: str, fake: bool):
+    started = time.perf_counter()
+    import src.settings as config
+
+    config.INDEX_PATH = str(pathlib.Path(workdir) / "index")
+    config.LOCAL_INDEX_PATH = str(pathlib.Path(workdir) / "index" / "local")
+    config.EMBEDDINGS_CACHE_PATH = str(pathlib.Path(workdir) / "embeddings.sqlite")
+    config.PERSISTENCE_PATH = str(pathlib.Path(workdir) / "storage.sqlite")
+    config.INGEST_CACHE_PATH = str(pathlib.Path(workdir) / "index" / "parsed")
+    config.JSON_LOG_PATH = str(pathlib.Path(workdir) / "deposit_bot.json")
+
+    import bot
+
+    bot.setup_logging()
+
+    imported = time.perf_counter() - started
+    heavy = [name for name in HEAVY_MODULES if name in sys.modules]
+
+    from benchmarks.replay import StubBot
+
+    async def run():
+        if fake:
+            bot.settings = config.GigaSettings(stand="fake")
+        await bot.warm_up()
+        ready = time.perf_counter() - started
+        update = SimpleNamespace(effective_chat=SimpleNamespace(id=1))
+        await bot.start(update, SimpleNamespace(bot=StubBot(0.0), chat_data={}))
+        start_answered = time.perf_counter() - started
+        await bot.wait_for_index()
+        return ready, start_answered, time.perf_counter() - started
+
+    ready, start_answered, index_ready = asyncio.run(run())
+    print(
+        orjson.dumps(
+            {
+                "import": imported,
+                "ready": ready,
+                "start": start_answered,
+                "index": index_ready,
+                "heavy": heavy,
+            }
+        ).decode()
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--workdir", default=None, help="каталог индекса (по умолчанию временный)")
+    parser.add_argument("--real", action="store_true", help="клиенты GigaChat вместо заменителей")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="deposit-cold-start-")
+    if args.child:
+        child(workdir, not args.real)
+        return
+
+    command = [sys.executable, "-m", "benchmarks.cold_start", "--child", "--workdir", workdir]
+    if args.real:
+        command.append("--real")
+    rows = []
+    print(f"{'run':>4} {'process':>8} {'import':>8} {'ready':>8} {'/start':>8} {'index':>8}  heavy")
+    for run in range(args.runs):
+        started = time.perf_counter()
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        process = time.perf_counter() - started
+        row = orjson.loads(output.strip().splitlines()[-1])
+        row["process"] = process
+        rows.append(row)
+        print(
+            f"{run + 1:>4} {process:>8.2f} {row['import']:>8.2f} {row['ready']:>8.2f} "
+            f"{row['start']:>8.2f} {row['index']:>8.2f}  {','.join(row['heavy']) or '-'}"
+        )
+    if len(rows) > 1:
+        # первый запуск собирает индекс, медиана - по остальным
+        warm = rows[1:]
+        print(
+            f"{'med':>4} {statistics.median(r['process'] for r in warm):>8.2f} "
+            f"{statistics.median(r['import'] for r in warm):>8.2f} "
+            f"{statistics.median(r['ready'] for r in warm):>8.2f} "
+            f"{statistics.median(r['start'] for r in warm):>8.2f} "
+            f"{statistics.median(r['index'] for r in warm):>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""Локальный HTTPS заменитель GigaChat API для проверки общего клиента (src.client_pool).
+
+Отвечает на /api/v2/oauth, /api/v1/chat/completions (в том числе потоково) и
+/api/v1/embeddings и считает выданные токены, TLS соединения и запросы. Проверка
+отправляет одновременные запросы чата и эмбеддингов через PooledGigaChat и
+PooledGigaChatEmbeddings и выводит, сколько соединений и токенов понадобилось.
+
+    python -m benchmarks.gigachat_stub --requests 200 --token-ttl 30
+    python -m benchmarks.gigachat_stub --serve --port 8443
+
+Для сертификата нужна утилита openssl.
+"""
+
+import argparse
+import asyncio
+import pathlib
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import orjson
+
+
+def make_certificate(directory: pathlib.Path):
+    cert, key = directory / "stub.pem", directory / "stub.key"
+    subprocess.run(
+        [
+            "openssl",
+            "req",
+            "-x509",
+            "-newkey",
+            "rsa:2048",
+            "-nodes",
+            "-days",
+            "1",
+            "-subj",
+            "/CN=127.0.0.1",
+            "-keyout",
+            str(key),
+            "-out",
+            str(cert),
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return cert, key
+
+
+class StubState:
+    def __init__(self, token_ttl: float, latency: float):
+        self.token_ttl = token_ttl
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.tokens = 0
+        self.connections = 0
+        self.requests = 0
+
+    def count(self, name: str):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self):
+        return {"tokens": self.tokens, "connections": self.connections, "requests": self.requests}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    state: StubState
+
+    def setup(self):
+        super().setup()
+        self.state.count("connections")
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = orjson.dumps(payload)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self._send_json(self.state.snapshot())
+        else:
+            self._send_json({"message": "not found"}, 404)
+
+    def do_POST(self):
+        body = self._read_body()
+        if self.path.endswith("/oauth"):
+            self.state.count("tokens")
+            expires_at = int((time.time() + self.state.token_ttl) * 1000)
+            self._send_json({"access_token": uuid.uuid4().hex, "expires_at": expires_at})
+            return
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            self._send_json({"status": 401, "message": "Unauthorized"}, 401)
+            return
+        self.state.count("requests")
+        time.sleep(self.state.latency)
+        payload = orjson.loads(body or b"{}")
+        if self.path.endswith("/embeddings"):
+            self._embeddings(payload)
+        elif self.path.endswith("/chat/completions"):
+            self._chat(payload)
+        else:
+            self._send_json({"message": "not found"}, 404)
+
+    def _embeddings(self, payload):
+        data = []
+        for i, text in enumerate(payload.get("input") or []):
+            seed = zlib.crc32(text.encode("utf-8"))
+            vector = [((seed >> (j % 24)) & 0xFF) / 255 for j in range(64)]
+            data.append(
+                {
+                    "object": "embedding",
+                    "embedding": vector,
+                    "index": i,
+                    "usage": {"prompt_tokens": len(text) // 3},
+                }
+            )
+        self._send_json({"object": "list", "data": data, "model": payload.get("model")})
+
+    def _chat(self, payload):
+        question = (payload.get("messages") or [{}])[-1].get("content", "")
+        text = f"Ответ заменителя GigaChat на: {question[:100]}"
+        usage = {"prompt_tokens": len(question) // 3, "completion_tokens": len(text) // 3}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        common = {"created": int(time.time()), "model": payload.get("model") or "GigaChat"}
+        if not payload.get("stream"):
+            self._send_json(
+                {
+                    **common,
+                    "object": "chat.completion",
+                    "choices": [
+                        {
+                            "index": 0,
+                            "finish_reason": "stop",
+                            "message": {"role": "assistant", "content": text},
+                        }
+                    ],
+                    "usage": usage,
+                }
+            )
+            return
+        events = [
+            {
+                **common,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "delta": {"role": "assistant", "content": word + " "}}],
+            }
+            for word in text.split(" ")
+        ]
+        events[-1]["choices"][0]["finish_reason"] = "stop"
+        events[-1]["usage"] = usage
+        body = b"".join(b"data: " + orjson.dumps(e) + b"\n\n" for e in events) + b"data: [DONE]\n\n"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_stub(host: str, port: int, state: StubState, cert, key) -> ThreadingHTTPServer:
+    handler = type("Handler", (StubHandler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(str(cert), str(key))
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, name="gigachat-stub", daemon=True).start()
+    return server
+
+
+async def check(base: str, requests: int, token_ttl: float) -> dict:
+    from langchain_core.messages import HumanMessage
+
+    from src.client_pool import POOL, PooledGigaChat, PooledGigaChatEmbeddings
+
+    options = {
+        "base_url": f"{base}/api/v1",
+        "auth_url": f"{base}/api/v2/oauth",
+        "credentials": "c3R1YjpzdHVi",
+        "scope": "GIGACHAT_API_CORP",
+        "verify_ssl_certs": False,
+        "timeout": 30.0,
+    }
+    chat = PooledGigaChat(stand="stub", model="GigaChat-Pro", **options)
+    embeddings = PooledGigaChatEmbeddings(stand="stub", **options)
+    # _client - обертки со своим таймаутом вокруг общего клиента пула
+    assert chat._client.client is embeddings._client.client, "чат и эмбеддинги должны делить клиент"
+
+    async def one(i: int):
+        if i % 2:
+            await embeddings.aembed_query(f"вопрос {i}")
+        else:
+            await chat.ainvoke([HumanMessage(content=f"вопрос {i}")])
+
+    started = time.perf_counter()
+    # вторая половина запросов идет, когда токену осталось жить меньше refresh_ahead
+    await asyncio.gather(*(one(i) for i in range(requests // 2)))
+    await asyncio.sleep(max(0.0, token_ttl - chat._client.refresh_ahead + 0.5))
+    await asyncio.gather(*(one(i) for i in range(requests // 2, requests)))
+    await asyncio.sleep(0.5)  # фоновое обновление токена
+    elapsed = time.perf_counter() - started
+    token_updates = chat._client.token_updates
+    await POOL.aclose()
+    return {"seconds": elapsed, "client_token_updates": token_updates}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.05, help="сек. на ответ")
+    parser.add_argument("--token-ttl", type=float, default=30.0, help="сек. жизни токена")
+    parser.add_argument("--serve", action="store_true", help="только запустить заменитель")
+    args = parser.parse_args(argv)
+
+    cert, key = make_certificate(pathlib.Path(tempfile.mkdtemp(prefix="gigachat-stub-")))
+    state = StubState(args.token_ttl, args.latency)
+    server = start_stub(args.host, args.port, state, cert, key)
+    base = f"https://{args.host}:{server.server_address[1]}"
+    print(f"Заменитель GigaChat: {base}")
+    if args.serve:
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            return
+
+    import src.settings as config
+
+    # refresh_ahead меньше срока жизни токена, иначе токен обновлялся бы каждый запрос
+    config.GIGACHAT_TOKEN_REFRESH_AHEAD = min(
+        config.GIGACHAT_TOKEN_REFRESH_AHEAD, args.token_ttl / 2
+    )
+    result = asyncio.run(check(base, args.requests, args.token_ttl))
+    server.shutdown()
+    stats = state.snapshot()
+    print(
+        f"запросов: {stats['requests']}, TLS соединений: {stats['connections']} "
+        f"(лимит {config.GIGACHAT_MAX_CONNECTIONS}), токенов выдано: {stats['tokens']}, "
+        f"обновлений токена клиентом: {result['client_token_updates']}, "
+        f"время: {result['seconds']:.2f} сек."
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Микробенчмарк сериализации истории чата: serialize/deserialize против encode/decode.
+
+Для каждой длины истории замеряются разбор состояния в память, сохранение хода
+(serialize всей памяти против дописывания реплик append_messages) и размер
+состояния в pickle, как его хранит SQLitePersistence.
+
+    python -m benchmarks.history_serialization --turns 10 50 200 --repeat 200
+"""
+
+import argparse
+import pickle
+import timeit
+
+from src.memory_serialization import append_messages, decode, deserialize, encode, serialize
+
+
+def build_memory(turns: int):
+    from langchain.memory import ConversationBufferMemory
+
+    memory = ConversationBufferMemory(memory_key="history", input_key="question")
+    for i in range(turns):
+        memory.save_context(
+            {"question": f"Какая ставка по вкладу Лучший процент на {i + 1} мес.?"},
+            {"text": f"Ставка по вкладу Лучший процент на {i + 1} мес. - до 20% годовых. " * 3},
+        )
+    return memory
+
+
+def measure(turns: int, repeat: int) -> dict:
+    memory = build_memory(turns)
+    legacy, compact = serialize(memory), encode(memory)
+    new_turn = build_memory(turns + 1).chat_memory.messages[-2:]
+
+    def legacy_save():
+        restored = deserialize(legacy)
+        restored.chat_memory.messages.extend(new_turn)
+        return serialize(restored)
+
+    def compact_save():
+        decode(compact)
+        # копия, чтобы повторы не наращивали исходное состояние
+        return append_messages(dict(compact), new_turn)
+
+    def per_call(stmt) -> float:
+        return min(timeit.repeat(stmt, number=repeat, repeat=3)) / repeat * 1000
+
+    return {
+        "turns": turns,
+        "legacy_load": per_call(lambda: deserialize(legacy)),
+        "compact_load": per_call(lambda: decode(compact)),
+        "legacy_turn": per_call(legacy_save),
+        "compact_turn": per_call(compact_save),
+        "legacy_bytes": len(pickle.dumps(legacy, protocol=pickle.HIGHEST_PROTOCOL)),
+        "compact_bytes": len(pickle.dumps(compact, protocol=pickle.HIGHEST_PROTOCOL)),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    print(
+        f"{'turns':>6} {'load, ms':>18} {'turn, ms':>18} {'pickle, bytes':>20}\n"
+        f"{'':>6} {'legacy':>9}{'compact':>9} {'legacy':>9}{'compact':>9} "
+        f"{'legacy':>10}{'compact':>10}"
+    )
+    for turns in args.turns:
+        row = measure(turns, args.repeat)
+        print(
+            f"{turns:>6} {row['legacy_load']:>9.3f}{row['compact_load']:>9.3f} "
+            f"{row['legacy_turn']:>9.3f}{row['compact_turn']:>9.3f} "
+            f"{row['legacy_bytes']:>10}{row['compact_bytes']:>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""Нагрузочный прогон записанных вопросов без GigaChat и Telegram.
+
+Вопросы берутся из JSONL лога бота (deposit_bot.json) и задаются заменителям
+GigaChat из src.fakes (GigaSettings(stand="fake")). Каждый чат задает свои вопросы
+по очереди, чаты работают одновременно. Для каждого числа чатов выводятся
+пропускная способность, перцентили задержки ответа и память на чат.
+
+    python -m benchmarks.replay --log deposit_bot.json --chats 1,8,32
+    python -m benchmarks.replay --target bot --llm-latency 2 --limit 200
+
+--target helper - вызов DepositHelper.aget_answer с сохранением состояния чата,
+--target bot - обработчик bot.answer с заглушками Update и Bot.
+"""
+
+import argparse
+import asyncio
+import logging
+import pathlib
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+import orjson
+
+import src.settings as config
+from src import metrics
+from src.chat_state import ChatState
+from src.settings import GigaSettings
+
+
+def load_questions(path, limit: Optional[int] = None) -> List[str]:
+    questions = []
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                question = orjson.loads(line).get("question")
+            except orjson.JSONDecodeError:
+                continue
+            if question and not question.startswith("/"):
+                questions.append(question)
+                if limit and len(questions) >= limit:
+                    break
+    return questions
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))]
+
+
+class StubMessage:
+    def __init__(self, bot: "StubBot", text: str):
+        self.bot = bot
+        self.text = text
+
+    async def edit_text(self, text: str):
+        await asyncio.sleep(self.bot.latency)
+        self.text = text
+        self.bot.edits += 1
+
+    async def delete(self):
+        await asyncio.sleep(self.bot.latency)
+
+
+class StubBot:
+    """Заменитель telegram.Bot: только методы, которые вызывают обработчики."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.sent = 0
+        self.edits = 0
+
+    async def send_message(self, chat_id, text: str, **kwargs):
+        await asyncio.sleep(self.latency)
+        self.sent += 1
+        return StubMessage(self, text)
+
+
+class HelperTarget:
+    """Ответы через DepositHelper.aget_answer, состояние чата - как в боте."""
+
+    def __init__(self, giga_settings: GigaSettings):
+        self.settings = giga_settings
+
+    def new_chat(self, chat_id: int) -> Dict:
+        return {}
+
+    async def ask(self, chat_id: int, chat_data: Dict, question: str):
+        state = ChatState.load(chat_data)
+        helper = state.restore(self.settings.chat_model, self.settings.embeddings, chat_data)
+        await helper.aget_answer(question)
+        state.update(helper)
+        state.save(chat_data)
+
+
+class BotTarget:
+    """Ответы через обработчик bot.answer: кэш ответов, стриминг, повторы."""
+
+    def __init__(self, giga_settings: GigaSettings, telegram_latency: float):
+        import bot
+        from src.answer_cache import SemanticAnswerCache
+        from src.resilience import ResiliencePolicy
+
+        bot.settings = giga_settings
+        bot.policy = ResiliencePolicy.from_settings(giga_settings)
+        self.bot = bot
+        self.cache_factory = lambda: SemanticAnswerCache(giga_settings.embeddings)
+        self.telegram_latency = telegram_latency
+
+    def reset(self):
+        # у каждого прогона свой кэш ответов, иначе следующий прогон отвечает из кэша
+        self.bot.answer_cache = self.cache_factory()
+
+    def new_chat(self, chat_id: int) -> SimpleNamespace:
+        return SimpleNamespace(bot=StubBot(self.telegram_latency), chat_data={})
+
+    async def ask(self, chat_id: int, context: SimpleNamespace, question: str):
+        update = SimpleNamespace(
+            message=SimpleNamespace(
+                text=question,
+                from_user=SimpleNamespace(id=chat_id, username=f"bench{chat_id}"),
+            ),
+            effective_chat=SimpleNamespace(id=chat_id),
+        )
+        await self.bot.answer(update, context)
+
+
+async def run_level(target, questions: List[str], chats: int, trace_memory: bool) -> Dict:
+    if hasattr(target, "reset"):
+        target.reset()
+    # вопросы раздаются чатам по кругу, внутри чата задаются последовательно
+    per_chat = [questions[i::chats] for i in range(chats)]
+    latencies: List[float] = []
+    errors = 0
+
+    async def chat(chat_id: int, chat_questions: List[str]):
+        nonlocal errors
+        session = target.new_chat(chat_id)
+        for question in chat_questions:
+            start = time.perf_counter()
+            try:
+                await target.ask(chat_id, session, question)
+            except Exception as e:
+                errors += 1
+                logging.getLogger(__name__).debug("Ошибка в чате %d: %r", chat_id, e)
+                continue
+            latencies.append(time.perf_counter() - start)
+        return session
+
+    if trace_memory:
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    sessions = await asyncio.gather(*(chat(i + 1, q) for i, q in enumerate(per_chat)))
+    elapsed = time.perf_counter() - started
+    peak = retained = 0
+    if trace_memory:
+        current, peak = tracemalloc.get_traced_memory()
+        retained = current - baseline
+        peak -= baseline
+        tracemalloc.stop()
+    del sessions
+
+    ordered = sorted(latencies)
+    return {
+        "chats": chats,
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": elapsed,
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50": percentile(ordered, 0.50),
+        "p95": percentile(ordered, 0.95),
+        "p99": percentile(ordered, 0.99),
+        "peak_kib_per_chat": peak / 1024 / chats,
+        "retained_kib_per_chat": retained / 1024 / chats,
+    }
+
+
+def print_report(rows: List[Dict]):
+    header = (
+        f"{'chats':>6} {'req':>6} {'err':>4} {'sec':>8} {'req/s':>8} "
+        f"{'p50':>7} {'p95':>7} {'p99':>7} {'peak KiB/chat':>14} {'kept KiB/chat':>14}"
+    )
+    print(header)
+    for row in rows:
+        print(
+            f"{row['chats']:>6} {row['requests']:>6} {row['errors']:>4} {row['seconds']:>8.2f} "
+            f"{row['rps']:>8.2f} {row['p50']:>7.2f} {row['p95']:>7.2f} {row['p99']:>7.2f} "
+            f"{row['peak_kib_per_chat']:>14.1f} {row['retained_kib_per_chat']:>14.1f}"
+        )
+
+
+def print_stages():
+    """Среднее время этапов из src.metrics за все прогоны."""
+    print()
+    for name, histogram in sorted(metrics.REGISTRY.histograms.items()):
+        if name.endswith("_seconds") and histogram.count:
+            print(f"{name:<32} n={histogram.count:<6} avg={histogram.sum / histogram.count:.4f}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--log",
+        default=str(pathlib.Path(__file__).parent.parent / "deposit_bot.json"),
+        help="JSONL лог бота с вопросами",
+    )
+    parser.add_argument("--chats", default="1,4,16,64", help="числа одновременных чатов")
+    parser.add_argument("--target", choices=("helper", "bot"), default="helper")
+    parser.add_argument("--limit", type=int, default=None, help="не больше N вопросов")
+    parser.add_argument("--llm-latency", type=float, default=2.0, help="медиана, сек.")
+    parser.add_argument("--llm-latency-sigma", type=float, default=0.5)
+    parser.add_argument("--embeddings-latency", type=float, default=0.2, help="медиана, сек.")
+    parser.add_argument("--embeddings-latency-sigma", type=float, default=0.3)
+    parser.add_argument("--telegram-latency", type=float, default=0.05, help="сек.")
+    parser.add_argument("--no-memory", action="store_true", help="не считать память")
+    parser.add_argument(
+        "--workdir", default=None, help="каталог для индекса и кэшей (по умолчанию временный)"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    questions = load_questions(args.log, args.limit)
+    if not questions:
+        raise SystemExit(f"В {args.log} нет вопросов")
+
+    # индекс на заменителе эмбеддингов не должен попасть на место рабочего
+    workdir = pathlib.Path(args.workdir or tempfile.mkdtemp(prefix="deposit-bench-"))
+    config.INDEX_PATH = str(workdir / "index")
+    config.LOCAL_INDEX_PATH = str(workdir / "index" / "local")
+    config.EMBEDDINGS_CACHE_PATH = str(workdir / "embeddings.sqlite")
+    config.INGEST_CACHE_PATH = str(workdir / "index" / "parsed")
+    config.PERSISTENCE_PATH = str(workdir / "storage.sqlite")
+
+    giga_settings = GigaSettings(
+        stand="fake",
+        fake_llm_latency=args.llm_latency,
+        fake_llm_latency_sigma=args.llm_latency_sigma,
+        fake_embeddings_latency=args.embeddings_latency,
+        fake_embeddings_latency_sigma=args.embeddings_latency_sigma,
+    )
+    from src.rag import RAG
+
+    # сборка индекса и цепочки не входит в замер
+    RAG.get_chain(giga_settings.chat_model, giga_settings.embeddings)
+    if args.target == "bot":
+        target = BotTarget(giga_settings, args.telegram_latency)
+    else:
+        target = HelperTarget(giga_settings)
+
+    print(f"{len(questions)} вопросов, target={args.target}, workdir={workdir}")
+    levels = [int(n) for n in args.chats.split(",")]
+
+    async def run_all():
+        # один цикл событий на все прогоны: фоновые задачи (сводка истории,
+        # батчи эмбеддингов) привязаны к циклу
+        return [await run_level(target, questions, n, not args.no_memory) for n in levels]
+
+    print_report(asyncio.run(run_all()))
+    print_stages()
+
+
+if __name__ == "__main__":
+    main()
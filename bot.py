@@ -1,56 +1,105 @@
+import asyncio
 import logging
-import pathlib
-import json
-from datetime import datetime
+import sys
+import time
+from typing import List, Optional
 
 from telegram import Update
+from telegram.error import RetryAfter, TelegramError
 from telegram.ext import (
     ApplicationBuilder,
     ContextTypes,
     CommandHandler,
     MessageHandler,
     filters,
-    PicklePersistence,
 )
 
+import src.settings as config
+from src import metrics
+from src.answer_cache import SemanticAnswerCache
+from src.chat_state import ChatState, reset_chat
 from src.deposit_helper import DepositHelper
+from src.embeddings_cache import normalize_text
+from src.json_logging import setup_json_logging
+from src.persistence import SQLitePersistence
+from src.rag import RAG
+from src.resilience import EmptyAnswerError, ResiliencePolicy
 from src.settings import GigaSettings, TG_TOKEN
+from src.single_flight import SingleFlight
+from src.update_processor import ChatOrderedUpdateProcessor
 
 
-class JsonLogFormatter(logging.Formatter):
-    def format(self, record):
-        log_record = {
-            "time": datetime.utcnow().isoformat(),
-            "username": getattr(record, "username", None),
-            "user_id": getattr(record, "user_id", None),
-            "question": getattr(record, "question", None),
-            "answer": getattr(record, "answer", None),
-        }
-        return json.dumps(log_record, ensure_ascii=False)
-
-
-json_handler = logging.FileHandler(
-    str(pathlib.Path(__file__).parent / "deposit_bot.json"),
-    mode="w",
-    encoding="UTF-8",
-)
-json_handler.setFormatter(JsonLogFormatter())
+def setup_logging():
+    # только при запуске бота: процессы разбора документов (src.ingestion, spawn)
+    # импортируют этот модуль заново и не должны открывать лог вопросов
+    json_handler = setup_json_logging(config.JSON_LOG_PATH)
+    logging.basicConfig(
+        level=logging.WARN,
+        force=True,
+        handlers=[json_handler, logging.StreamHandler()],
+    )
 
-logging.basicConfig(
-    level=logging.WARN,
-    force=True,
-    handlers=[json_handler, logging.StreamHandler()],
-)
 
 _logger = logging.getLogger(__name__)
 _logger.setLevel(logging.INFO)
 
+# клиенты GigaChat создаются при первом обращении, см. GigaSettings
 settings = GigaSettings()
+answer_cache: Optional[SemanticAnswerCache] = None
+policy = ResiliencePolicy.from_settings(settings)
+single_flight = SingleFlight()
+index_warmup: Optional[asyncio.Future] = None
+
+TECHNICAL_ERROR_TEXT = "Возникла техническая ошибка. Повторите запрос, пожалуйста."
+
+
+def build_chain():
+    start = time.perf_counter()
+    RAG.get_chain(settings.chat_model, settings.embeddings)
+    elapsed = time.perf_counter() - start
+    metrics.observe("index_warmup_seconds", elapsed)
+    _logger.info("Индекс и цепочка готовы за %.2f сек.", elapsed)
+
+
+async def warm_up(application=None):
+    """Собирает индекс в фоновом потоке: бот уже отвечает на /start и /clear,
+    а вопросы ждут готовности индекса в wait_for_index."""
+    global answer_cache, index_warmup
+    if answer_cache is None:
+        answer_cache = SemanticAnswerCache(settings.embeddings)
+    index_warmup = asyncio.get_running_loop().run_in_executor(None, build_chain)
+
+
+async def close_clients(application=None):
+    """Закрывает соединения общих клиентов GigaChat, если они создавались."""
+    client_pool = sys.modules.get("src.client_pool")
+    if client_pool is not None:
+        await client_pool.POOL.aclose()
+
+
+async def wait_for_index(attempts: int = 2):
+    """Ждет фоновой сборки индекса. Неудачная сборка запускается заново тоже в
+    потоке: на цикле событий она остановила бы все чаты."""
+    global index_warmup
+    for _ in range(attempts):
+        warmup = index_warmup
+        if warmup is None:
+            return
+        if not warmup.done():
+            with metrics.timer("index_wait_seconds"):
+                await asyncio.wait([warmup])
+        if warmup.exception() is None:
+            if index_warmup is warmup:
+                index_warmup = None
+            return
+        if index_warmup is warmup:
+            _logger.error("Не удалось собрать индекс в фоне: %r", warmup.exception())
+            index_warmup = asyncio.get_running_loop().run_in_executor(None, build_chain)
+    raise RuntimeError("Индекс не собран")
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    giga = DepositHelper(settings.chat_model, settings.embeddings)
-    context.chat_data["giga"] = giga
+    reset_chat(context.chat_data)
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
         text="Привет!\n"
@@ -61,36 +110,206 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def clear(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    giga = DepositHelper(settings.chat_model, settings.embeddings)
-    context.chat_data["giga"] = giga
+    reset_chat(context.chat_data)
     await context.bot.send_message(chat_id=update.effective_chat.id, text="Контекст сброшен.")
 
 
+TG_MESSAGE_LIMIT = 4096
+
+
+def split_message(text: str, limit: int = TG_MESSAGE_LIMIT) -> List[str]:
+    """Части текста не длиннее limit, по границе строки или слова, если она есть.
+
+    Разрез зависит только от первых limit символов, поэтому при дописывании текста
+    уже отправленные части не меняются.
+    """
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = text.rfind(" ", 0, limit)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip()
+    if text or not parts:
+        parts.append(text)
+    return parts
+
+
+async def send_long_message(context: ContextTypes.DEFAULT_TYPE, chat_id: int, text: str):
+    for part in split_message(text):
+        await context.bot.send_message(chat_id=chat_id, text=part)
+
+
+async def stream_answer(update: Update, context: ContextTypes.DEFAULT_TYPE, giga, question):
+    """Показывает ответ по мере генерации, правя сообщение не чаще раза в интервал.
+
+    Текст длиннее лимита Telegram продолжается в следующих сообщениях. Ошибки Telegram
+    не прерывают генерацию: правка пропускается, а после RetryAfter следующие правки
+    ждут указанное время. Возвращает полный ответ и признак того, что он показан целиком;
+    если последняя правка не удалась, черновики удаляются и ответ нужно отправить заново.
+    При ошибке модели или отмене черновики удаляются, а исключение передается дальше,
+    в политику повторов.
+    """
+    chat_id = update.effective_chat.id
+    messages = []
+    shown = []
+    paused_until = 0.0
+
+    async def show(text: str):
+        for i, part in enumerate(split_message(text)):
+            if i == len(messages):
+                messages.append(await context.bot.send_message(chat_id=chat_id, text=part))
+                shown.append(part)
+            elif part != shown[i]:
+                await messages[i].edit_text(part)
+                shown[i] = part
+
+    async def try_show(text: str) -> bool:
+        nonlocal paused_until
+        try:
+            with metrics.timer("telegram_send_seconds"):
+                await show(text)
+        except RetryAfter as e:
+            paused_until = time.monotonic() + e.retry_after
+            _logger.warning("Правка ответа отложена на %s с: %s", e.retry_after, e)
+            return False
+        except TelegramError as e:
+            _logger.warning("Не удалось обновить ответ: %s", e)
+            return False
+        return True
+
+    async def delete_drafts():
+        for message in messages:
+            try:
+                await message.delete()
+            except Exception:
+                pass
+
+    text = ""
+    await try_show(config.STREAM_PLACEHOLDER)
+    last_edit = time.monotonic()
+    try:
+        async for chunk in giga.astream_answer(question):
+            text += chunk
+            now = time.monotonic()
+            if (
+                now - last_edit >= config.STREAM_EDIT_INTERVAL
+                and now >= paused_until
+                and text.strip()
+            ):
+                await try_show(text)
+                last_edit = now
+        if not text.strip():
+            raise EmptyAnswerError()
+    except BaseException:
+        await delete_drafts()
+        raise
+    # последняя правка обязательна: дожидаемся конца паузы Telegram
+    delay = paused_until - time.monotonic()
+    if delay > 0:
+        await asyncio.sleep(delay)
+    if await try_show(text):
+        return text, True
+    await delete_drafts()
+    return text, False
+
+
 async def answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    with metrics.timer("answer_seconds"):
+        await _answer(update, context)
+
+
+async def _answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    started = time.monotonic()
     user = update.message.from_user
     question = update.message.text
 
-    giga: DepositHelper = context.chat_data.get("giga") or DepositHelper(
-        settings.chat_model, settings.embeddings
-    )
+    try:
+        await wait_for_index()
+    except RuntimeError:
+        await send_long_message(context, update.effective_chat.id, TECHNICAL_ERROR_TEXT)
+        return
+    state = ChatState.load(context.chat_data)
+    giga: DepositHelper = state.restore(settings.chat_model, settings.embeddings, context.chat_data)
 
-    attempt = 0
-    result = None
-    while not result and attempt < 3:
-        try:
-            result = await giga.aget_answer(question)
-        except Exception as e:
+    retries = 0
+    first_turn = giga.is_new_conversation()
+    # вопросы о доходе с суммой и сроком считаются локально, без RAG
+    result = await giga.acalculate(question)
+    from_calculator = bool(result)
+    semantic = True
+    if not result and first_turn:
+        # если документы находятся по одному BM25, эмбеддинг вопроса не нужен и кэшу ответов
+        semantic = not RAG.is_lexically_decisive(question)
+        result = await answer_cache.aget(question, RAG.get_corpus_hash(), semantic)
+        metrics.inc("answer_cache_hits_total" if result else "answer_cache_misses_total")
+        if result:
+            giga.remember(question, result)
+            _logger.debug("Ответ из кэша, статистика: %s", answer_cache.stats())
+    from_cache = bool(result) and not from_calculator
+    streamed = shared = False
+
+    stream_first = config.STREAM_ANSWERS
+
+    async def upstream():
+        nonlocal giga
+
+        # каждая попытка со своей копией истории: при дублировании запроса
+        # попытки идут параллельно и не должны писать в одну память.
+        # Первая попытка показывает ответ потоково, под тем же сроком и размыкателем
+        async def attempt():
+            nonlocal stream_first, streamed
+            helper = state.restore(settings.chat_model, settings.embeddings, context.chat_data)
+            if stream_first:
+                stream_first = False
+                # ошибки Telegram не повторяют запрос к модели: если ответ не удалось
+                # показать потоково, он уходит обычными сообщениями
+                text, streamed = await stream_answer(update, context, helper, question)
+                return helper, text
+            text = await helper.aget_answer(question)
+            if not text:
+                raise EmptyAnswerError()
+            return helper, text
+
+        def on_retry(attempt_number, e):
+            nonlocal retries
+            retries += 1
             _logger.error(
                 "Ошибка при попытке %d для пользователя %s: %s",
-                attempt + 1,
+                attempt_number + 1,
                 user.username,
                 e,
             )
-            attempt += 1
 
-    context.chat_data["giga"] = giga
-    result = result or "Возникла техническая ошибка. Повторите запрос, пожалуйста."
-    if attempt > 0:
+        try:
+            giga, text = await policy.run(attempt, on_retry=on_retry)
+        except Exception as e:
+            _logger.error("Не удалось получить ответ для пользователя %s: %r", user.username, e)
+            return None
+        return text
+
+    if not result and first_turn and config.SINGLE_FLIGHT:
+        # одинаковые первые вопросы из разных чатов ждут один ответ модели
+        key = f"{RAG.get_corpus_hash()}\0{normalize_text(question)}"
+        # чужой ответ ждем не дольше собственного срока запроса к модели
+        timeout = policy.deadline - (time.monotonic() - started)
+        try:
+            result, shared = await single_flight.run(key, upstream, timeout=timeout)
+        except asyncio.TimeoutError:
+            _logger.error("Не дождались общего ответа для пользователя %s", user.username)
+        if shared and result:
+            giga.remember(question, result)
+    elif not result:
+        result = await upstream()
+
+    state.update(giga)
+    state.save(context.chat_data)
+    if result and first_turn and not (from_cache or from_calculator or shared):
+        await answer_cache.aput(question, result, RAG.get_corpus_hash(), semantic)
+    result = result or TECHNICAL_ERROR_TEXT
+    if retries > 0:
         result = "Простите, что заставил ждать. " + result
 
     _logger.info(
@@ -102,7 +321,9 @@ async def answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "answer": result,
         },
     )
-    await context.bot.send_message(chat_id=update.effective_chat.id, text=result)
+    if not streamed:
+        with metrics.timer("telegram_send_seconds"):
+            await send_long_message(context, update.effective_chat.id, result)
 
 
 async def unknown(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -113,13 +334,19 @@ async def unknown(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
-my_persistence = PicklePersistence(
-    filepath=str(pathlib.Path(__file__).parent.parent.parent / "storage")
-)
+my_persistence = SQLitePersistence()
 
 if __name__ == "__main__":
+    setup_logging()
+    metrics.start_metrics_server(config.METRICS_HOST, config.METRICS_PORT)
     application = (
-        ApplicationBuilder().token(TG_TOKEN).persistence(persistence=my_persistence).build()
+        ApplicationBuilder()
+        .token(TG_TOKEN)
+        .persistence(persistence=my_persistence)
+        .concurrent_updates(ChatOrderedUpdateProcessor())
+        .post_init(warm_up)
+        .post_shutdown(close_clients)
+        .build()
     )
 
     application.add_handler(CommandHandler("start", start))
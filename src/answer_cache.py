@@ -0,0 +1,146 @@
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from logging import getLogger
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+import src.settings as settings
+from src.embeddings_cache import normalize_text
+
+_logger = getLogger(__name__)
+
+# числа с разделителями разрядов: "100 000", "1,5"
+_NUMBER = re.compile(r"\d+(?:[ \u00a0\u202f]\d{3})*(?:[.,]\d+)?")
+
+
+def question_numbers(question: str) -> Tuple[str, ...]:
+    """Числа вопроса: суммы, сроки и ставки, от которых зависит ответ."""
+    return tuple(sorted(re.sub(r"\s", "", n).replace(",", ".") for n in _NUMBER.findall(question)))
+
+
+@dataclass
+class CachedAnswer:
+    question: str
+    answer: str
+    vector: Optional[np.ndarray]
+    created: float
+    numbers: Tuple[str, ...] = ()
+
+
+class SemanticAnswerCache:
+    """Кэш ответов на первые вопросы диалога с поиском по близости эмбеддингов.
+
+    Записи привязаны к версии корпуса (хэшу индекса): при смене документов кэш
+    сбрасывается целиком. Близкий вопрос подходит, только если числа в нем те же:
+    "вклад на 6 месяцев" и "вклад на 12 месяцев" отличаются одним словом, а ответы разные.
+
+    С semantic=False эмбеддинг вопроса не вычисляется, а запись находится только
+    по точному (нормализованному) тексту вопроса.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        threshold: float = None,
+        ttl: float = None,
+        max_size: int = None,
+    ):
+        self.embeddings = embeddings
+        self.threshold = settings.ANSWER_CACHE_THRESHOLD if threshold is None else threshold
+        self.ttl = settings.ANSWER_CACHE_TTL if ttl is None else ttl
+        self.max_size = max_size or settings.ANSWER_CACHE_SIZE
+        self.version: Optional[str] = None
+        self.hits = 0
+        self.misses = 0
+
+        self._entries: "OrderedDict[str, CachedAnswer]" = OrderedDict()
+        self._matrix: Optional[np.ndarray] = None
+        self._keys: list = []
+
+    def _check_version(self, version: Optional[str]):
+        if version != self.version:
+            if self._entries:
+                _logger.info("Корпус изменился, кэш ответов сброшен (%s записей)", len(self))
+            self.clear()
+            self.version = version
+
+    def _evict(self):
+        now = time.time()
+        expired = [k for k, e in self._entries.items() if now - e.created > self.ttl]
+        for key in expired:
+            del self._entries[key]
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        self._matrix = None
+
+    def _search(self, vector: np.ndarray, numbers: Tuple[str, ...]) -> Optional[str]:
+        if not self._entries:
+            return None
+        if self._matrix is None:
+            self._keys = [k for k, e in self._entries.items() if e.vector is not None]
+            if not self._keys:
+                return None
+            self._matrix = np.stack([self._entries[k].vector for k in self._keys])
+        scores = self._matrix @ vector
+        for index in np.argsort(-scores):
+            if scores[index] < self.threshold:
+                break
+            key = self._keys[int(index)]
+            if self._entries[key].numbers == numbers:
+                return key
+        return None
+
+    async def aget(
+        self, question: str, version: Optional[str] = None, semantic: bool = True
+    ) -> Optional[str]:
+        self._check_version(version)
+        key = normalize_text(question)
+        if key not in self._entries and semantic:
+            vector = _normalize(await self.embeddings.aembed_query(question))
+            key = self._search(vector, question_numbers(question))
+
+        entry = self._entries.get(key) if key else None
+        if entry is not None and time.time() - entry.created > self.ttl:
+            self._evict()
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        _logger.debug("Ответ из кэша для %r (совпал с %r)", question, entry.question)
+        return entry.answer
+
+    async def aput(
+        self, question: str, answer: str, version: Optional[str] = None, semantic: bool = True
+    ):
+        self._check_version(version)
+        vector = _normalize(await self.embeddings.aembed_query(question)) if semantic else None
+        key = normalize_text(question)
+        self._entries[key] = CachedAnswer(
+            question, answer, vector, time.time(), question_numbers(question)
+        )
+        self._entries.move_to_end(key)
+        self._evict()
+
+    def clear(self):
+        self._entries.clear()
+        self._matrix = None
+        self._keys = []
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self), "hits": self.hits, "misses": self.misses}
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _normalize(vector) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
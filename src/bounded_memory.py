@@ -0,0 +1,150 @@
+import asyncio
+import threading
+from logging import getLogger
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain.memory import ConversationBufferMemory
+from langchain_core.messages import BaseMessage, get_buffer_string
+
+import src.settings as settings
+
+_logger = getLogger(__name__)
+
+# грубая оценка без обращения к API: для русского текста ~3 символа на токен
+CHARS_PER_TOKEN = 3
+
+SUMMARY_PROMPT = """Дополни краткое содержание разговора клиента с финансовым помощником новыми репликами.
+Сохрани суммы, сроки, названия вкладов и счетов, а также вопросы клиента. Пиши кратко.
+
+Текущее краткое содержание:
+{summary}
+
+Новые реплики:
+{new_lines}
+
+Новое краткое содержание:"""
+
+
+# сводка считается вне запроса: колбэки (в том числе стриминг ответа) не наследуем
+_DETACHED = {"callbacks": []}
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+class SummaryBufferMemory(ConversationBufferMemory):
+    """История с ограничением по токенам: последние реплики дословно, старые - в сводке.
+
+    Сводка пересчитывается в фоне после ответа, поэтому размер промпта и время
+    ответа не растут с длиной диалога.
+    """
+
+    moving_summary_buffer: str = ""
+    max_token_limit: int = settings.MEMORY_MAX_TOKENS
+    keep_last_turns: int = settings.MEMORY_KEEP_TURNS
+
+    # не поля модели: gigachain-core из requirements.txt подменяет langchain_core
+    # версией на pydantic v1, где PrivateAttr из pydantic v2 не действует, поэтому
+    # значения пишутся мимо проверки полей, см. _set_private
+    _llm: Any = None
+    _fold_task: Any = None
+    _fold_listener: Optional[Callable[[str, List[BaseMessage]], None]] = None
+
+    def _set_private(self, name: str, value: Any):
+        object.__setattr__(self, name, value)
+
+    def bind_llm(self, llm):
+        self._set_private("_llm", llm)
+
+    def set_fold_listener(self, listener: Callable[[str, List[BaseMessage]], None]):
+        """listener(summary, folded) вызывается после переноса реплик в сводку."""
+        self._set_private("_fold_listener", listener)
+
+    @property
+    def fold_task(self):
+        return self._fold_task
+
+    def _recent_messages(self) -> List[BaseMessage]:
+        messages = self.chat_memory.messages[-self.keep_last_turns * 2 :]
+        budget = self.max_token_limit - estimate_tokens(self.moving_summary_buffer)
+        tokens = [estimate_tokens(m.content) for m in messages]
+        while len(messages) > 2 and sum(tokens) > budget:
+            messages, tokens = messages[1:], tokens[1:]
+        return messages
+
+    @property
+    def buffer_as_messages(self) -> List[BaseMessage]:
+        return self._recent_messages()
+
+    @property
+    def buffer_as_str(self) -> str:
+        history = get_buffer_string(
+            self._recent_messages(), human_prefix=self.human_prefix, ai_prefix=self.ai_prefix
+        )
+        if self.moving_summary_buffer:
+            return (
+                f"Краткое содержание предыдущего разговора: {self.moving_summary_buffer}\n{history}"
+            )
+        return history
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        super().save_context(inputs, outputs)
+        self.schedule_fold()
+
+    def schedule_fold(self):
+        """Запускает перенос реплик за пределами окна в сводку, не дожидаясь результата."""
+        excess = len(self.chat_memory.messages) - self.keep_last_turns * 2
+        if excess <= 0 or self._llm is None:
+            return
+        if self._fold_task is not None and not self._fold_task.done():
+            return
+        folded = list(self.chat_memory.messages[:excess])
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is not None:
+            self._set_private("_fold_task", loop.create_task(self._afold(folded)))
+        else:
+            thread = threading.Thread(target=self._fold, args=(folded,), daemon=True)
+            thread.start()
+
+    def _prompt(self, folded: List[BaseMessage]) -> str:
+        new_lines = get_buffer_string(
+            folded, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix
+        )
+        return SUMMARY_PROMPT.format(summary=self.moving_summary_buffer, new_lines=new_lines)
+
+    def _apply(self, summary: str, folded: List[BaseMessage]):
+        messages = self.chat_memory.messages
+        if messages[: len(folded)] == folded:
+            self.chat_memory.messages = messages[len(folded) :]
+            self.moving_summary_buffer = summary
+        if self._fold_listener is not None:
+            self._fold_listener(summary, folded)
+
+    def _fold(self, folded: List[BaseMessage]):
+        try:
+            summary = self._llm.invoke(self._prompt(folded), config=_DETACHED).content
+        except Exception as e:
+            _logger.warning("Не удалось обновить сводку разговора: %s", e)
+            return
+        self._apply(summary, folded)
+
+    async def _afold(self, folded: List[BaseMessage]):
+        try:
+            summary = (await self._llm.ainvoke(self._prompt(folded), config=_DETACHED)).content
+        except Exception as e:
+            _logger.warning("Не удалось обновить сводку разговора: %s", e)
+            return
+        self._apply(summary, folded)
+
+
+def create_memory(llm=None) -> ConversationBufferMemory:
+    options = {"memory_key": "history", "input_key": "question", "output_key": "text"}
+    if settings.MEMORY_MODE == "summary":
+        memory = SummaryBufferMemory(**options)
+        memory.bind_llm(llm)
+        return memory
+    return ConversationBufferMemory(**options)
@@ -0,0 +1,81 @@
+# состояние чата в persistence хранится только в простых типах:
+# история сообщений и несколько флагов, без объектов цепочек и клиентов LLM
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, MutableMapping
+
+from langchain_core.messages import BaseMessage
+
+from src.deposit_helper import DepositHelper
+from src.memory_serialization import append_messages, decode, drop_turns, encode, read_turns
+
+STATE_KEY = "state"
+STATE_VERSION = 1
+
+
+@dataclass
+class ChatState:
+    memory: Dict[str, Any] = field(default_factory=dict)
+    turns: int = 0
+    version: int = STATE_VERSION
+
+    @classmethod
+    def load(cls, chat_data: MutableMapping) -> "ChatState":
+        raw = chat_data.get(STATE_KEY)
+        if raw:
+            return cls(**raw)
+
+        # чаты, сохраненные до перехода на компактное состояние
+        legacy = chat_data.pop("giga", None)
+        if legacy is not None and getattr(legacy, "memory", None) is not None:
+            return cls(memory=encode(legacy.memory))
+        return cls()
+
+    def save(self, chat_data: MutableMapping):
+        chat_data[STATE_KEY] = asdict(self)
+
+    def restore(self, llm, embeddings, chat_data: MutableMapping = None) -> DepositHelper:
+        """Собирает помощника для одного запроса вокруг общих llm и ретривера.
+
+        Если передан chat_data, сводка истории, досчитанная в фоне уже после ответа,
+        будет записана прямо в сохраненное состояние чата.
+        """
+        helper = DepositHelper(llm, embeddings, memory=decode(self.memory))
+        if chat_data is not None and hasattr(helper.memory, "set_fold_listener"):
+            helper.memory.set_fold_listener(
+                lambda summary, folded: apply_fold(chat_data, summary, folded)
+            )
+        return helper
+
+    def update(self, helper: DepositHelper):
+        memory = helper.memory
+        messages = memory.chat_memory.messages
+        known = self.memory.get("count") if self.memory else None
+        summary = getattr(memory, "moving_summary_buffer", None)
+        if (
+            known is not None
+            and len(messages) >= known
+            and summary == self.memory.get("moving_summary_buffer")
+        ):
+            # помощник собран из этого состояния: дописываем только реплики этого хода
+            self.memory = append_messages(self.memory, messages[known:])
+        else:
+            self.memory = encode(memory)
+        self.turns += 1
+
+
+def apply_fold(chat_data: MutableMapping, summary: str, folded: List[BaseMessage]):
+    state = ChatState.load(chat_data)
+    if not state.memory:
+        return
+    turns = read_turns(state.memory)
+    # чат мог быть сброшен или уже свернут, пока считалась сводка
+    if [content for _, content, _ in turns[: len(folded)]] != [m.content for m in folded]:
+        return
+    state.memory = drop_turns(state.memory, len(folded))
+    state.memory["moving_summary_buffer"] = summary
+    state.save(chat_data)
+
+
+def reset_chat(chat_data: MutableMapping):
+    chat_data.pop("giga", None)
+    ChatState().save(chat_data)
@@ -0,0 +1,275 @@
+import asyncio
+import importlib.util
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import cached_property
+from logging import getLogger
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Tuple
+
+import httpx
+from gigachat import GigaChat as GigaChatClient
+from langchain_community.chat_models.gigachat import GigaChat
+from langchain_community.embeddings.gigachat import GigaChatEmbeddings
+
+import src.settings as settings
+from src import metrics
+
+_logger = getLogger(__name__)
+
+# параметры соединения клиента SDK: по ним клиенты делятся между моделями стенда;
+# модель передается в каждом запросе, таймаут - свой у каждой модели (request_timeout)
+CLIENT_OPTIONS = (
+    "base_url",
+    "auth_url",
+    "credentials",
+    "scope",
+    "access_token",
+    "user",
+    "password",
+    "verify_ssl_certs",
+    "ca_bundle_file",
+    "cert_file",
+    "key_file",
+    "key_file_password",
+)
+
+_request_timeout: ContextVar[Optional[float]] = ContextVar("gigachat_request_timeout", default=None)
+
+
+@contextmanager
+def request_timeout(timeout: Optional[float]):
+    """Таймаут HTTP запросов общего клиента в пределах блока; None - таймаут клиента."""
+    previous = _request_timeout.get()
+    _request_timeout.set(timeout)
+    try:
+        yield
+    finally:
+        # set, а не reset: асинхронный генератор могут закрыть в другом контексте
+        _request_timeout.set(previous)
+
+
+def _apply_request_timeout(request: httpx.Request):
+    timeout = _request_timeout.get()
+    if timeout is not None:
+        request.extensions["timeout"] = httpx.Timeout(timeout).as_dict()
+
+
+async def _aapply_request_timeout(request: httpx.Request):
+    _apply_request_timeout(request)
+
+
+def http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+class SharedGigaChatClient(GigaChatClient):
+    """Клиент GigaChat SDK с настраиваемым пулом соединений и общим токеном.
+
+    Токен обновляется заранее, за refresh_ahead секунд до истечения, в фоне;
+    одновременные запросы с истекшим токеном ждут одно обновление.
+    """
+
+    def __init__(self, refresh_ahead: float = None, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.refresh_ahead = (
+            settings.GIGACHAT_TOKEN_REFRESH_AHEAD if refresh_ahead is None else refresh_ahead
+        )
+        self.token_updates = 0
+        self._token_lock = threading.Lock()
+        self._atoken_lock: Optional[asyncio.Lock] = None
+        self._refreshing = False
+
+    def _http_kwargs(self) -> Dict[str, Any]:
+        s = self._settings
+        kwargs: Dict[str, Any] = {
+            "base_url": s.base_url,
+            "verify": s.ca_bundle_file or s.verify_ssl_certs,
+            "timeout": httpx.Timeout(s.timeout),
+            "limits": httpx.Limits(
+                max_connections=settings.GIGACHAT_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.GIGACHAT_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.GIGACHAT_KEEPALIVE_EXPIRY,
+            ),
+            # HTTP/2 мультиплексирует запросы в одном соединении, нужен пакет h2
+            "http2": settings.GIGACHAT_HTTP2 and http2_available(),
+        }
+        if s.cert_file:
+            kwargs["cert"] = (s.cert_file, s.key_file, s.key_file_password)
+        return kwargs
+
+    @cached_property
+    def _client(self) -> httpx.Client:
+        return httpx.Client(
+            **self._http_kwargs(), event_hooks={"request": [_apply_request_timeout]}
+        )
+
+    @cached_property
+    def _aclient(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            **self._http_kwargs(), event_hooks={"request": [_aapply_request_timeout]}
+        )
+
+    def _token_ttl(self) -> Optional[float]:
+        token = self._access_token
+        if token is None:
+            return None
+        # expires_at в миллисекундах, 0 - токен передан в настройках без срока
+        if not token.expires_at:
+            return float("inf")
+        return token.expires_at / 1000 - time.time()
+
+    def _needs_update(self) -> bool:
+        ttl = self._token_ttl()
+        return ttl is None or ttl < self.refresh_ahead
+
+    def _check_validity_token(self) -> bool:
+        ttl = self._token_ttl()
+        if ttl is None or ttl <= 1:
+            return False
+        if ttl < self.refresh_ahead and not self._refreshing:
+            self._refresh_in_background()
+        return True
+
+    def _refresh_in_background(self):
+        self._refreshing = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            threading.Thread(target=self._refresh, name="gigachat-token", daemon=True).start()
+        else:
+            loop.create_task(self._arefresh())
+
+    def _refresh(self):
+        try:
+            self._update_token()
+        except Exception as e:
+            _logger.warning("Не удалось заранее обновить токен GigaChat: %r", e)
+        finally:
+            self._refreshing = False
+
+    async def _arefresh(self):
+        try:
+            await self._aupdate_token()
+        except Exception as e:
+            _logger.warning("Не удалось заранее обновить токен GigaChat: %r", e)
+        finally:
+            self._refreshing = False
+
+    def _update_token(self) -> None:
+        with self._token_lock:
+            # токен мог обновить другой поток, пока этот ждал блокировку
+            if not self._needs_update():
+                return
+            with metrics.timer("gigachat_token_seconds"):
+                super()._update_token()
+            self.token_updates += 1
+
+    async def _aupdate_token(self) -> None:
+        if self._atoken_lock is None:
+            self._atoken_lock = asyncio.Lock()
+        async with self._atoken_lock:
+            if not self._needs_update():
+                return
+            with metrics.timer("gigachat_token_seconds"):
+                await super()._aupdate_token()
+            self.token_updates += 1
+
+
+class TimeoutClient:
+    """Общий клиент стенда, запросы которого идут с таймаутом конкретной модели."""
+
+    def __init__(self, client: SharedGigaChatClient, timeout: Optional[float]):
+        self.client = client
+        self.timeout = timeout
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.client, name)
+
+    def chat(self, *args: Any, **kwargs: Any) -> Any:
+        with request_timeout(self.timeout):
+            return self.client.chat(*args, **kwargs)
+
+    async def achat(self, *args: Any, **kwargs: Any) -> Any:
+        with request_timeout(self.timeout):
+            return await self.client.achat(*args, **kwargs)
+
+    def stream(self, *args: Any, **kwargs: Any) -> Iterator[Any]:
+        with request_timeout(self.timeout):
+            yield from self.client.stream(*args, **kwargs)
+
+    async def astream(self, *args: Any, **kwargs: Any) -> AsyncIterator[Any]:
+        with request_timeout(self.timeout):
+            async for chunk in self.client.astream(*args, **kwargs):
+                yield chunk
+
+    def embeddings(self, *args: Any, **kwargs: Any) -> Any:
+        with request_timeout(self.timeout):
+            return self.client.embeddings(*args, **kwargs)
+
+    async def aembeddings(self, *args: Any, **kwargs: Any) -> Any:
+        with request_timeout(self.timeout):
+            return await self.client.aembeddings(*args, **kwargs)
+
+
+class ClientPool:
+    """Клиенты SDK по стендам и параметрам соединения: чат и эмбеддинги одного
+    стенда делят соединения и токен, таймауты у каждой модели свои."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients: Dict[Tuple, SharedGigaChatClient] = {}
+
+    def get(self, stand: str, **options: Any) -> SharedGigaChatClient:
+        kwargs = {k: v for k, v in options.items() if k in CLIENT_OPTIONS and v is not None}
+        key = (stand, tuple(sorted(kwargs.items())))
+        client = self._clients.get(key)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(key)
+                if client is None:
+                    client = self._clients[key] = SharedGigaChatClient(**kwargs)
+                    _logger.debug("Клиент GigaChat для стенда %s создан", stand)
+        return client
+
+    def close(self):
+        with self._lock:
+            clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            client.close()
+
+    async def aclose(self):
+        with self._lock:
+            clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            await client.aclose()
+            # синхронными соединениями пользуются потоки сборки индекса
+            client.close()
+
+
+POOL = ClientPool()
+
+
+def _options(model) -> Dict[str, Any]:
+    return {name: getattr(model, name, None) for name in CLIENT_OPTIONS}
+
+
+class PooledGigaChat(GigaChat):
+    """GigaChat, использующий общий клиент стенда из POOL."""
+
+    stand: str = ""
+
+    @cached_property
+    def _client(self) -> TimeoutClient:
+        return TimeoutClient(POOL.get(self.stand, **_options(self)), self.timeout)
+
+
+class PooledGigaChatEmbeddings(GigaChatEmbeddings):
+    """GigaChatEmbeddings, использующий общий клиент стенда из POOL."""
+
+    stand: str = ""
+
+    @cached_property
+    def _client(self) -> TimeoutClient:
+        return TimeoutClient(POOL.get(self.stand, **_options(self)), self.timeout)
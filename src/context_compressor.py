@@ -0,0 +1,142 @@
+import re
+from logging import getLogger
+from typing import List, Tuple
+
+import numpy as np
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+import src.settings as settings
+from src import metrics
+from src.bounded_memory import estimate_tokens
+from src.hybrid_retriever import tokenize
+from src.local_embeddings import HashingEmbeddings
+
+_logger = getLogger(__name__)
+
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+(?=[A-ZА-ЯЁ0-9«\"(-])")
+# предложение, которое уточняет предыдущее и без него теряет смысл
+_CONTINUATION = re.compile(
+    r"(?:Если|Иначе|При этом|Но|Однако|Поэтому|Тогда|Это|В этом случае|В таком случае)\b"
+)
+# короткие основы (предлоги, союзы) не говорят о теме предложения
+_MIN_STEM_LEN = 3
+
+
+def split_passages(text: str) -> List[str]:
+    """Предложения текста, склеенные с тем, без чего они непонятны: строка,
+    заканчивающаяся двоеточием, - с пунктами списка до следующего вопроса или
+    двоеточия, предложение - со следующими за ним уточнениями ("Если ...")."""
+    passages: List[str] = []
+    in_list = False
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            in_list = False
+            continue
+        if in_list and not line.endswith(("?", ":")):
+            passages[-1] += "\n" + line
+            continue
+        for sentence in _SENTENCE_END.split(line):
+            sentence = sentence.strip()
+            if not sentence:
+                continue
+            if passages and not passages[-1].endswith("?") and _CONTINUATION.match(sentence):
+                passages[-1] += " " + sentence
+            else:
+                passages.append(sentence)
+        in_list = line.endswith(":")
+    return passages
+
+
+class ContextCompressor:
+    """Оставляет в найденных чанках только предложения (см. split_passages), ближе
+    всего подходящие к вопросу, в пределах бюджета токенов.
+
+    mode="lexical" - доля основ слов вопроса в предложении, "local" - дополнительно
+    косинусная близость локальных эмбеддингов (src.local_embeddings): векторы
+    предложений GigaChat потребовали бы лишних запросов к API.
+    """
+
+    def __init__(self, token_budget: int = None, mode: str = None):
+        self.token_budget = token_budget or settings.CONTEXT_TOKEN_BUDGET
+        self.mode = mode or settings.CONTEXT_COMPRESSION
+        self._local = HashingEmbeddings() if self.mode == "local" else None
+
+    def _scores(self, query: str, sentences: List[str]) -> np.ndarray:
+        query_stems = {s for s in tokenize(query) if len(s) >= _MIN_STEM_LEN}
+        scores = np.zeros(len(sentences), dtype=np.float32)
+        if query_stems:
+            for i, sentence in enumerate(sentences):
+                scores[i] = len(query_stems.intersection(tokenize(sentence))) / len(query_stems)
+        if self._local is not None:
+            vectors = np.asarray(self._local.embed_documents(sentences), dtype=np.float32)
+            query_vector = np.asarray(self._local.embed_query(query), dtype=np.float32)
+            scores = 0.5 * scores + 0.5 * (vectors @ query_vector)
+        return scores
+
+    def compress(self, query: str, documents: List[Document]) -> List[Document]:
+        # первая строка чанка - имя файла (см. ingestion.update_chunk_content),
+        # она остается всегда: по ней модель понимает, о каком продукте речь
+        spans: List[Tuple[int, int, str]] = []
+        heads = []
+        for doc_index, doc in enumerate(documents):
+            head, _, body = doc.page_content.partition("\n")
+            heads.append(head)
+            spans += [(doc_index, i, s) for i, s in enumerate(split_passages(body))]
+        before = sum(estimate_tokens(doc.page_content) for doc in documents)
+        if not spans:
+            return documents
+
+        scores = self._scores(query, [s for _, _, s in spans])
+        # заголовки выводятся всегда, даже если на предложения бюджета не осталось
+        budget = max(self.token_budget - sum(estimate_tokens(head) for head in heads), 0)
+        kept = set()
+        # при равных баллах раньше идут предложения из более релевантных чанков
+        for idx in np.argsort(-scores, kind="stable"):
+            cost = estimate_tokens(spans[idx][2])
+            if cost > budget:
+                continue
+            kept.add(int(idx))
+            budget -= cost
+
+        compressed = []
+        for doc_index, doc in enumerate(documents):
+            body = [s for i, (d, _, s) in enumerate(spans) if d == doc_index and i in kept]
+            content = "\n".join([heads[doc_index]] + body)
+            compressed.append(Document(page_content=content, metadata=doc.metadata))
+        after = sum(estimate_tokens(doc.page_content) for doc in compressed)
+
+        metrics.observe("context_tokens_before", before, metrics.TOKENS_BUCKETS)
+        metrics.observe("context_tokens_after", after, metrics.TOKENS_BUCKETS)
+        metrics.inc("context_tokens_saved_total", max(before - after, 0))
+        _logger.debug("Контекст сжат с ~%d до ~%d токенов", before, after)
+        return compressed
+
+
+class CompressingRetriever(BaseRetriever):
+    """Ретривер, сжимающий найденные документы ContextCompressor перед промптом."""
+
+    base_retriever: BaseRetriever
+    compressor: ContextCompressor
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        docs = self.base_retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        return self.compressor.compress(query, docs)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        docs = await self.base_retriever.ainvoke(
+            query, config={"callbacks": run_manager.get_child()}
+        )
+        return self.compressor.compress(query, docs)
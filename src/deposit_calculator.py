@@ -0,0 +1,368 @@
+import re
+from dataclasses import dataclass, field
+from logging import getLogger
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from src.hybrid_retriever import tokenize
+
+_logger = getLogger(__name__)
+
+# условия продуктов в документах data/, например
+# "Максимальная ставка по вкладу СберВклад: до 16% годовых"
+_RATE = re.compile(
+    r"Максимальная ставка по (?:вкладу (?P<name>[^:\n]+?)|(?P<account>счету))\s*:"
+    r"\s*до\s*(?P<rate>\d+(?:[.,]\d+)?)\s*%"
+)
+_MIN_AMOUNT = re.compile(r"Минимальная сумма (?:вклада|счета)\s*:\s*(?P<value>[^\n]+)")
+_TERM = re.compile(r"Срок (?:вклада|счета)\s*:\s*(?P<value>[^\n]+)")
+# "Максимальная гарантированная ставка: 16% первые 3 месяца, при открытии первого ..."
+# и "Минимальная гарантированная ставка: 10% базовая ставка"; у вкладов там текст
+_GUARANTEED_RATE = re.compile(
+    r"(?P<kind>Максимальная|Минимальная) гарантированная ставка\s*:"
+    r"\s*(?P<rate>\d+(?:[.,]\d+)?)\s*%(?P<terms>[^\n]*)"
+)
+_PROMO_MONTHS = re.compile(r"первы\w*\s+(?P<months>\d+)\s*(?:\(\w+\)\s*)?мес\w*")
+# проценты причисляются к сумме, если начисляются ежемесячно или за расчетный период
+_ACCRUAL = re.compile(r"Условия начисления процентов по (?:вкладу|счету)[^:]*:\s*(?P<value>[^\n]+)")
+_MONTHLY_ACCRUAL = re.compile(r"ежемесячн|расч[её]тн\w* период")
+ACCOUNT_NAME = "Накопительный счет"
+MAX_TERM_MONTHS = 10 * 12
+
+# число: "500 000", "500000", "1,5"; множитель; единица срока или процент
+_NUMBER = re.compile(
+    r"(?<![\d,.])(?P<number>\d{1,3}(?:[ \u00a0\u202f]\d{3})+|\d+(?:[.,]\d+)?)"
+    r"\s*(?P<mult>тыс\w*|т\.?\s?р\b|млн\w*|миллион\w*|(?<=\d)[кk]\b)?"
+    r"\s*(?P<unit>месяц\w*|мес\b\.?|год\w*|лет\b|дн\w*|день|%|процент\w*)?"
+)
+_WORD_TERMS = (
+    (re.compile(r"\bполгода\b"), 6),
+    (re.compile(r"\bквартал\w*"), 3),
+    (re.compile(r"\bна\s+(?:один\s+)?год\b"), 12),
+    (re.compile(r"\bна\s+(?:один\s+)?месяц\b"), 1),
+)
+_MULTIPLIERS = (("тыс", 1e3), ("т", 1e3), ("к", 1e3), ("k", 1e3), ("млн", 1e6), ("миллион", 1e6))
+# явный вопрос о доходе; "сколько раз", "сколько стоит", "процент по вкладу"
+# с суммой и сроком - вопросы к документам, а не просьба о расчете
+_INCOME_WORDS = re.compile(r"доход|заработа|\bполучу\b|набеж|сколько\s+будет\s+в\s+конце\s+срока")
+_WITH_CAPITALIZATION = re.compile(r"\bс\s+(?:ежемесячной\s+)?капитализац")
+_WITHOUT_CAPITALIZATION = re.compile(r"без\s+капитализац")
+
+
+def _to_float(number: str) -> float:
+    return float(re.sub(r"[ \u00a0\u202f]", "", number).replace(",", "."))
+
+
+def _months(value: float, unit: str) -> Optional[float]:
+    if unit.startswith("мес"):
+        return value
+    if unit.startswith(("год", "лет")):
+        return value * 12
+    if unit.startswith(("дн", "ден")):
+        return value * 12 / 365
+    return None
+
+
+def parse_terms(text: str) -> List[float]:
+    """Сроки в месяцах из текста вида "от 1 месяца до 36 месяцев" или
+    "3 месяца, 6 месяцев и 1 год"."""
+    terms = []
+    for match in _NUMBER.finditer(text.lower()):
+        unit = match.group("unit") or ""
+        months = _months(_to_float(match.group("number")), unit)
+        if months is not None:
+            terms.append(months)
+    return terms
+
+
+@dataclass
+class Product:
+    name: str
+    rate: float  # максимальная ставка, % годовых
+    min_amount: float = 0.0
+    min_months: Optional[float] = None  # None - бессрочный
+    max_months: Optional[float] = None
+    # сроки, если вклад открывается только на них
+    fixed_terms: Tuple[float, ...] = ()
+    # ставка rate действует первые promo_months месяцев при promo_condition,
+    # дальше - base_rate
+    promo_months: Optional[float] = None
+    promo_condition: str = ""
+    base_rate: Optional[float] = None
+    capitalization: bool = False  # можно ли оставлять проценты на вкладе
+
+    @property
+    def has_promo(self) -> bool:
+        return self.promo_months is not None and self.base_rate is not None
+
+    def describe_rate(self) -> str:
+        if not self.has_promo:
+            return f"ставка до {self.rate:g}% годовых"
+        condition = f" {self.promo_condition}" if self.promo_condition else ""
+        return (
+            f"ставка {self.rate:g}% годовых первые {format_term(self.promo_months)}"
+            f"{condition}, затем {self.base_rate:g}%"
+        )
+
+    def conditions(
+        self, amount: float, months: float, capitalization: Optional[bool] = None
+    ) -> List[str]:
+        """Нарушенные условия продукта для суммы, срока и капитализации."""
+        notes = []
+        if capitalization and not self.capitalization:
+            notes.append("капитализация процентов не предусмотрена")
+        if amount < self.min_amount:
+            notes.append(f"минимальная сумма - {format_money(self.min_amount)}")
+        if self.fixed_terms and not any(abs(months - t) < 0.5 for t in self.fixed_terms):
+            terms = ", ".join(format_term(t) for t in self.fixed_terms)
+            notes.append(f"вклад открывается на {terms}")
+        elif self.min_months is not None and not (
+            self.min_months - 0.5 <= months <= (self.max_months or months) + 0.5
+        ):
+            notes.append(
+                f"срок - от {format_term(self.min_months)} до {format_term(self.max_months)}"
+            )
+        return notes
+
+
+def extract_products(documents: Iterable[Document]) -> List[Product]:
+    """Продукты и их условия из текста документов; условия относятся к
+    ближайшей выше строке с максимальной ставкой в том же чанке."""
+    products = {}
+    for doc in documents:
+        product = None
+        for line in doc.page_content.splitlines():
+            rate = _RATE.search(line)
+            if rate:
+                name = ACCOUNT_NAME if rate.group("account") else rate.group("name").strip()
+                product = products.get(name) or Product(name, _to_float(rate.group("rate")))
+                products[name] = product
+                continue
+            if product is None:
+                continue
+            min_amount = _MIN_AMOUNT.search(line)
+            if min_amount:
+                numbers = _NUMBER.findall(min_amount.group("value"))
+                product.min_amount = _to_float(numbers[0][0]) if numbers else 0.0
+                continue
+            guaranteed = _GUARANTEED_RATE.search(line)
+            if guaranteed:
+                rate = _to_float(guaranteed.group("rate"))
+                if guaranteed.group("kind") == "Минимальная":
+                    product.base_rate = rate
+                    continue
+                promo = _PROMO_MONTHS.search(guaranteed.group("terms"))
+                if promo:
+                    product.rate = rate
+                    product.promo_months = float(promo.group("months"))
+                    condition = guaranteed.group("terms")[promo.end() :]
+                    product.promo_condition = condition.strip(" ,.;")
+                continue
+            accrual = _ACCRUAL.search(line)
+            if accrual:
+                product.capitalization = bool(_MONTHLY_ACCRUAL.search(accrual.group("value")))
+                continue
+            term = _TERM.search(line)
+            if term:
+                value = term.group("value").lower()
+                terms = parse_terms(value)
+                if "бессроч" in value or not terms:
+                    product.min_months = product.max_months = None
+                elif "от" in value.split() or "до" in value.split():
+                    product.min_months, product.max_months = min(terms), max(terms)
+                else:
+                    product.fixed_terms = tuple(sorted(set(terms)))
+                    product.min_months, product.max_months = min(terms), max(terms)
+    return list(products.values())
+
+
+def calculate(amounts, months, rates, promo_months=None, base_rates=None) -> np.ndarray:
+    """Доход для всех сочетаний сумм, сроков (мес.) и ставок (% годовых) за один проход.
+
+    Если заданы promo_months и base_rates, ставка rates действует первые
+    promo_months месяцев (np.inf - весь срок), дальше - base_rates.
+    Форма результата (суммы, сроки, ставки, 2): доход без капитализации и с
+    ежемесячной капитализацией процентов.
+    """
+    amount = np.asarray(amounts, dtype=np.float64)[:, None, None]
+    term = np.asarray(months, dtype=np.float64)[None, :, None]
+    rate = np.asarray(rates, dtype=np.float64)[None, None, :] / 100
+    if promo_months is None:
+        promo, base = term, rate
+    else:
+        promo = np.minimum(term, np.asarray(promo_months, dtype=np.float64)[None, None, :])
+        base = np.asarray(base_rates, dtype=np.float64)[None, None, :] / 100
+    rest = term - promo
+    simple = amount * (rate * promo + base * rest) / 12
+    compound = amount * np.expm1(promo * np.log1p(rate / 12) + rest * np.log1p(base / 12))
+    return np.stack(np.broadcast_arrays(simple, compound), axis=-1)
+
+
+def format_money(value: float) -> str:
+    return f"{value:,.0f}".replace(",", " ") + " ₽"
+
+
+def format_term(months: float) -> str:
+    if months >= 12 and months % 12 == 0:
+        years = int(months // 12)
+        return f"{years} {'год' if years == 1 else 'года' if years < 5 else 'лет'}"
+    if months == int(months):
+        return f"{int(months)} мес."
+    return f"{round(months * 365 / 12)} дн."
+
+
+@dataclass
+class CalculationRequest:
+    amount: float
+    months: float
+    capitalization: Optional[bool] = None  # None - показать оба варианта
+    rate: Optional[float] = None  # ставка, названная клиентом
+    stems: List[str] = field(default_factory=list)
+
+
+def parse_question(question: str) -> Optional[CalculationRequest]:
+    """Сумма, срок и параметры расчета из вопроса; None, если это не вопрос о расчете."""
+    text = question.lower().replace("ё", "е")
+    if not _INCOME_WORDS.search(text):
+        return None
+    amounts, terms, rates = [], [], []
+    for match in _NUMBER.finditer(text):
+        value = _to_float(match.group("number"))
+        unit = match.group("unit") or ""
+        months = _months(value, unit)
+        if months is not None:
+            terms.append(months)
+        elif unit.startswith(("%", "процент")):
+            rates.append(value)
+        else:
+            mult = (match.group("mult") or "").replace(".", "").replace(" ", "")
+            for prefix, factor in _MULTIPLIERS:
+                if mult.startswith(prefix):
+                    value *= factor
+                    break
+            amounts.append(value)
+    # "в 2024 году" - не срок вклада
+    terms = [months for months in terms if 0 < months <= MAX_TERM_MONTHS]
+    if not terms:
+        terms = [months for pattern, months in _WORD_TERMS if pattern.search(text)]
+    amounts = [a for a in amounts if a >= 1000]
+    if not amounts or not terms:
+        return None
+
+    capitalization = None
+    if _WITHOUT_CAPITALIZATION.search(text):
+        capitalization = False
+    elif _WITH_CAPITALIZATION.search(text):
+        capitalization = True
+    return CalculationRequest(
+        amount=max(amounts),
+        months=terms[0],
+        capitalization=capitalization,
+        rate=rates[0] if rates else None,
+        stems=tokenize(text),
+    )
+
+
+class RateTable:
+    """Ставки продуктов из документов корпуса и расчет дохода без LLM."""
+
+    def __init__(self, products: List[Product]):
+        self.products = products
+        self.rates = np.array([p.rate for p in products], dtype=np.float64)
+        self.promo_months = np.array(
+            [p.promo_months if p.has_promo else np.inf for p in products], dtype=np.float64
+        )
+        self.base_rates = np.array(
+            [p.base_rate if p.has_promo else p.rate for p in products], dtype=np.float64
+        )
+        # продукт в вопросе узнаем по основе первого слова названия
+        self._stems = [(tokenize(p.name) or [""])[0] for p in products]
+
+    @classmethod
+    def from_documents(cls, documents: Iterable[Document]) -> "RateTable":
+        table = cls(extract_products(documents))
+        _logger.debug("Ставки продуктов: %s", {p.name: p.rate for p in table.products})
+        return table
+
+    def _select(self, request: CalculationRequest) -> List[int]:
+        named = [i for i, s in enumerate(self._stems) if s and s in request.stems]
+        if named:
+            return named
+        eligible = [
+            i
+            for i, product in enumerate(self.products)
+            if not product.conditions(request.amount, request.months, request.capitalization)
+        ]
+        return eligible or list(range(len(self.products)))
+
+    def answer(self, question: str) -> Optional[str]:
+        """Готовый ответ на вопрос о доходе или None, если расчет неприменим."""
+        request = parse_question(question)
+        if request is None:
+            return None
+        if request.rate is not None:
+            selected = []
+            rates = np.array([request.rate])
+            income = calculate([request.amount], [request.months], rates)[0, 0]
+        elif not self.products:
+            return None
+        else:
+            selected = self._select(request)
+            rates = self.rates[selected]
+            income = calculate(
+                [request.amount],
+                [request.months],
+                rates,
+                self.promo_months[selected],
+                self.base_rates[selected],
+            )[0, 0]
+        all_variants = [(False, "без капитализации"), (True, "с ежемесячной капитализацией")]
+        if request.capitalization is not None:
+            all_variants = [v for v in all_variants if v[0] == request.capitalization]
+
+        lines = [f"Расчет для {format_money(request.amount)} на {format_term(request.months)}:"]
+        for row, rate in enumerate(rates):
+            variants = all_variants
+            if selected:
+                product = self.products[selected[row]]
+                lines.append(f"\n«{product.name}», {product.describe_rate()}")
+                notes = product.conditions(request.amount, request.months, request.capitalization)
+                if not product.capitalization:
+                    variants = [(False, "без капитализации")]
+                if notes:
+                    lines.append("Условия вклада не выполнены: " + "; ".join(notes) + ".")
+            else:
+                lines.append(f"\nПо ставке {rate:g}% годовых")
+            for capitalized, title in variants:
+                value = income[row, int(capitalized)]
+                lines.append(
+                    f"- {title}: доход {format_money(value)}, "
+                    f"в конце срока {format_money(request.amount + value)}"
+                )
+        if selected:
+            lines.append(
+                "\nРасчет по максимальной ставке: точная ставка зависит от суммы, срока и "
+                "условий и указана в СберБанк Онлайн. Налог на процентный доход не учтен."
+            )
+        return "\n".join(lines)
+
+
+PHRASE_PROMPT = (
+    "Ты консультант Сбера по вкладам. Перескажи клиенту готовый расчет дохода коротко и "
+    "вежливо. Не меняй и не пересчитывай числа, не добавляй новых условий."
+)
+
+
+async def aphrase(llm, question: str, calculation: str, config=None) -> str:
+    """Формулировка готового расчета моделью; числа считает RateTable."""
+    message = await llm.ainvoke(
+        [
+            SystemMessage(content=PHRASE_PROMPT),
+            HumanMessage(content=f"Вопрос клиента: {question}\n\nРасчет:\n{calculation}"),
+        ],
+        config=config,
+    )
+    return message.content
@@ -1,12 +1,15 @@
+import json
 import logging
 import time
-from typing import Dict, Any, List
+from typing import AsyncIterator, Dict, Any, List, Optional
 
-from langchain.chains.retrieval_qa.base import RetrievalQA
-from langchain.memory import ConversationBufferMemory
 from langchain_core.callbacks import BaseCallbackHandler
 
 import src.settings as settings
+from src import metrics
+from src.bounded_memory import create_memory
+from src.deposit_calculator import aphrase
+from src.metrics import ROUTE_STATS_PREFIX, MetricsHandler
 from src.rag import RAG
 
 logging.basicConfig()
@@ -18,28 +21,93 @@ if settings.VERBOSE:
 # logging.getLogger("langchain.chains.llm").setLevel(logging.ERROR)
 _logger = logging.getLogger(__name__)
 
+# один на процесс: хранит только времена начала этапов по run_id
+metrics_handler = MetricsHandler()
+
 
 class Credit:
     def __init__(self, llm, emdeddings, memory=None):
         self.prompt_handler = CustomHandler()
-        self.memory = memory or ConversationBufferMemory(
-            memory_key="history", input_key="question", output_key="text"
-        )
-        self.rag: RetrievalQA = RAG(llm, emdeddings, self.memory).chain
+        self.llm = llm
+        self.memory = memory or create_memory(llm)
+        if hasattr(self.memory, "bind_llm"):
+            self.memory.bind_llm(llm)
+        self.rag = RAG.get_chain(llm, emdeddings)
 
     def get_answer(self, question):
         chain_invoke = self.rag.invoke(
             {"question": question, "history": self.memory.buffer_as_str},
-            config={"callbacks": [self.prompt_handler]},
+            config={"callbacks": [self.prompt_handler, metrics_handler]},
         )
-        return chain_invoke.get("text")
+        answer = chain_invoke.get("text")
+        if answer:
+            self.remember(question, answer)
+        return answer
 
     async def aget_answer(self, question):
         chain_invoke = await self.rag.ainvoke(
             {"question": question, "history": self.memory.buffer_as_str},
-            config={"callbacks": [self.prompt_handler]},
+            config={"callbacks": [self.prompt_handler, metrics_handler]},
         )
-        return chain_invoke.get("text")
+        answer = chain_invoke.get("text")
+        if answer:
+            self.remember(question, answer)
+        return answer
+
+    async def astream_answer(self, question) -> AsyncIterator[str]:
+        """Отдает ответ по частям по мере генерации токенов моделью."""
+        answer = ""
+        async for event in self.rag.astream_events(
+            {"question": question, "history": self.memory.buffer_as_str},
+            config={"callbacks": [self.prompt_handler, metrics_handler]},
+            version="v2",
+        ):
+            if event["event"] == "on_chat_model_stream":
+                chunk = event["data"]["chunk"].content
+                if chunk:
+                    answer += chunk
+                    yield chunk
+        if answer:
+            self.remember(question, answer)
+
+    async def acalculate(self, question) -> Optional[str]:
+        """Ответ калькулятора доходности по ставкам из документов без RAG.
+
+        None, если в вопросе нет суммы и срока или калькулятор отключен. Считает
+        только в начале диалога: сумма и срок в продолжении могут относиться к
+        сказанному раньше, такие вопросы отвечает RAG с историей.
+        """
+        table = RAG.get_rate_table()
+        if settings.CALCULATOR_MODE == "off" or table is None or not self.is_new_conversation():
+            return None
+        with metrics.timer("calculator_seconds"):
+            answer = table.answer(question)
+        if answer is None:
+            return None
+        self.prompt_handler.on_text("capacity: калькулятор доходности")
+        if settings.CALCULATOR_MODE == "llm":
+            try:
+                answer = (
+                    await aphrase(
+                        self.llm,
+                        question,
+                        answer,
+                        config={"callbacks": [self.prompt_handler, metrics_handler]},
+                    )
+                    or answer
+                )
+            except Exception as e:
+                _logger.warning("Не удалось сформулировать расчет моделью: %r", e)
+        metrics.inc("calculator_answers_total")
+        self.remember(question, answer)
+        return answer
+
+    def is_new_conversation(self) -> bool:
+        return not self.memory.chat_memory.messages
+
+    def remember(self, question, answer):
+        """Добавляет в историю вопрос и ответ."""
+        self.memory.save_context({"question": question}, {"text": answer})
 
     def get_last_prompt(self):
         return self.prompt_handler.last_prompt
@@ -48,17 +116,29 @@ class Credit:
         return self.prompt_handler.last_route
 
 
+DepositHelper = Credit
+
+
 class CustomHandler(BaseCallbackHandler):
     def __init__(self):
         self.last_route = None
         self.last_prompt = None
+        # заполняется при маршрутизации через LocalRouterChain
+        self.last_route_method = None
+        self.last_route_latency = None
+        self.route_fallback_rate = None
 
     def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any) -> Any:
         formatted_prompts = "\n".join(prompts)
         self.last_prompt = formatted_prompts
 
     def on_text(self, text: str, **kwargs: Any) -> Any:
-        if any(text.startswith(s) for s in ["common", "capacity"]):
+        if text.startswith(ROUTE_STATS_PREFIX):
+            stats = json.loads(text[len(ROUTE_STATS_PREFIX) :])
+            self.last_route_method = stats["method"]
+            self.last_route_latency = stats["latency"]
+            self.route_fallback_rate = stats["fallback_rate"]
+        elif any(text.startswith(s) for s in ["common", "capacity"]):
             self.last_route = text.split(": ")[0]
 
 
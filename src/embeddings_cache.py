@@ -0,0 +1,278 @@
+import asyncio
+import hashlib
+import pathlib
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from logging import getLogger
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+import src.settings as settings
+from src import metrics
+
+_logger = getLogger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text).casefold().split())
+
+
+_IDENTITY_ATTRS = ("model", "dim", "ngram_range")
+
+
+def embeddings_identity(embeddings: Embeddings) -> str:
+    """Модель эмбеддингов и параметры, от которых зависят векторы (без оберток-кэшей)."""
+    while isinstance(embeddings, CachedEmbeddings):
+        embeddings = embeddings.embeddings
+    params = [
+        f"{name}={getattr(embeddings, name)}"
+        for name in _IDENTITY_ATTRS
+        if getattr(embeddings, name, None) is not None
+    ]
+    return f"{type(embeddings).__name__}({', '.join(params)})"
+
+
+class DiskEmbeddingsCache:
+    """Постоянный уровень кэша: векторы в SQLite в виде float32."""
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        if not keys:
+            return {}
+        found = {}
+        with self._lock:
+            # ограничение SQLite на число параметров в запросе
+            for i in range(0, len(keys), 500):
+                part = keys[i : i + 500]
+                rows = self._conn.execute(
+                    "SELECT key, vector FROM embeddings WHERE key IN (%s)"
+                    % ",".join("?" * len(part)),
+                    part,
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]):
+        if not items:
+            return
+        rows = [(key, np.asarray(v, dtype=np.float32).tobytes()) for key, v in items.items()]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows
+            )
+            self._conn.commit()
+
+
+class CachedEmbeddings(Embeddings):
+    """Кэширующая обертка над эмбеддингами с LRU в памяти, кэшем на диске и батчингом.
+
+    Ключ - хэш модели и нормализованного текста, поэтому повторные вопросы,
+    отличающиеся регистром или пробелами, не требуют запроса к API, а векторы
+    другой модели из кэша на диске не используются.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        namespace: str = "",
+        cache_path=None,
+        max_size: int = None,
+        batch_size: int = None,
+        batch_delay: float = None,
+    ):
+        self.embeddings = embeddings
+        self.namespace = namespace
+        self._key_prefix = f"{namespace}\0{embeddings_identity(embeddings)}\0"
+        self.max_size = max_size or settings.EMBEDDINGS_CACHE_SIZE
+        self.batch_size = batch_size or settings.EMBEDDINGS_BATCH_SIZE
+        self.batch_delay = settings.EMBEDDINGS_BATCH_DELAY if batch_delay is None else batch_delay
+        cache_path = cache_path or settings.EMBEDDINGS_CACHE_PATH
+        self.disk = DiskEmbeddingsCache(cache_path) if cache_path else None
+
+        self._memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Tuple[str, asyncio.Future]] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        # цикл событий держит на задачи только слабые ссылки
+        self._flush_tasks: Set[asyncio.Task] = set()
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256((self._key_prefix + normalize_text(text)).encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, vector: List[float]):
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_size:
+                self._memory.popitem(last=False)
+
+    def _lookup_memory(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self._lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+        return found
+
+    def _lookup_disk(self, keys: List[str]) -> Dict[str, List[float]]:
+        from_disk = self.disk.get_many(keys)
+        for key, vector in from_disk.items():
+            self._remember(key, vector)
+        return from_disk
+
+    def _lookup(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = self._lookup_memory(keys)
+        missing = [key for key in keys if key not in found]
+        if self.disk and missing:
+            found.update(self._lookup_disk(missing))
+        return found
+
+    async def _alookup(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = self._lookup_memory(keys)
+        missing = [key for key in keys if key not in found]
+        if self.disk and missing:
+            # чтение SQLite не должно останавливать цикл событий
+            loop = asyncio.get_running_loop()
+            found.update(await loop.run_in_executor(None, self._lookup_disk, missing))
+        return found
+
+    def _store(self, vectors: Dict[str, List[float]]):
+        for key, vector in vectors.items():
+            self._remember(key, vector)
+        if self.disk:
+            self.disk.put_many(vectors)
+
+    async def _astore(self, vectors: Dict[str, List[float]]):
+        for key, vector in vectors.items():
+            self._remember(key, vector)
+        if self.disk and vectors:
+            await asyncio.get_running_loop().run_in_executor(None, self.disk.put_many, vectors)
+
+    def _misses(self, texts: List[str]) -> Tuple[List[str], Dict[str, List[float]], Dict[str, str]]:
+        keys = [self._key(text) for text in texts]
+        return keys, *self._split(keys, texts, self._lookup(keys))
+
+    async def _amisses(
+        self, texts: List[str]
+    ) -> Tuple[List[str], Dict[str, List[float]], Dict[str, str]]:
+        keys = [self._key(text) for text in texts]
+        return keys, *self._split(keys, texts, await self._alookup(keys))
+
+    @staticmethod
+    def _split(
+        keys: List[str], texts: List[str], found: Dict[str, List[float]]
+    ) -> Tuple[Dict[str, List[float]], Dict[str, str]]:
+        misses: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                misses.setdefault(key, text)
+        return found, misses
+
+    def _batches(self, misses: Dict[str, str]):
+        items = list(misses.items())
+        for i in range(0, len(items), self.batch_size):
+            yield items[i : i + self.batch_size]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, found, misses = self._misses(texts)
+        for batch in self._batches(misses):
+            vectors = self.embeddings.embed_documents([text for _, text in batch])
+            computed = {key: vector for (key, _), vector in zip(batch, vectors)}
+            self._store(computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        found = self._lookup([key])
+        if key in found:
+            return found[key]
+        # время эмбеддинга - только для промахов, попадания в кэш его занизили бы
+        with metrics.timer("query_embedding_seconds"):
+            vector = self.embeddings.embed_query(text)
+        self._store({key: vector})
+        return vector
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, found, misses = await self._amisses(texts)
+        for batch in self._batches(misses):
+            vectors = await self.embeddings.aembed_documents([text for _, text in batch])
+            computed = {key: vector for (key, _), vector in zip(batch, vectors)}
+            await self._astore(computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        found = await self._alookup([key])
+        if key in found:
+            return found[key]
+
+        # промахи из одновременных запросов собираются в один батч
+        loop = asyncio.get_running_loop()
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = (text, loop.create_future())
+            self._pending[key] = pending
+            if self._flush_handle is None:
+                self._flush_handle = loop.call_later(self.batch_delay, self._start_flush)
+        with metrics.timer("query_embedding_seconds"):
+            return await asyncio.shield(pending[1])
+
+    def _start_flush(self):
+        task = asyncio.ensure_future(self._aflush())
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def _aflush(self):
+        pending, self._pending = self._pending, {}
+        self._flush_handle = None
+        misses = {key: text for key, (text, _) in pending.items()}
+        try:
+            for batch in self._batches(misses):
+                # векторы запросов считаются как в embed_query: у модели они могут
+                # отличаться от векторов документов, а ключ кэша у них общий
+                results = await asyncio.gather(
+                    *(self.embeddings.aembed_query(text) for _, text in batch),
+                    return_exceptions=True,
+                )
+                computed = {}
+                for (key, _), result in zip(batch, results):
+                    if isinstance(result, BaseException):
+                        self._fail(pending, [key], result)
+                    else:
+                        computed[key] = result
+                await self._astore(computed)
+                for key, vector in computed.items():
+                    future = pending[key][1]
+                    if not future.done():
+                        future.set_result(vector)
+        finally:
+            # ожидающие не должны зависнуть, даже если сброс прервали
+            self._fail(pending, list(pending), RuntimeError("батч эмбеддингов не выполнен"))
+
+    @staticmethod
+    def _fail(
+        pending: Dict[str, Tuple[str, asyncio.Future]], keys: List[str], error: BaseException
+    ):
+        for key in keys:
+            future = pending[key][1]
+            if not future.done():
+                future.set_exception(error)
@@ -0,0 +1,138 @@
+# заменители GigaChat для бенчмарков и нагрузочных тестов без сети, см. benchmarks/
+import asyncio
+import math
+import random
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from src.local_embeddings import HashingEmbeddings
+
+
+def sample_latency(median: float, sigma: float) -> float:
+    """Логнормальная задержка: median - медиана, sigma - разброс (0 - без разброса)."""
+    if median <= 0:
+        return 0.0
+    return random.lognormvariate(math.log(median), sigma)
+
+
+class FakeChatModel(BaseChatModel):
+    """Чат-модель с настраиваемой задержкой и потоковой выдачей токенов."""
+
+    latency_median: float = 5.0
+    latency_sigma: float = 0.5
+    ttft_share: float = 0.2  # доля задержки до первого токена
+    answer_words: int = 60
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-gigachat"
+
+    def _answer(self, messages: List[BaseMessage]) -> str:
+        question = str(messages[-1].content)
+        words = (f"Ответ на вопрос «{question[:100]}»: " + "текст " * self.answer_words).split()
+        return " ".join(words[: self.answer_words])
+
+    def _result(self, messages: List[BaseMessage], text: str) -> ChatResult:
+        prompt_tokens = sum(len(str(m.content)) for m in messages) // 3
+        completion_tokens = len(text) // 3
+        return ChatResult(
+            generations=[ChatGeneration(message=AIMessage(content=text))],
+            llm_output={
+                "token_usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+                "model_name": self._llm_type,
+            },
+        )
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        time.sleep(sample_latency(self.latency_median, self.latency_sigma))
+        return self._result(messages, self._answer(messages))
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        await asyncio.sleep(sample_latency(self.latency_median, self.latency_sigma))
+        return self._result(messages, self._answer(messages))
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        total = sample_latency(self.latency_median, self.latency_sigma)
+        words = self._answer(messages).split(" ")
+        time.sleep(total * self.ttft_share)
+        for i, word in enumerate(words):
+            chunk = ChatGenerationChunk(
+                message=AIMessageChunk(content=word if not i else " " + word)
+            )
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+            time.sleep(total * (1 - self.ttft_share) / len(words))
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        total = sample_latency(self.latency_median, self.latency_sigma)
+        words = self._answer(messages).split(" ")
+        await asyncio.sleep(total * self.ttft_share)
+        for i, word in enumerate(words):
+            chunk = ChatGenerationChunk(
+                message=AIMessageChunk(content=word if not i else " " + word)
+            )
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+            await asyncio.sleep(total * (1 - self.ttft_share) / len(words))
+
+
+class FakeEmbeddings(Embeddings):
+    """Эмбеддинги с задержкой сетевого вызова; векторы - из HashingEmbeddings."""
+
+    def __init__(self, latency_median: float = 0.3, latency_sigma: float = 0.3):
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self._local = HashingEmbeddings()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(sample_latency(self.latency_median, self.latency_sigma))
+        return self._local.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        await asyncio.sleep(sample_latency(self.latency_median, self.latency_sigma))
+        return self._local.embed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
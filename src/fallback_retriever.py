@@ -0,0 +1,70 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from logging import getLogger
+from typing import Any, List
+
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+import src.settings as settings
+
+_logger = getLogger(__name__)
+
+_executor = ThreadPoolExecutor(thread_name_prefix="remote-embeddings")
+
+
+class FallbackRetriever(BaseRetriever):
+    """Векторный поиск, переключающийся на локальный индекс при медленных эмбеддингах.
+
+    Запрос эмбеддится удаленной моделью; если она не ответила за budget секунд
+    или вернула ошибку, поиск идет по второму индексу, построенному локальными
+    эмбеддингами. Иначе поиск выполняет remote_retriever со своими настройками
+    (MMR, порог): вектор запроса он берет из кэша CachedEmbeddings.
+    """
+
+    remote_retriever: BaseRetriever
+    embeddings: Any
+    # VectorStore или MatrixRetriever: нужен similarity_search
+    local_db: Any
+    k: int = 3
+    budget: float = settings.REMOTE_EMBEDDINGS_BUDGET
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _local(self, query: str) -> List[Document]:
+        return self.local_db.similarity_search(query, k=self.k)
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        future = _executor.submit(self.embeddings.embed_query, query)
+        try:
+            future.result(timeout=self.budget)
+        except FutureTimeoutError:
+            _logger.warning("Эмбеддинг запроса дольше %.1f сек., локальный поиск", self.budget)
+            return self._local(query)
+        except Exception as e:
+            _logger.warning("Ошибка эмбеддинга запроса, локальный поиск: %s", e)
+            return self._local(query)
+        return self.remote_retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        try:
+            await asyncio.wait_for(self.embeddings.aembed_query(query), self.budget)
+        except asyncio.TimeoutError:
+            _logger.warning("Эмбеддинг запроса дольше %.1f сек., локальный поиск", self.budget)
+            return self._local(query)
+        except Exception as e:
+            _logger.warning("Ошибка эмбеддинга запроса, локальный поиск: %s", e)
+            return self._local(query)
+        return await self.remote_retriever.ainvoke(
+            query, config={"callbacks": run_manager.get_child()}
+        )
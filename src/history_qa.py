@@ -0,0 +1,55 @@
+from typing import Any, Dict, List, Optional
+
+from langchain.chains.retrieval_qa.base import RetrievalQA
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForChainRun,
+    CallbackManagerForChainRun,
+)
+
+
+class HistoryRetrievalQA(RetrievalQA):
+    """RetrievalQA, получающая историю диалога во входных данных, а не из памяти.
+
+    Одна такая цепочка обслуживает все чаты: у нее нет состояния конкретного чата.
+    """
+
+    history_key: str = "history"
+
+    @property
+    def input_keys(self) -> List[str]:
+        return [self.input_key, self.history_key]
+
+    def _result(self, answer: str, docs) -> Dict[str, Any]:
+        if self.return_source_documents:
+            return {self.output_key: answer, "source_documents": docs}
+        return {self.output_key: answer}
+
+    def _call(
+        self, inputs: Dict[str, Any], run_manager: Optional[CallbackManagerForChainRun] = None
+    ) -> Dict[str, Any]:
+        _run_manager = run_manager or CallbackManagerForChainRun.get_noop_manager()
+        question = inputs[self.input_key]
+        docs = self._get_docs(question, run_manager=_run_manager)
+        answer = self.combine_documents_chain.run(
+            input_documents=docs,
+            question=question,
+            history=inputs[self.history_key],
+            callbacks=_run_manager.get_child(),
+        )
+        return self._result(answer, docs)
+
+    async def _acall(
+        self,
+        inputs: Dict[str, Any],
+        run_manager: Optional[AsyncCallbackManagerForChainRun] = None,
+    ) -> Dict[str, Any]:
+        _run_manager = run_manager or AsyncCallbackManagerForChainRun.get_noop_manager()
+        question = inputs[self.input_key]
+        docs = await self._aget_docs(question, run_manager=_run_manager)
+        answer = await self.combine_documents_chain.arun(
+            input_documents=docs,
+            question=question,
+            history=inputs[self.history_key],
+            callbacks=_run_manager.get_child(),
+        )
+        return self._result(answer, docs)
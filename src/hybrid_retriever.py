@@ -0,0 +1,142 @@
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Dict, List, Tuple
+
+import numpy as np
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+
+import src.settings as settings
+
+_TOKEN = re.compile(r"\w+")
+
+# упрощенный стеммер для русского: отрезаем самое длинное окончание,
+# оставляя основу не короче трех букв
+_ENDINGS = sorted(
+    """
+    иями ями ами иях иям ием ией ого его ому ему ыми ими ешь ишь ете ите ют ут ат ят ет ит
+    ая яя ое ее ие ые ой ей ий ый ом ем ам ям ах ях ою ею ую юю ов ев ия ья ью ть ла ли ло
+    на ны но а я о е и ы у ю ь й
+    """.split(),
+    key=len,
+    reverse=True,
+)
+
+
+def stem(word: str) -> str:
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[: -len(ending)]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    return [stem(token) for token in _TOKEN.findall(text.lower().replace("ё", "е"))]
+
+
+def _doc_key(doc: Document) -> Tuple[str, str]:
+    return doc.metadata.get("source", ""), doc.page_content
+
+
+class BM25Index:
+    """Инвертированный индекс с ранжированием BM25 по чанкам в памяти процесса."""
+
+    def __init__(self, documents: List[Document], k1: float = 1.5, b: float = 0.75):
+        self.documents = documents
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        lengths = []
+        for idx, doc in enumerate(documents):
+            terms = Counter(tokenize(doc.page_content))
+            lengths.append(sum(terms.values()))
+            for term, tf in terms.items():
+                self.postings[term].append((idx, tf))
+        self.doc_len = np.asarray(lengths, dtype=np.float32)
+        self.avg_len = float(self.doc_len.mean()) if documents else 0.0
+        n = len(documents)
+        self.idf = {
+            term: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    def search(self, query: str, k: int) -> List[Tuple[Document, float]]:
+        scores = np.zeros(len(self.documents), dtype=np.float32)
+        norm = self.k1 * (1 - self.b + self.b * self.doc_len / (self.avg_len or 1.0))
+        for term in set(tokenize(query)):
+            for idx, tf in self.postings.get(term, ()):
+                scores[idx] += self.idf[term] * tf * (self.k1 + 1) / (tf + norm[idx])
+        top = np.argsort(-scores)[:k]
+        return [(self.documents[i], float(scores[i])) for i in top if scores[i] > 0]
+
+
+class HybridRetriever(BaseRetriever):
+    """Объединяет лексический поиск BM25 и векторный ретривер по reciprocal rank fusion.
+
+    Если лексический результат однозначен (высокий балл и отрыв от второго места),
+    векторный поиск и вычисление эмбеддинга запроса пропускаются.
+    """
+
+    vector_retriever: BaseRetriever
+    index: BM25Index
+    k: int = 3
+    fetch_k: int = 10
+    rrf_k: int = 60
+    decisive_score: float = settings.LEXICAL_DECISIVE_SCORE
+    decisive_margin: float = settings.LEXICAL_DECISIVE_MARGIN
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @classmethod
+    def from_vector_store(cls, db: VectorStore, vector_retriever: BaseRetriever, **kwargs):
+        documents = [db.docstore.search(doc_id) for doc_id in db.index_to_docstore_id.values()]
+        return cls(vector_retriever=vector_retriever, index=BM25Index(documents), **kwargs)
+
+    def is_decisive(self, query: str) -> bool:
+        """Ответит ли поиск по одному BM25, без эмбеддинга запроса."""
+        return self._lexical(query)[1]
+
+    def _lexical(self, query: str):
+        lexical = self.index.search(query, self.fetch_k)
+        decisive = bool(lexical) and lexical[0][1] >= self.decisive_score
+        if decisive and len(lexical) > 1:
+            decisive = lexical[0][1] >= self.decisive_margin * lexical[1][1]
+        return [doc for doc, _ in lexical], decisive
+
+    def _fuse(self, *rankings: List[Document]) -> List[Document]:
+        scores: Dict[Tuple[str, str], float] = defaultdict(float)
+        docs: Dict[Tuple[str, str], Document] = {}
+        for ranking in rankings:
+            for rank, doc in enumerate(ranking):
+                key = _doc_key(doc)
+                scores[key] += 1.0 / (self.rrf_k + rank + 1)
+                docs.setdefault(key, doc)
+        ordered = sorted(scores, key=scores.get, reverse=True)
+        return [docs[key] for key in ordered[: self.k]]
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        lexical, decisive = self._lexical(query)
+        if decisive:
+            return lexical[: self.k]
+        dense = self.vector_retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        return self._fuse(lexical, dense)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        lexical, decisive = self._lexical(query)
+        if decisive:
+            return lexical[: self.k]
+        dense = await self.vector_retriever.ainvoke(
+            query, config={"callbacks": run_manager.get_child()}
+        )
+        return self._fuse(lexical, dense)
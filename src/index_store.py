@@ -0,0 +1,141 @@
+import hashlib
+import json
+import pathlib
+from logging import getLogger
+from typing import TYPE_CHECKING, Dict, Iterable, Optional
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+import src.settings as settings
+from src.embeddings_cache import embeddings_identity
+
+if TYPE_CHECKING:
+    from langchain_community.vectorstores.faiss import FAISS
+
+_logger = getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 2
+
+
+def file_hash(path: pathlib.Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def build_manifest(doc_path, embeddings: Embeddings = None) -> Dict:
+    """Описание корпуса: хэши содержимого файлов, параметры нарезки на чанки и
+    модель эмбеддингов, которой посчитаны векторы."""
+    root = pathlib.Path(doc_path)
+    files = {
+        str(p.relative_to(root)): file_hash(p)
+        for p in sorted(root.rglob("*"))
+        if p.is_file() and not any(part.startswith(".") for part in p.relative_to(root).parts)
+    }
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "chunk_size": settings.CHUNK_SIZE,
+        "chunk_overlap": settings.CHUNK_OVERLAP,
+        "embeddings": embeddings_identity(embeddings) if embeddings is not None else None,
+        "files": files,
+    }
+    manifest["corpus_hash"] = hashlib.sha256(
+        json.dumps(manifest, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    return manifest
+
+
+def chunk_hash(doc: Document) -> str:
+    """Стабильный идентификатор чанка: совпадает, пока не изменились текст и метаданные."""
+    payload = json.dumps(
+        {"content": doc.page_content, "metadata": doc.metadata},
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def sync_index(
+    db: Optional["FAISS"], documents: Iterable[Document], embeddings: Embeddings
+) -> "FAISS":
+    """Приводит индекс к набору документов, эмбеддинги считаются только для новых чанков.
+
+    Чанки хранятся в docstore под своим хэшем, поэтому разница между индексом и
+    корпусом вычисляется сравнением множеств идентификаторов.
+    """
+    chunks: Dict[str, Document] = {}
+    for doc in documents:
+        chunks.setdefault(chunk_hash(doc), doc)
+
+    if db is None:
+        # векторное хранилище импортируется при первой сборке, а не при старте бота
+        from langchain_community.vectorstores.faiss import FAISS
+
+        _logger.debug("Полная сборка индекса: %s чанков", len(chunks))
+        return FAISS.from_documents(list(chunks.values()), embeddings, ids=list(chunks))
+
+    indexed = set(db.index_to_docstore_id.values())
+    removed = [chunk_id for chunk_id in indexed if chunk_id not in chunks]
+    added = [chunk_id for chunk_id in chunks if chunk_id not in indexed]
+    _logger.debug(
+        "Обновление индекса: добавлено %s, удалено %s, без изменений %s",
+        len(added),
+        len(removed),
+        len(indexed) - len(removed),
+    )
+    if removed:
+        db.delete(removed)
+    if added:
+        db.add_documents([chunks[chunk_id] for chunk_id in added], ids=added)
+    return db
+
+
+class IndexStore:
+    """FAISS индекс на диске, действительный пока не изменились документы или настройки."""
+
+    def __init__(self, index_path=None):
+        self.path = pathlib.Path(index_path or settings.INDEX_PATH)
+
+    @property
+    def manifest_path(self) -> pathlib.Path:
+        return self.path / MANIFEST_NAME
+
+    def read_manifest(self) -> Optional[Dict]:
+        if not self.manifest_path.exists():
+            return None
+        try:
+            return json.loads(self.manifest_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            _logger.warning("Не удалось прочитать манифест индекса %s: %s", self.manifest_path, e)
+            return None
+
+    def is_current(self, manifest: Dict) -> bool:
+        stored = self.read_manifest()
+        return bool(stored) and stored.get("corpus_hash") == manifest["corpus_hash"]
+
+    def load(self, embeddings: Embeddings) -> Optional["FAISS"]:
+        if not self.manifest_path.exists():
+            return None
+        from langchain_community.vectorstores.faiss import FAISS
+
+        try:
+            # индекс и docstore пишем только сами, поэтому pickle здесь допустим
+            return FAISS.load_local(
+                str(self.path), embeddings, allow_dangerous_deserialization=True
+            )
+        except Exception as e:
+            _logger.warning("Не удалось загрузить индекс из %s: %s", self.path, e)
+            return None
+
+    def save(self, db: "FAISS", manifest: Dict):
+        self.path.mkdir(parents=True, exist_ok=True)
+        db.save_local(str(self.path))
+        # манифест пишется последним: при падении на середине индекс просто пересоберется
+        tmp_path = self.manifest_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+        tmp_path.replace(self.manifest_path)
@@ -0,0 +1,203 @@
+import hashlib
+import importlib
+import multiprocessing
+import os
+import pathlib
+import re
+from concurrent.futures import ProcessPoolExecutor
+from logging import getLogger
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import orjson
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+
+import src.settings as settings
+from src.index_store import file_hash
+
+_logger = getLogger(__name__)
+
+# порядок и параметры загрузчиков те же, что были у DirectoryLoader в get_docs;
+# модули загрузчиков импортируются только в процессах разбора, см. parse_file
+_LOADERS_PACKAGE = "langchain_community.document_loaders"
+LOADERS = [
+    ("**/*.txt", "text.TextLoader", {"autodetect_encoding": True}),
+    ("**/*.json", "text.TextLoader", {"autodetect_encoding": False}),
+    ("**/*.doc*", "word_document.Docx2txtLoader", {}),
+    ("**/*.pdf", "pdf.PyPDFLoader", {"extract_images": False}),
+    ("**/*.html", "html_bs.BSHTMLLoader", {"bs_kwargs": {"features": "html.parser"}}),
+]
+
+_NEWLINES_1_2 = re.compile(r"\n{1,2}")
+_NEWLINES_3 = re.compile(r"\n{3,}")
+_NEWLINE_TABS = re.compile(r"(\n+\t+){2,}")
+_TABS = re.compile(r"\t+")
+_NEWLINES_2 = re.compile(r"\n{2,}")
+
+ParsedDoc = Tuple[str, Dict]
+
+
+def update_document_content(content: str) -> str:
+    res = _NEWLINES_1_2.sub("\n", content)
+    res = _NEWLINES_3.sub("\n\n", res)
+    res = _NEWLINE_TABS.sub("\n\n\n", res)
+    res = _TABS.sub(" ", res)
+    return res
+
+
+def update_chunk_content(content: str, metadata: dict) -> str:
+    res = _NEWLINES_2.sub("\n", content)
+    file_name = metadata["source"]
+    return pathlib.Path(file_name).stem + "\n" + res
+
+
+def get_text_splitter() -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
+        chunk_size=settings.CHUNK_SIZE,
+        chunk_overlap=settings.CHUNK_OVERLAP,
+        separators=["\n\n\n", "\n\n", "\n"],
+        keep_separator=False,
+        is_separator_regex=False,
+    )
+
+
+def parse_file(path: str, loader_index: int) -> List[ParsedDoc]:
+    """Разбор одного файла, выполняется в отдельном процессе."""
+    _, loader_name, loader_kwargs = LOADERS[loader_index]
+    module_name, class_name = loader_name.rsplit(".", 1)
+    module = importlib.import_module(f"{_LOADERS_PACKAGE}.{module_name}")
+    docs = getattr(module, class_name)(path, **loader_kwargs).load()
+    return [(update_document_content(doc.page_content), doc.metadata) for doc in docs]
+
+
+def list_files(doc_path, pattern: str) -> List[pathlib.Path]:
+    root = pathlib.Path(doc_path)
+    return sorted(
+        p
+        for p in root.glob(pattern)
+        if p.is_file() and not any(part.startswith(".") for part in p.relative_to(root).parts)
+    )
+
+
+class ParsedCache:
+    """Кэш разобранного и нормализованного текста файлов.
+
+    Запись действительна, пока у файла прежние mtime и размер; если они
+    изменились, а содержимое (sha256) нет, запись тоже используется. Первая
+    строка записи - заголовок, поэтому актуальность проверяется без чтения текста.
+    """
+
+    VERSION = 2
+
+    def __init__(self, path=None):
+        self.path = pathlib.Path(path or settings.INGEST_CACHE_PATH)
+
+    def _entry_path(self, source: pathlib.Path, loader_index: int) -> pathlib.Path:
+        key = hashlib.sha1(f"{loader_index}:{source.resolve()}".encode("utf-8")).hexdigest()
+        return self.path / f"{key}.json"
+
+    def is_fresh(self, source: pathlib.Path, loader_index: int) -> bool:
+        entry_path = self._entry_path(source, loader_index)
+        try:
+            with open(entry_path, "rb") as f:
+                header = orjson.loads(f.readline())
+        except (OSError, orjson.JSONDecodeError):
+            return False
+        if not isinstance(header, dict) or header.get("version") != self.VERSION:
+            return False
+        stat = source.stat()
+        if header["mtime_ns"] == stat.st_mtime_ns and header["size"] == stat.st_size:
+            return True
+        if header["sha256"] != file_hash(source):
+            return False
+        header["mtime_ns"], header["size"] = stat.st_mtime_ns, stat.st_size
+        body = entry_path.read_bytes().split(b"\n", 1)[1]
+        self._write(entry_path, header, body)
+        return True
+
+    def get(self, source: pathlib.Path, loader_index: int) -> Optional[List[ParsedDoc]]:
+        if not self.is_fresh(source, loader_index):
+            return None
+        try:
+            body = self._entry_path(source, loader_index).read_bytes().split(b"\n", 1)[1]
+            return [(content, metadata) for content, metadata in orjson.loads(body)]
+        except (OSError, IndexError, orjson.JSONDecodeError):
+            return None
+
+    def put(self, source: pathlib.Path, loader_index: int, docs: List[ParsedDoc]):
+        stat = source.stat()
+        header = {
+            "version": self.VERSION,
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "sha256": file_hash(source),
+        }
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._write(self._entry_path(source, loader_index), header, orjson.dumps(docs))
+
+    @staticmethod
+    def _write(entry_path: pathlib.Path, header: Dict, body: bytes):
+        tmp_path = entry_path.with_suffix(".tmp")
+        tmp_path.write_bytes(orjson.dumps(header) + b"\n" + body)
+        tmp_path.replace(entry_path)
+
+
+def iter_docs(doc_path, cache: ParsedCache = None, workers: int = None) -> Iterator[Document]:
+    """Чанки документов из doc_path по одному, в том же виде, что отдавал get_docs.
+
+    Файлы, которых нет в кэше, разбираются параллельно в пуле процессов spawn:
+    дочерние процессы заново импортируют главный модуль, поэтому вызывающий
+    скрипт должен запускать работу под ``if __name__ == "__main__":``, иначе пул
+    падает с BrokenProcessPool.
+    """
+    cache = cache or ParsedCache()
+    workers = workers or settings.INGEST_WORKERS or os.cpu_count()
+    splitter = get_text_splitter()
+
+    tasks = [
+        (source, loader_index)
+        for loader_index, (pattern, _, _) in enumerate(LOADERS)
+        for source in list_files(doc_path, pattern)
+    ]
+    # текст из кэша читается по мере выдачи чанков, здесь - только заголовки
+    fresh = {task: cache.is_fresh(*task) for task in tasks}
+    misses = [task for task in tasks if not fresh[task]]
+    _logger.debug("Файлов: %s, требуют разбора: %s", len(tasks), len(misses))
+
+    executor = None
+    futures = []
+    if misses:
+        # spawn, а не fork: пул создается из потока прогрева индекса, пока работают
+        # потоки логов и метрик, и дочерний процесс мог бы унаследовать их занятые блокировки
+        executor = ProcessPoolExecutor(
+            max_workers=min(workers, len(misses)),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    try:
+        futures = [
+            executor.submit(parse_file, str(source), loader_index)
+            for source, loader_index in misses
+        ]
+        parsed = (future.result() for future in futures)
+        for task in tasks:
+            docs = cache.get(*task) if fresh[task] else None
+            if not fresh[task]:
+                docs = next(parsed)
+                cache.put(*task, docs)
+            elif docs is None:
+                # запись испортили после проверки заголовка
+                docs = parse_file(str(task[0]), task[1])
+            documents = [Document(page_content=content, metadata=meta) for content, meta in docs]
+            for chunk in splitter.split_documents(documents):
+                yield chunk.copy(
+                    update={
+                        "page_content": update_chunk_content(chunk.page_content, chunk.metadata)
+                    }
+                )
+    finally:
+        if executor:
+            # cancel_futures появился только в Python 3.9: если выдачу чанков прервали,
+            # не начатые разборы отменяются вручную
+            for future in futures:
+                future.cancel()
+            executor.shutdown()
@@ -0,0 +1,137 @@
+import atexit
+import logging
+import pathlib
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler
+from typing import List, Optional
+
+import orjson
+
+import src.settings as settings
+
+
+class JsonLogFormatter(logging.Formatter):
+    def format(self, record):
+        log_record = {
+            # время события, а не записи в файл фоновым потоком
+            "time": datetime.fromtimestamp(record.created, timezone.utc)
+            .replace(tzinfo=None)
+            .isoformat(),
+            "username": getattr(record, "username", None),
+            "user_id": getattr(record, "user_id", None),
+            "question": getattr(record, "question", None),
+            "answer": getattr(record, "answer", None),
+        }
+        return orjson.dumps(log_record).decode("utf-8")
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Кладет запись в очередь и сразу возвращается; при переполнении запись теряется."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonlWriter(threading.Thread):
+    """Фоновый поток, пишущий записи из очереди пачками в JSONL с ротацией.
+
+    Файл открывается на дозапись, поэтому лог сохраняется между перезапусками.
+    Файл ротируется по размеру или по истечении rotate_interval с момента его
+    создания; этот момент хранится рядом, в файле <имя>.opened.
+    """
+
+    def __init__(
+        self,
+        log_queue: queue.Queue,
+        path,
+        formatter: logging.Formatter,
+        batch_size: int = None,
+        flush_interval: float = None,
+        max_bytes: int = None,
+        rotate_interval: float = None,
+    ):
+        super().__init__(name="jsonl-writer", daemon=True)
+        self.queue = log_queue
+        self.path = pathlib.Path(path)
+        self.formatter = formatter
+        self.batch_size = batch_size or settings.LOG_BATCH_SIZE
+        self.flush_interval = flush_interval or settings.LOG_FLUSH_INTERVAL
+        self.max_bytes = max_bytes or settings.LOG_MAX_BYTES
+        self.rotate_interval = rotate_interval or settings.LOG_ROTATE_INTERVAL
+        self._stop_event = threading.Event()
+        self._opened_path = self.path.with_name(self.path.name + ".opened")
+        self._opened_at = self._read_opened_at() if self.path.exists() else None
+
+    def _read_opened_at(self) -> float:
+        try:
+            return float(self._opened_path.read_text())
+        except (OSError, ValueError):
+            # лог старше этой отметки: считаем его открытым сейчас
+            return self._mark_opened()
+
+    def _mark_opened(self) -> float:
+        self._opened_at = time.time()
+        try:
+            self._opened_path.write_text(repr(self._opened_at))
+        except OSError as e:
+            logging.getLogger(__name__).error("Не удалось сохранить время открытия лога: %s", e)
+        return self._opened_at
+
+    def _rotate_if_needed(self, incoming: int):
+        if not self.path.exists():
+            self._mark_opened()
+            return
+        too_big = self.path.stat().st_size + incoming > self.max_bytes
+        too_old = time.time() - self._opened_at > self.rotate_interval
+        if too_big or too_old:
+            suffix = datetime.now().strftime("%Y%m%d-%H%M%S")
+            self.path.rename(self.path.with_name(f"{self.path.stem}.{suffix}{self.path.suffix}"))
+            self._mark_opened()
+
+    def _write(self, batch: List[logging.LogRecord]):
+        if not batch:
+            return
+        data = "".join(self.formatter.format(record) + "\n" for record in batch).encode("utf-8")
+        self._rotate_if_needed(len(data))
+        with open(self.path, "ab") as f:
+            f.write(data)
+
+    def run(self):
+        batch: List[logging.LogRecord] = []
+        deadline = time.monotonic() + self.flush_interval
+        while not (self._stop_event.is_set() and self.queue.empty()):
+            try:
+                batch.append(self.queue.get(timeout=max(deadline - time.monotonic(), 0.01)))
+            except queue.Empty:
+                pass
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                try:
+                    self._write(batch)
+                except OSError as e:
+                    logging.getLogger(__name__).error("Не удалось записать лог: %s", e)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+        self._write(batch)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def setup_json_logging(path, formatter: Optional[logging.Formatter] = None) -> logging.Handler:
+    """Возвращает неблокирующий handler, записи которого пишет JsonlWriter."""
+    log_queue: queue.Queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+    writer = JsonlWriter(log_queue, path, formatter or JsonLogFormatter())
+    writer.start()
+    atexit.register(writer.stop)
+    return NonBlockingQueueHandler(log_queue)
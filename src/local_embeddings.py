@@ -0,0 +1,45 @@
+import zlib
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+import src.settings as settings
+from src.embeddings_cache import normalize_text
+
+
+class HashingEmbeddings(Embeddings):
+    """Локальные эмбеддинги без сети: символьные n-граммы, хэшированные в вектор.
+
+    Качество ниже, чем у GigaChat, но вектор считается за доли миллисекунды на CPU,
+    поэтому такие эмбеддинги годятся как запасной путь поиска.
+    """
+
+    def __init__(self, dim: int = None, ngram_range=(3, 5)):
+        self.dim = dim or settings.LOCAL_EMBEDDINGS_DIM
+        self.ngram_range = ngram_range
+
+    def _embed(self, text: str) -> List[float]:
+        text = f" {normalize_text(text).replace('ё', 'е')} "
+        hashes = [
+            zlib.crc32(text[i : i + n].encode("utf-8"))
+            for n in range(self.ngram_range[0], self.ngram_range[1] + 1)
+            for i in range(len(text) - n + 1)
+        ]
+        vector = np.zeros(self.dim, dtype=np.float32)
+        if hashes:
+            hashes = np.asarray(hashes, dtype=np.uint32)
+            # знак из старшего бита уменьшает искажение от коллизий
+            signs = np.where(hashes >> 31, -1.0, 1.0).astype(np.float32)
+            vector = np.bincount(hashes % self.dim, weights=signs, minlength=self.dim)
+            vector = vector.astype(np.float32)
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+        return vector.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
@@ -0,0 +1,100 @@
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+import src.settings as settings
+from src import metrics
+
+
+class MatrixRetriever(BaseRetriever):
+    """Точный поиск по нормированной матрице векторов всех чанков одним умножением.
+
+    Корпус небольшой, поэтому полный перебор быстрее и точнее обхода FAISS, а MMR
+    и порог по косинусной близости считаются честно на тех же векторах.
+    """
+
+    embeddings: Embeddings
+    documents: List[Document]
+    matrix: np.ndarray
+    k: int = settings.RETRIEVER_K
+    fetch_k: int = settings.RETRIEVER_FETCH_K
+    lambda_mult: float = settings.RETRIEVER_LAMBDA_MULT
+    score_threshold: float = settings.RETRIEVER_SCORE_THRESHOLD
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @classmethod
+    def from_faiss(cls, db, embeddings: Optional[Embeddings] = None, **kwargs):
+        n = db.index.ntotal
+        vectors = np.ascontiguousarray(db.index.reconstruct_n(0, n), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        documents = [db.docstore.search(db.index_to_docstore_id[i]) for i in range(n)]
+        return cls(
+            embeddings=embeddings or db.embeddings,
+            documents=documents,
+            matrix=vectors / norms,
+            **kwargs,
+        )
+
+    def _mmr(self, candidates: np.ndarray, scores: np.ndarray, k: int) -> List[int]:
+        vectors = self.matrix[candidates]
+        similarity = vectors @ vectors.T
+        selected = [0]
+        # максимальная близость каждого кандидата к уже выбранным
+        redundancy = similarity[0].copy()
+        while len(selected) < min(k, len(candidates)):
+            mmr = self.lambda_mult * scores - (1 - self.lambda_mult) * redundancy
+            mmr[selected] = -np.inf
+            best = int(np.argmax(mmr))
+            selected.append(best)
+            np.maximum(redundancy, similarity[best], out=redundancy)
+        return selected
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = None) -> List[Document]:
+        with metrics.timer("vector_search_seconds"):
+            return self._search(embedding, k or self.k)
+
+    def _search(self, embedding: List[float], k: int) -> List[Document]:
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query /= norm
+        scores = self.matrix @ query
+
+        fetch_k = min(max(self.fetch_k, k), len(scores))
+        if fetch_k < len(scores):
+            candidates = np.argpartition(-scores, fetch_k - 1)[:fetch_k]
+        else:
+            candidates = np.arange(len(scores))
+        candidates = candidates[np.argsort(-scores[candidates])]
+        candidates = candidates[scores[candidates] >= self.score_threshold]
+        if not len(candidates):
+            return []
+
+        if self.lambda_mult >= 1:
+            chosen = candidates[:k]
+        else:
+            chosen = candidates[self._mmr(candidates, scores[candidates], k)]
+        return [self.documents[i] for i in chosen]
+
+    def similarity_search(self, query: str, k: int = None) -> List[Document]:
+        return self.similarity_search_by_vector(self.embeddings.embed_query(query), k)
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return self.similarity_search(query)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return self.similarity_search_by_vector(await self.embeddings.aembed_query(query))
@@ -3,11 +3,17 @@
 
 
 # преобразование списков объектов в простые типы
+import time
+from typing import List, Optional, Tuple
+
+import orjson
 from langchain.memory import ConversationBufferMemory
 from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.chat_history import BaseChatMessageHistory
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
 
+from src.bounded_memory import SummaryBufferMemory
+
 
 def list_to_dict(instance):
     if not instance:
@@ -56,7 +62,16 @@ def deserialize(dictionary):
     dict_input_key = dictionary["input_key"]
     dict_memory_key = dictionary["memory_key"]
 
-    cbm = ConversationBufferMemory(memory_key=dict_memory_key, input_key=dict_input_key)
+    if "moving_summary_buffer" in dictionary:
+        cbm = SummaryBufferMemory(
+            memory_key=dict_memory_key,
+            input_key=dict_input_key,
+            moving_summary_buffer=dictionary["moving_summary_buffer"],
+            max_token_limit=dictionary["max_token_limit"],
+            keep_last_turns=dictionary["keep_last_turns"],
+        )
+    else:
+        cbm = ConversationBufferMemory(memory_key=dict_memory_key, input_key=dict_input_key)
     cbm.chat_memory = ChatMessageHistory()
 
     for item in dictionary["chat_memory"]["messages"]:
@@ -67,3 +82,124 @@ def deserialize(dictionary):
             aim = AIMessage(item["content"])
             cbm.chat_memory.add_message(aim)
     return cbm
+
+
+# компактное состояние истории: реплики хранятся строками JSON [role, content, ts]
+# в одном bytes, новые реплики дописываются в конец без повторной сериализации старых
+HISTORY_VERSION = 2
+
+_SUMMARY_FIELDS = ("moving_summary_buffer", "max_token_limit", "keep_last_turns")
+_MESSAGE_CLASSES = {"human": HumanMessage, "ai": AIMessage}
+
+
+def encode_turn(role: str, content: str, ts: float = None) -> bytes:
+    return orjson.dumps([role, content, ts], option=orjson.OPT_APPEND_NEWLINE)
+
+
+def encode(memory) -> dict:
+    """Состояние памяти в версии HISTORY_VERSION."""
+    if memory is None:
+        return {}
+    state = {
+        "version": HISTORY_VERSION,
+        "memory_key": memory.memory_key,
+        "input_key": memory.input_key,
+        "count": 0,
+        "messages": b"",
+    }
+    if isinstance(memory, SummaryBufferMemory):
+        state.update({name: getattr(memory, name) for name in _SUMMARY_FIELDS})
+    return append_messages(state, memory.chat_memory.messages)
+
+
+def upgrade(dictionary: dict) -> dict:
+    """Переводит состояние из прежнего формата serialize в HISTORY_VERSION."""
+    if not dictionary or "version" in dictionary:
+        return dictionary
+    state = {
+        "version": HISTORY_VERSION,
+        "memory_key": dictionary["memory_key"],
+        "input_key": dictionary["input_key"],
+    }
+    if "moving_summary_buffer" in dictionary:
+        state.update({name: dictionary[name] for name in _SUMMARY_FIELDS})
+    messages = dictionary["chat_memory"]["messages"]
+    state["messages"] = b"".join(encode_turn(m["type"], m["content"]) for m in messages)
+    state["count"] = len(messages)
+    return state
+
+
+def append_turn(state: dict, role: str, content: str, ts: float = None) -> dict:
+    """Дописывает реплику в состояние; старые реплики не разбираются и не кодируются заново."""
+    state = upgrade(state)
+    state["messages"] += encode_turn(role, content, time.time() if ts is None else ts)
+    state["count"] += 1
+    return state
+
+
+def append_messages(state: dict, messages: List[BaseMessage]) -> dict:
+    state = upgrade(state)
+    now = time.time()
+    state["messages"] += b"".join(
+        encode_turn(m.type, m.content, m.additional_kwargs.get("ts", now)) for m in messages
+    )
+    state["count"] += len(messages)
+    return state
+
+
+def read_turns(state: dict) -> List[Tuple[str, str, Optional[float]]]:
+    """Реплики состояния любой версии в виде (role, content, ts)."""
+    if not state:
+        return []
+    if "version" not in state:
+        return [(m["type"], m["content"], None) for m in state["chat_memory"]["messages"]]
+    data = state["messages"]
+    if not data:
+        return []
+    # строки JSON без переводов строк внутри, поэтому весь список разбирается одним вызовом
+    return orjson.loads(b"[" + data[:-1].replace(b"\n", b",") + b"]")
+
+
+def drop_turns(state: dict, n: int) -> dict:
+    """Удаляет первые n реплик, отрезая байты до n-го перевода строки."""
+    state = upgrade(state)
+    data = state["messages"]
+    end = 0
+    for _ in range(min(n, state["count"])):
+        end = data.index(b"\n", end) + 1
+    state["messages"] = data[end:]
+    state["count"] -= min(n, state["count"])
+    return state
+
+
+def decode(state: dict):
+    """Память из состояния HISTORY_VERSION или прежнего формата serialize."""
+    if not state:
+        return None
+    if "version" not in state:
+        return deserialize(state)
+    if "moving_summary_buffer" in state:
+        memory = SummaryBufferMemory(
+            memory_key=state["memory_key"],
+            input_key=state["input_key"],
+            **{name: state[name] for name in _SUMMARY_FIELDS},
+        )
+    else:
+        memory = ConversationBufferMemory(
+            memory_key=state["memory_key"], input_key=state["input_key"]
+        )
+    # реплики записаны encode, поэтому проверки pydantic пропускаются (construct и
+    # присваивание списка вместо ChatMessageHistory(messages=...)): на длинной
+    # истории они занимали большую часть времени. Метка времени возвращается в
+    # additional_kwargs, иначе полная перезапись состояния (ChatState.update)
+    # проставила бы старым репликам текущее время
+    history = ChatMessageHistory()
+    history.messages = [
+        _MESSAGE_CLASSES[role].construct(content=content, additional_kwargs={"ts": ts})
+        if ts is not None
+        else _MESSAGE_CLASSES[role].construct(content=content)
+        for role, content, ts in read_turns(state)
+        if role in _MESSAGE_CLASSES
+    ]
+    memory.chat_memory = history
+    return memory
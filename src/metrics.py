@@ -0,0 +1,204 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging import getLogger
+from typing import Any, Dict, List, Optional, Sequence, Set
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+_logger = getLogger(__name__)
+
+PREFIX = "deposit_bot_"
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+TOKENS_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+# префикс сообщения on_text со статистикой маршрутизации (src.multi_chain),
+# лежит здесь, чтобы обработчик колбэков не импортировал langchain.chains
+ROUTE_STATS_PREFIX = "route_stats: "
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str) -> List[str]:
+        lines = [f"# TYPE {name} histogram"]
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum {self.sum}")
+        lines.append(f"{name}_count {self.count}")
+        return lines
+
+
+class Registry:
+    """Гистограммы и счетчики в памяти процесса, выдаются в текстовом формате Prometheus."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms: Dict[str, Histogram] = {}
+        self.counters: Dict[str, float] = {}
+
+    def observe(self, name: str, value: float, buckets: Sequence[float] = SECONDS_BUCKETS):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(buckets)
+            histogram.observe(value)
+
+    def inc(self, name: str, amount: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, histogram in sorted(self.histograms.items()):
+                lines += histogram.render(PREFIX + name)
+            for name, value in sorted(self.counters.items()):
+                lines += [f"# TYPE {PREFIX}{name} counter", f"{PREFIX}{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def observe(name: str, value: float, buckets: Sequence[float] = SECONDS_BUCKETS):
+    REGISTRY.observe(name, value, buckets)
+
+
+def inc(name: str, amount: float = 1):
+    REGISTRY.inc(name, amount)
+
+
+@contextmanager
+def timer(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+class MetricsHandler(BaseCallbackHandler):
+    """Время этапов цепочки и число токенов по колбэкам LangChain.
+
+    Этапы: retrieval (эмбеддинг запроса и поиск во внешнем ретривере), prompt_build
+    (от старта LLMChain до вызова модели), llm_ttft (до первого токена при стриминге)
+    и llm_total.
+    """
+
+    run_inline = True
+
+    def __init__(self):
+        self._starts: Dict[UUID, float] = {}
+        self._first_token: Dict[UUID, bool] = {}
+        self._retrievers: Set[UUID] = set()
+
+    def on_retriever_start(
+        self, serialized, query, *, run_id: UUID, parent_run_id=None, **kwargs: Any
+    ):
+        # вложенные ретриверы (гибридный внутри запасного и т.п.) входят во время
+        # внешнего: поиск на вопрос учитывается один раз
+        nested = parent_run_id in self._retrievers
+        self._retrievers.add(run_id)
+        if not nested:
+            self._starts[run_id] = time.perf_counter()
+
+    def on_retriever_end(self, documents, *, run_id: UUID, **kwargs: Any):
+        self._retrievers.discard(run_id)
+        start = self._starts.pop(run_id, None)
+        if start is not None:
+            observe("retrieval_seconds", time.perf_counter() - start)
+
+    def on_retriever_error(self, error, *, run_id: UUID, **kwargs: Any):
+        self._retrievers.discard(run_id)
+        if self._starts.pop(run_id, None) is not None:
+            inc("retrieval_errors_total")
+
+    def on_chain_start(self, serialized, inputs, *, run_id: UUID, **kwargs: Any):
+        class_path = (serialized or {}).get("id") or []
+        if kwargs.get("name") == "LLMChain" or class_path[-1:] == ["LLMChain"]:
+            self._starts[run_id] = time.perf_counter()
+
+    def on_chain_end(self, outputs, *, run_id: UUID, **kwargs: Any):
+        self._starts.pop(run_id, None)
+
+    def on_chain_error(self, error, *, run_id: UUID, **kwargs: Any):
+        self._starts.pop(run_id, None)
+
+    def _llm_start(self, run_id: UUID, parent_run_id: Optional[UUID]):
+        now = time.perf_counter()
+        chain_start = self._starts.get(parent_run_id)
+        if chain_start is not None:
+            observe("prompt_build_seconds", now - chain_start)
+        self._starts[run_id] = now
+        self._first_token[run_id] = True
+
+    def on_chat_model_start(
+        self, serialized, messages, *, run_id: UUID, parent_run_id=None, **kwargs: Any
+    ):
+        self._llm_start(run_id, parent_run_id)
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, parent_run_id=None, **kwargs):
+        self._llm_start(run_id, parent_run_id)
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any):
+        if self._first_token.pop(run_id, False):
+            observe("llm_ttft_seconds", time.perf_counter() - self._starts[run_id])
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any):
+        self._first_token.pop(run_id, None)
+        start = self._starts.pop(run_id, None)
+        if start is not None:
+            observe("llm_total_seconds", time.perf_counter() - start)
+        usage = (response.llm_output or {}).get("token_usage")
+        if usage is not None:
+            if not isinstance(usage, dict):
+                usage = usage.dict()
+            for key in ("prompt_tokens", "completion_tokens"):
+                if usage.get(key) is not None:
+                    observe(key, usage[key], TOKENS_BUCKETS)
+                    inc(f"{key}_total", usage[key])
+
+    def on_llm_error(self, error, *, run_id: UUID, **kwargs: Any):
+        self._first_token.pop(run_id, None)
+        self._starts.pop(run_id, None)
+        inc("llm_errors_total")
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(host: str, port: int) -> ThreadingHTTPServer:
+    """Отдает /metrics из отдельного потока."""
+    server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    _logger.info("Метрики доступны на http://%s:%s/metrics", host, port)
+    return server
@@ -2,16 +2,28 @@
 
 from __future__ import annotations
 
+import json
+import time
 from abc import ABC
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
+import numpy as np
 from langchain.chains import ConversationChain
 from langchain.chains.base import Chain
-from langchain.chains.router.base import MultiRouteChain
+from langchain.chains.router.base import MultiRouteChain, RouterChain
 from langchain.chains.router.llm_router import LLMRouterChain, RouterOutputParser
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForChainRun,
+    CallbackManagerForChainRun,
+)
+from langchain_core.embeddings import Embeddings
 from langchain_core.language_models import BaseLanguageModel
 from langchain_core.prompts import PromptTemplate
 
+import src.settings as settings
+from src.hybrid_retriever import tokenize
+from src.metrics import ROUTE_STATS_PREFIX
+
 MULTI_PROMPT_ROUTER_TEMPLATE = """\
 Учитывая исходный текстовый ввод в языковую модель и историю диалога, выбери наиболее подходящий запрос для \
 ввода. Тебе будут даны имена доступных запросов и описание того, для чего лучше всего подходит \
@@ -43,6 +55,125 @@ MULTI_PROMPT_ROUTER_TEMPLATE = """\
 """
 
 
+class LocalRouterChain(RouterChain):
+    """Выбор цепочки без обращения к LLM: по ключевым словам и по близости
+    эмбеддинга вопроса к примерам вопросов каждой цепочки.
+
+    Если уверенность ниже порога, решение принимает fallback (LLMRouterChain).
+    """
+
+    prototypes: Dict[str, List[str]]
+    keywords: Dict[str, List[str]] = {}
+    embeddings: Optional[Embeddings] = None
+    fallback: Optional[RouterChain] = None
+    threshold: float = settings.ROUTER_CONFIDENCE_THRESHOLD
+    routed: int = 0
+    fallbacks: int = 0
+
+    # не поля модели: в langchain_core на pydantic v1 присвоение им через self
+    # падает с "object has no field", поэтому значения пишутся мимо проверки полей
+    _names: List[str] = []
+    _matrix: Optional[np.ndarray] = None
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def input_keys(self) -> List[str]:
+        return ["question"]
+
+    def _by_keywords(self, question: str) -> Tuple[Optional[str], float]:
+        terms = set(tokenize(question))
+        hits = {
+            name: len(terms & set(tokenize(" ".join(words))))
+            for name, words in self.keywords.items()
+        }
+        hits = {name: count for name, count in hits.items() if count}
+        if not hits:
+            return None, 0.0
+        ranked = sorted(hits.values(), reverse=True)
+        if len(ranked) > 1 and ranked[0] == ranked[1]:
+            return None, 0.0
+        return max(hits, key=hits.get), 1.0
+
+    def _prepare(self, vectors: List[List[float]]):
+        matrix = np.asarray(vectors, dtype=np.float32)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+        object.__setattr__(self, "_matrix", matrix)
+
+    def _by_vector(self, vector: List[float]) -> Tuple[Optional[str], float]:
+        query = np.asarray(vector, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        scores = self._matrix @ query
+        best = int(np.argmax(scores))
+        return self._names[best], float(scores[best])
+
+    def _prototype_texts(self) -> List[str]:
+        names = [name for name, texts in self.prototypes.items() for _ in texts]
+        object.__setattr__(self, "_names", names)
+        return [text for texts in self.prototypes.values() for text in texts]
+
+    def _stats(self, result: Dict[str, Any], method: str, confidence: float, start: float) -> str:
+        self.routed += 1
+        self.fallbacks += method == "llm"
+        stats = {
+            "destination": result["destination"],
+            "method": method,
+            "confidence": round(confidence, 3),
+            "latency": round(time.perf_counter() - start, 4),
+            "fallback_rate": round(self.fallbacks / self.routed, 3),
+        }
+        return ROUTE_STATS_PREFIX + json.dumps(stats, ensure_ascii=False)
+
+    def _call(
+        self, inputs: Dict[str, Any], run_manager: Optional[CallbackManagerForChainRun] = None
+    ) -> Dict[str, Any]:
+        _run_manager = run_manager or CallbackManagerForChainRun.get_noop_manager()
+        start = time.perf_counter()
+        destination, confidence = self._by_keywords(inputs["question"])
+        method = "keywords"
+        if destination is None and self.embeddings is not None:
+            if self._matrix is None:
+                self._prepare(self.embeddings.embed_documents(self._prototype_texts()))
+            vector = self.embeddings.embed_query(inputs["question"])
+            destination, confidence = self._by_vector(vector)
+            method = "embeddings"
+        if confidence >= self.threshold or self.fallback is None:
+            result = {"destination": destination, "next_inputs": dict(inputs)}
+        else:
+            result = self.fallback(
+                inputs, callbacks=_run_manager.get_child(), return_only_outputs=True
+            )
+            method = "llm"
+        _run_manager.on_text(self._stats(result, method, confidence, start))
+        return result
+
+    async def _acall(
+        self,
+        inputs: Dict[str, Any],
+        run_manager: Optional[AsyncCallbackManagerForChainRun] = None,
+    ) -> Dict[str, Any]:
+        _run_manager = run_manager or AsyncCallbackManagerForChainRun.get_noop_manager()
+        start = time.perf_counter()
+        destination, confidence = self._by_keywords(inputs["question"])
+        method = "keywords"
+        if destination is None and self.embeddings is not None:
+            if self._matrix is None:
+                self._prepare(await self.embeddings.aembed_documents(self._prototype_texts()))
+            vector = await self.embeddings.aembed_query(inputs["question"])
+            destination, confidence = self._by_vector(vector)
+            method = "embeddings"
+        if confidence >= self.threshold or self.fallback is None:
+            result = {"destination": destination, "next_inputs": dict(inputs)}
+        else:
+            result = await self.fallback.acall(
+                inputs, callbacks=_run_manager.get_child(), return_only_outputs=True
+            )
+            method = "llm"
+        await _run_manager.on_text(self._stats(result, method, confidence, start))
+        return result
+
+
 class MultiChain(MultiRouteChain, ABC):
     """A multi-route chain that uses an LLM router chain to choose amongst chains."""
 
@@ -54,11 +185,17 @@ class MultiChain(MultiRouteChain, ABC):
     def from_chains(
         cls,
         llm: BaseLanguageModel,
-        chain_infos: List[Dict[str, Union[str, Chain]]],
+        chain_infos: List[Dict[str, Union[str, List[str], Chain]]],
         default_chain: Optional[Chain] = None,
+        router: str = "llm",
+        embeddings: Optional[Embeddings] = None,
         **kwargs: Any,
     ) -> MultiChain:
-        """Convenience constructor for instantiating from destination prompts."""
+        """Convenience constructor for instantiating from destination prompts.
+
+        router="local" routes with LocalRouterChain using the optional "examples" and
+        "keywords" lists of chain_infos, falling back to the LLM router when unsure.
+        """
         destinations = [f"{p['name']}: {p['description']}" for p in chain_infos]
         destinations_str = "\n\n".join(destinations)
         router_template = MULTI_PROMPT_ROUTER_TEMPLATE.format(destinations=destinations_str)
@@ -68,6 +205,15 @@ class MultiChain(MultiRouteChain, ABC):
             output_parser=RouterOutputParser(next_inputs_inner_key="question"),
         )
         router_chain = LLMRouterChain.from_llm(llm, router_prompt)
+        if router == "local":
+            router_chain = LocalRouterChain(
+                prototypes={
+                    p["name"]: list(p.get("examples") or [p["description"]]) for p in chain_infos
+                },
+                keywords={p["name"]: list(p["keywords"]) for p in chain_infos if p.get("keywords")},
+                embeddings=embeddings,
+                fallback=router_chain,
+            )
         destination_chains = {}
         for c_info in chain_infos:
             name = c_info["name"]
@@ -0,0 +1,258 @@
+import asyncio
+import pathlib
+import pickle
+import sqlite3
+import threading
+from logging import getLogger
+from typing import Any, Dict, Optional, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+import src.settings as settings
+
+_logger = getLogger(__name__)
+
+CHAT_DATA = "chat_data"
+USER_DATA = "user_data"
+BOT_DATA = "bot_data"
+CALLBACK_DATA = "callback_data"
+CONVERSATIONS = "conversations"
+META = "meta"
+PICKLE_IMPORTED = "pickle_imported"
+
+
+class _LegacyUnpickler(pickle.Unpickler):
+    """Читает файл PicklePersistence без объекта бота: ссылки на бота становятся None."""
+
+    def persistent_load(self, pid: str) -> None:
+        return None
+
+
+def read_pickle_persistence(path: pathlib.Path) -> Dict[Tuple[str, str], bytes]:
+    """Записи файла PicklePersistence (single_file) в виде строк таблицы data."""
+    with path.open("rb") as f:
+        data = _LegacyUnpickler(f).load()
+    rows = {}
+    for kind in (CHAT_DATA, USER_DATA):
+        for key, value in (data.get(kind) or {}).items():
+            rows[(kind, str(key))] = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    for kind in (BOT_DATA, CALLBACK_DATA):
+        if data.get(kind):
+            rows[(kind, "")] = pickle.dumps(data[kind], protocol=pickle.HIGHEST_PROTOCOL)
+    for name, conversations in (data.get(CONVERSATIONS) or {}).items():
+        rows[(CONVERSATIONS, name)] = pickle.dumps(conversations, protocol=pickle.HIGHEST_PROTOCOL)
+    return rows
+
+
+class SQLitePersistence(BasePersistence):
+    """Persistence для python-telegram-bot: одна строка SQLite (WAL) на чат.
+
+    Данные чатов и пользователей читаются при первом обращении к ним, на диск
+    пишутся только изменившиеся записи одной транзакцией на цикл сохранения.
+    Файл прежней PicklePersistence (legacy_path) при первом подключении
+    переносится в базу один раз; записи, уже бывшие в базе, не перезаписываются.
+    """
+
+    def __init__(
+        self,
+        filepath=None,
+        store_data: Optional[PersistenceInput] = None,
+        update_interval: float = 60,
+        compact_interval: float = None,
+        legacy_path=None,
+    ):
+        super().__init__(store_data=store_data, update_interval=update_interval)
+        self.filepath = pathlib.Path(filepath or settings.PERSISTENCE_PATH)
+        self.legacy_path = pathlib.Path(legacy_path or settings.LEGACY_PERSISTENCE_PATH)
+        self.compact_interval = compact_interval or settings.PERSISTENCE_COMPACT_INTERVAL
+
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._loaded: Dict[Tuple[str, int], bool] = {}
+        self._written: Dict[Tuple[str, str], int] = {}
+        self._dirty: Dict[Tuple[str, str], bytes] = {}
+        self._write_task: Optional[asyncio.Task] = None
+        self._compact_task: Optional[asyncio.Task] = None
+        self._conversations: Dict[str, Dict] = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.filepath.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.filepath), check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS data ("
+                "kind TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, "
+                "PRIMARY KEY (kind, key))"
+            )
+            self._conn.commit()
+            self._import_pickle(self._conn)
+        return self._conn
+
+    def _import_pickle(self, conn: sqlite3.Connection):
+        if not self.legacy_path.is_file():
+            return
+        imported = conn.execute(
+            "SELECT 1 FROM data WHERE kind = ? AND key = ?", (META, PICKLE_IMPORTED)
+        ).fetchone()
+        if imported:
+            return
+        try:
+            rows = read_pickle_persistence(self.legacy_path)
+        except Exception as e:
+            # без отметки об импорте: попытка повторится при следующем запуске
+            _logger.error("Не удалось прочитать %s: %r", self.legacy_path, e)
+            return
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO data (kind, key, value) VALUES (?, ?, ?)",
+                [(kind, key, value) for (kind, key), value in rows.items()],
+            )
+            conn.execute(
+                "INSERT INTO data (kind, key, value) VALUES (?, ?, ?)",
+                (META, PICKLE_IMPORTED, str(self.legacy_path).encode("utf-8")),
+            )
+        _logger.warning("Перенесено %d записей из %s", len(rows), self.legacy_path)
+
+    def _read(self, kind: str, key: str) -> Any:
+        with self._lock:
+            row = (
+                self._connect()
+                .execute("SELECT value FROM data WHERE kind = ? AND key = ?", (kind, key))
+                .fetchone()
+            )
+        if row is None:
+            return None
+        self._written[(kind, key)] = hash(row[0])
+        return pickle.loads(row[0])
+
+    def _write_rows(self, rows: Dict[Tuple[str, str], Optional[bytes]]):
+        upserts = [(kind, key, value) for (kind, key), value in rows.items() if value is not None]
+        deletes = [(kind, key) for (kind, key), value in rows.items() if value is None]
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO data (kind, key, value) VALUES (?, ?, ?)", upserts
+                )
+                conn.executemany("DELETE FROM data WHERE kind = ? AND key = ?", deletes)
+
+    def _compact(self):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            total_pages = conn.execute("PRAGMA page_count").fetchone()[0]
+            if total_pages and free_pages / total_pages > 0.25:
+                conn.execute("VACUUM")
+
+    def _schedule(self, kind: str, key: str, data: Any):
+        value = None if data is None else pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        if value is not None and self._written.get((kind, key)) == hash(value):
+            return
+        self._dirty[(kind, key)] = value
+        if self._write_task is None or self._write_task.done():
+            self._write_task = asyncio.create_task(self._write_dirty())
+        if self._compact_task is None:
+            self._compact_task = asyncio.create_task(self._compact_periodically())
+
+    async def _write_dirty(self):
+        # все update_* одного цикла сохранения успевают попасть в одну транзакцию
+        await asyncio.sleep(0)
+        while self._dirty:
+            rows, self._dirty = self._dirty, {}
+            await asyncio.to_thread(self._write_rows, rows)
+            for (kind, key), value in rows.items():
+                if value is None:
+                    self._written.pop((kind, key), None)
+                else:
+                    self._written[(kind, key)] = hash(value)
+
+    async def _compact_periodically(self):
+        while True:
+            await asyncio.sleep(self.compact_interval)
+            try:
+                await asyncio.to_thread(self._compact)
+            except sqlite3.Error as e:
+                _logger.warning("Не удалось сжать %s: %s", self.filepath, e)
+
+    async def _refresh(self, kind: str, key: int, data: Dict):
+        if self._loaded.get((kind, key)):
+            return
+        self._loaded[(kind, key)] = True
+        stored = await asyncio.to_thread(self._read, kind, str(key))
+        if stored:
+            for name, value in stored.items():
+                data.setdefault(name, value)
+
+    async def get_chat_data(self) -> Dict[int, Any]:
+        return {}
+
+    async def get_user_data(self) -> Dict[int, Any]:
+        return {}
+
+    async def get_bot_data(self) -> Any:
+        return await asyncio.to_thread(self._read, BOT_DATA, "") or {}
+
+    async def get_callback_data(self) -> Optional[Any]:
+        return await asyncio.to_thread(self._read, CALLBACK_DATA, "")
+
+    async def get_conversations(self, name: str) -> Dict:
+        if name not in self._conversations:
+            stored = await asyncio.to_thread(self._read, CONVERSATIONS, name)
+            self._conversations[name] = stored or {}
+        return dict(self._conversations[name])
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict):
+        await self._refresh(CHAT_DATA, chat_id, chat_data)
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict):
+        await self._refresh(USER_DATA, user_id, user_data)
+
+    async def refresh_bot_data(self, bot_data: Any):
+        pass
+
+    async def update_chat_data(self, chat_id: int, data: Dict):
+        self._loaded[(CHAT_DATA, chat_id)] = True
+        self._schedule(CHAT_DATA, str(chat_id), data)
+
+    async def update_user_data(self, user_id: int, data: Dict):
+        self._loaded[(USER_DATA, user_id)] = True
+        self._schedule(USER_DATA, str(user_id), data)
+
+    async def update_bot_data(self, data: Any):
+        self._schedule(BOT_DATA, "", data)
+
+    async def update_callback_data(self, data: Any):
+        self._schedule(CALLBACK_DATA, "", data)
+
+    async def update_conversation(self, name: str, key: Tuple, new_state: Optional[object]):
+        await self.get_conversations(name)
+        conversations = self._conversations[name]
+        if new_state is None:
+            conversations.pop(key, None)
+        else:
+            conversations[key] = new_state
+        self._schedule(CONVERSATIONS, name, conversations)
+
+    async def drop_chat_data(self, chat_id: int):
+        self._loaded.pop((CHAT_DATA, chat_id), None)
+        self._schedule(CHAT_DATA, str(chat_id), None)
+
+    async def drop_user_data(self, user_id: int):
+        self._loaded.pop((USER_DATA, user_id), None)
+        self._schedule(USER_DATA, str(user_id), None)
+
+    async def flush(self):
+        if self._compact_task is not None:
+            self._compact_task.cancel()
+            self._compact_task = None
+        if self._write_task is not None:
+            await self._write_task
+        if self._dirty:
+            await self._write_dirty()
+        if self._conn is not None:
+            await asyncio.to_thread(self._compact)
+            self._conn.close()
+            self._conn = None
@@ -1,55 +1,160 @@
-from typing import Optional
+import threading
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
 
-from langchain.chains.retrieval_qa.base import RetrievalQA
-from langchain.memory import ConversationBufferMemory
 from langchain_core.prompts import (
     HumanMessagePromptTemplate,
     SystemMessagePromptTemplate,
     ChatPromptTemplate,
 )
-from langchain_core.vectorstores import VectorStoreRetriever
+from langchain_core.retrievers import BaseRetriever
 
 import src.settings as settings
+from src.bounded_memory import create_memory
 from src.common_prompt import FINAL_PROMPT_START
-from src.documents_db import get_vector_db
+from src.context_compressor import CompressingRetriever, ContextCompressor
+from src.deposit_calculator import RateTable
+from src.documents_db import get_vector_db, update_vector_db
+from src.fallback_retriever import FallbackRetriever
+from src.hybrid_retriever import HybridRetriever
+from src.index_store import IndexStore
+from src.local_embeddings import HashingEmbeddings
+from src.matrix_retriever import MatrixRetriever
+
+if TYPE_CHECKING:
+    from src.history_qa import HistoryRetrievalQA
 
 
 class RAG:
-    _retriever: Optional[VectorStoreRetriever] = None
+    _db = None
+    _retriever: Optional[BaseRetriever] = None
+    _hybrid: Optional[HybridRetriever] = None
+    _corpus_hash: Optional[str] = None
+    _rate_table: Optional[RateTable] = None
+    _prompt: Optional[ChatPromptTemplate] = None
+    _chains: Dict[int, "HistoryRetrievalQA"] = {}
+    # индекс может собираться в фоновом потоке при старте бота
+    _lock = threading.RLock()
 
     def __init__(self, llm, emdeddings, memory=None):
-        self.memory = memory or ConversationBufferMemory(
-            memory_key="history", input_key="question", output_key="text"
-        )
-        self.chain: RetrievalQA = RetrievalQA.from_chain_type(
-            llm,
-            retriever=RAG.get_retriever(emdeddings),
-            chain_type="stuff",
-            # Should be one of "stuff", "map_reduce", # "map_rerank", and "refine". ,
-            return_source_documents=True,
-            verbose=settings.VERBOSE,
-            input_key="question",
-            output_key="text",
-            chain_type_kwargs={
-                "verbose": settings.VERBOSE,
-                "prompt": RAG.get_prompt(),
-                "memory": self.memory,
-                "output_key": "text",
-            },
-        )
+        # память не привязана к цепочке: история передается во входных данных,
+        # а сохраняет ее вызывающий код
+        self.memory = memory or create_memory(llm)
+        self.chain: "HistoryRetrievalQA" = RAG.get_chain(llm, emdeddings)
+
+    @classmethod
+    def get_chain(cls, llm, emdeddings) -> "HistoryRetrievalQA":
+        """Общая для всех чатов цепочка, собирается один раз на процесс и модель."""
+        chain = cls._chains.get(id(llm))
+        if chain is not None:
+            return chain
+        with cls._lock:
+            chain = cls._chains.get(id(llm))
+            if chain is not None:
+                return chain
+            # langchain.chains тяжелый, импортируется при первой сборке цепочки
+            from src.history_qa import HistoryRetrievalQA
+
+            chain = HistoryRetrievalQA.from_chain_type(
+                llm,
+                retriever=cls.get_retriever(emdeddings),
+                chain_type="stuff",
+                # Should be one of "stuff", "map_reduce", # "map_rerank", and "refine". ,
+                return_source_documents=True,
+                verbose=settings.VERBOSE,
+                input_key="question",
+                output_key="text",
+                chain_type_kwargs={
+                    "verbose": settings.VERBOSE,
+                    "prompt": cls.get_prompt(),
+                    "output_key": "text",
+                },
+            )
+            cls._chains[id(llm)] = chain
+        return chain
 
     @classmethod
     def get_retriever(cls, emdeddings):
-        if not cls._retriever:
-            cls._retriever = get_vector_db(emdeddings).as_retriever(
+        if cls._retriever is not None:
+            return cls._retriever
+        with cls._lock:
+            if cls._retriever is None:
+                cls._set_index(get_vector_db(emdeddings))
+        return cls._retriever
+
+    @classmethod
+    def refresh(cls, emdeddings):
+        """Синхронизирует используемый индекс с DOC_PATH и пересобирает все, что
+        построено по нему: BM25, матрицу векторов, таблицу ставок и версию корпуса."""
+        with cls._lock:
+            cls._set_index(update_vector_db(cls._db, emdeddings))
+            for chain in cls._chains.values():
+                chain.retriever = cls._retriever
+
+    @classmethod
+    def _set_index(cls, db):
+        rate_table = RateTable.from_documents(
+            db.docstore.search(doc_id) for doc_id in db.index_to_docstore_id.values()
+        )
+        retriever, hybrid = cls._build_retriever(db)
+        cls._db, cls._rate_table, cls._retriever, cls._hybrid = db, rate_table, retriever, hybrid
+        cls._corpus_hash = (IndexStore().read_manifest() or {}).get("corpus_hash")
+
+    @classmethod
+    def _build_retriever(cls, db) -> Tuple[BaseRetriever, Optional[HybridRetriever]]:
+        if settings.RETRIEVER_MODE == "matrix":
+            retriever = MatrixRetriever.from_faiss(db)
+        else:
+            retriever = db.as_retriever(
                 search_type="mmr",
                 # Can be "similarity" (default), "mmr", or "similarity_score_threshold"
-                search_kwargs={"k": 3, "score_threshold": 0.9, "lambda_mult": 1},
+                search_kwargs={
+                    "k": settings.RETRIEVER_K,
+                    "fetch_k": settings.RETRIEVER_FETCH_K,
+                    "lambda_mult": settings.RETRIEVER_LAMBDA_MULT,
+                },
             )
-        return cls._retriever
+        if settings.LOCAL_EMBEDDINGS_FALLBACK:
+            local_db = get_vector_db(HashingEmbeddings(), settings.LOCAL_INDEX_PATH)
+            if settings.RETRIEVER_MODE == "matrix":
+                # порог подобран под GigaChat, к локальным векторам не применим
+                local_db = MatrixRetriever.from_faiss(local_db, score_threshold=-1.0)
+            retriever = FallbackRetriever(
+                remote_retriever=retriever,
+                embeddings=db.embeddings,
+                local_db=local_db,
+                k=settings.RETRIEVER_K,
+            )
+        hybrid = None
+        if settings.HYBRID_RETRIEVAL:
+            retriever = hybrid = HybridRetriever.from_vector_store(
+                db, retriever, k=settings.RETRIEVER_K
+            )
+        if settings.CONTEXT_COMPRESSION != "off":
+            retriever = CompressingRetriever(
+                base_retriever=retriever, compressor=ContextCompressor()
+            )
+        return retriever, hybrid
 
-    @staticmethod
-    def get_prompt():
+    @classmethod
+    def is_lexically_decisive(cls, question: str) -> bool:
+        """Найдет ли ретривер документы по вопросу без его эмбеддинга."""
+        hybrid = cls._hybrid
+        return hybrid is not None and hybrid.is_decisive(question)
+
+    @classmethod
+    def get_rate_table(cls) -> Optional[RateTable]:
+        """Ставки продуктов из того же корпуса, что и ретривер."""
+        return cls._rate_table
+
+    @classmethod
+    def get_corpus_hash(cls) -> Optional[str]:
+        """Версия корпуса, по которому построен текущий ретривер."""
+        return cls._corpus_hash
+
+    @classmethod
+    def get_prompt(cls):
+        if cls._prompt is not None:
+            return cls._prompt
         system_prompt_template = f"""{FINAL_PROMPT_START}
 ----------------
 При подготовке ответа клиенту используй следующую информацию, как основополагающую.
@@ -62,5 +167,5 @@ class RAG:
             SystemMessagePromptTemplate.from_template(system_prompt_template),
             HumanMessagePromptTemplate.from_template("{question}"),
         ]
-        prompt = ChatPromptTemplate.from_messages(messages)
-        return prompt
+        cls._prompt = ChatPromptTemplate.from_messages(messages)
+        return cls._prompt
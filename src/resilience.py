@@ -0,0 +1,224 @@
+import asyncio
+import random
+import sys
+import time
+from collections import deque
+from logging import getLogger
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+from src import metrics
+
+_logger = getLogger(__name__)
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+class EmptyAnswerError(Exception):
+    """Модель вернула пустой ответ."""
+
+
+class CircuitOpenError(Exception):
+    """GigaChat недоступен, запросы временно не отправляются."""
+
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, (asyncio.TimeoutError, EmptyAnswerError)):
+        return True
+    # исключения клиентов сверяются по уже загруженным модулям: импорт gigachat
+    # и httpx отсюда утяжелил бы старт бота, а пока модуль не загружен, его
+    # исключение и не могло возникнуть
+    gigachat_exceptions = sys.modules.get("gigachat.exceptions")
+    if gigachat_exceptions is not None:
+        if isinstance(exc, gigachat_exceptions.AuthenticationError):
+            return False
+        if isinstance(exc, gigachat_exceptions.ResponseError):
+            # ResponseError(url, status_code, content, headers)
+            status_code = exc.args[1] if len(exc.args) > 1 else None
+            return status_code in RETRYABLE_STATUS_CODES
+    httpx = sys.modules.get("httpx")
+    if httpx is not None:
+        if isinstance(exc, (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError)):
+            return True
+        if isinstance(exc, httpx.HTTPStatusError):
+            return exc.response.status_code in RETRYABLE_STATUS_CODES
+    return False
+
+
+class CircuitBreaker:
+    """После failure_threshold ошибок подряд отклоняет запросы reset_timeout секунд,
+    затем пропускает один пробный запрос."""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def end_probe(self):
+        self._probe_in_flight = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                _logger.warning("GigaChat недоступен, запросы приостановлены")
+            self.opened_at = time.monotonic()
+
+
+class LatencyTracker:
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self.samples = deque(maxlen=size)
+        self.min_samples = min_samples
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+
+    def p95(self) -> Optional[float]:
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+
+class ResiliencePolicy:
+    """Повторы запросов к модели: экспоненциальная задержка со случайным разбросом,
+    общий срок на запрос пользователя, дублирующий запрос при долгом ответе и
+    размыкатель цепи на время недоступности GigaChat.
+
+    factory при каждом вызове должна создавать независимую попытку: при
+    дублировании две попытки выполняются одновременно.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 1.0,
+        max_delay: float = 8.0,
+        deadline: float = 90.0,
+        hedge: bool = False,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.hedge = hedge
+        self.breaker = breaker or CircuitBreaker(5, 30.0)
+        self.latency = LatencyTracker()
+
+    @classmethod
+    def from_settings(cls, giga_settings) -> "ResiliencePolicy":
+        return cls(
+            max_attempts=giga_settings.retry_attempts,
+            base_delay=giga_settings.retry_base_delay,
+            max_delay=giga_settings.retry_max_delay,
+            deadline=giga_settings.request_deadline,
+            hedge=giga_settings.hedge_requests,
+            breaker=CircuitBreaker(
+                giga_settings.breaker_failure_threshold, giga_settings.breaker_reset_timeout
+            ),
+        )
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    async def run(
+        self,
+        factory: Callable[[], Awaitable[T]],
+        on_retry: Optional[Callable[[int, BaseException], Any]] = None,
+    ) -> T:
+        loop = asyncio.get_running_loop()
+        deadline_at = loop.time() + self.deadline
+        attempt = 0
+        while True:
+            probe = self.breaker.state == "half_open"
+            if not self.breaker.allow():
+                metrics.inc("circuit_open_rejections_total")
+                raise CircuitOpenError()
+            try:
+                try:
+                    result = await asyncio.wait_for(
+                        self._attempt(factory), max(deadline_at - loop.time(), 0)
+                    )
+                finally:
+                    # отмененная пробная попытка (CancelledError - не Exception)
+                    # иначе оставила бы размыкатель открытым навсегда
+                    if probe:
+                        self.breaker.end_probe()
+            except Exception as e:
+                retryable = is_retryable(e)
+                # прочие ошибки не связаны с доступностью сервиса и не меняют
+                # состояние размыкателя: ни счетчик отказов, ни его открытие
+                if retryable:
+                    self.breaker.record_failure()
+                delay = self.backoff(attempt + 1)
+                if (
+                    not retryable
+                    or attempt + 1 >= self.max_attempts
+                    or loop.time() + delay >= deadline_at
+                ):
+                    raise
+                if on_retry is not None:
+                    on_retry(attempt, e)
+                attempt += 1
+                metrics.inc("llm_retries_total")
+                await asyncio.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return result
+
+    async def _timed(self, factory: Callable[[], Awaitable[T]]) -> T:
+        start = time.monotonic()
+        result = await factory()
+        self.latency.add(time.monotonic() - start)
+        return result
+
+    async def _attempt(self, factory: Callable[[], Awaitable[T]]) -> T:
+        hedge_after = self.latency.p95() if self.hedge else None
+        if hedge_after is None:
+            return await self._timed(factory)
+
+        tasks = {asyncio.ensure_future(self._timed(factory))}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if not done:
+                _logger.debug("Ответ дольше p95 (%.1f сек.), дублируем запрос", hedge_after)
+                metrics.inc("llm_hedged_requests_total")
+                tasks.add(asyncio.ensure_future(self._timed(factory)))
+            error: Optional[BaseException] = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
@@ -1,10 +1,8 @@
 import pathlib
 from dataclasses import dataclass
+from functools import cached_property
 from typing import Any, Dict
 
-from langchain_community.chat_models.gigachat import GigaChat
-from langchain_community.embeddings.gigachat import GigaChatEmbeddings
-
 
 GIGA_CRED = "MGY5ZDg4YzAtYzRhNS00ZGYyLTk5Y2ItZjQ0ZTFjYTBjZGY5OjJhZDllNGI4LTAwOTQtNDQzNi05ZWQwLWQwN2VjMzU5MWFmYg=="
 # GIGA_CRED = "MGY5ZDg4YzAtYzRhNS00ZGYyLTk5Y2ItZjQ0ZTFjYTBjZGY5OjIxYjFhMzY1LTJiOWEtNGEwNC1hYjhlLThkNDRhMzY4NGFjYw=="
@@ -18,6 +16,103 @@ CHUNK_SIZE = 1400
 CHUNK_OVERLAP = 70
 
 DOC_PATH = str(pathlib.Path(__file__).parent.parent / "data")
+# каталог с сохраненным FAISS индексом и манифестом корпуса
+INDEX_PATH = str(pathlib.Path(__file__).parent.parent / "index")
+# второй индекс на локальных эмбеддингах (src.local_embeddings) для поиска,
+# когда эмбеддинг запроса в GigaChat не укладывается в REMOTE_EMBEDDINGS_BUDGET
+LOCAL_EMBEDDINGS_FALLBACK = True
+LOCAL_INDEX_PATH = str(pathlib.Path(__file__).parent.parent / "index" / "local")
+LOCAL_EMBEDDINGS_DIM = 512
+REMOTE_EMBEDDINGS_BUDGET = 2.0  # сек.
+# кэш разобранного текста документов и число процессов для разбора (None - по числу CPU)
+INGEST_CACHE_PATH = str(pathlib.Path(__file__).parent.parent / "index" / "parsed")
+INGEST_WORKERS = None
+
+# кэш эмбеддингов: LRU в памяти + SQLite на диске
+EMBEDDINGS_CACHE_PATH = str(pathlib.Path(__file__).parent.parent / "index" / "embeddings.sqlite")
+EMBEDDINGS_CACHE_SIZE = 10_000
+EMBEDDINGS_BATCH_SIZE = 16
+EMBEDDINGS_BATCH_DELAY = 0.01  # сек., окно для сбора одновременных запросов в батч
+
+# векторный поиск: "matrix" - точный перебор по матрице векторов в numpy
+# (src.matrix_retriever), "faiss" - MMR средствами FAISS
+RETRIEVER_MODE = "matrix"
+RETRIEVER_K = 3
+RETRIEVER_FETCH_K = 10  # кандидатов для MMR
+RETRIEVER_LAMBDA_MULT = 0.7  # 1 - только близость к запросу, 0 - только разнообразие
+RETRIEVER_SCORE_THRESHOLD = 0.0  # минимальная косинусная близость чанка, только для "matrix"
+
+# гибридный поиск: BM25 + векторный. Если лучший BM25 балл не ниже порога и
+# превосходит второй в MARGIN раз, эмбеддинг запроса не вычисляется ни для поиска,
+# ни для кэша ответов. Порог подобран по корпусу data/: у типичных вопросов лучший
+# балл 4-9.5 и отрыв от второго меньше 1.2 раза, а вопрос о конкретном условии
+# продукта ("Как продлевается СберВклад?") дает 11.9 против 6.7. Баллы BM25 зависят
+# от корпуса, при его заметном изменении порог стоит перепроверить
+HYBRID_RETRIEVAL = True
+LEXICAL_DECISIVE_SCORE = 10.0
+LEXICAL_DECISIVE_MARGIN = 1.5
+
+# сжатие найденного контекста (src.context_compressor): в промпт идут только
+# предложения, ближе всего подходящие к вопросу. "lexical" - по совпадению основ слов,
+# "local" - еще и по локальным эмбеддингам, "off" - чанки целиком
+CONTEXT_COMPRESSION = "lexical"
+CONTEXT_TOKEN_BUDGET = 600  # токенов контекста на запрос, оценка estimate_tokens
+
+# локальная маршрутизация MultiChain: ниже этой уверенности решает LLM
+ROUTER_CONFIDENCE_THRESHOLD = 0.75
+
+# калькулятор доходности (src.deposit_calculator) для вопросов с суммой и сроком:
+# "local" - ответ без LLM, "llm" - модель только формулирует готовый расчет,
+# "off" - такие вопросы идут в RAG как остальные
+CALCULATOR_MODE = "local"
+
+# кэш ответов на первые вопросы диалога
+ANSWER_CACHE_THRESHOLD = 0.95  # минимальная косинусная близость вопросов
+ANSWER_CACHE_TTL = 24 * 60 * 60  # сек.
+ANSWER_CACHE_SIZE = 1000
+
+# объединение одинаковых первых вопросов из разных чатов в один запрос к модели
+SINGLE_FLIGHT = True
+SINGLE_FLIGHT_MAX_WAIT = 60.0  # сек., дольше ожидающий запрос идет к модели сам
+
+# история диалога: "buffer" - вся история, "summary" - последние реплики и сводка
+MEMORY_MODE = "summary"
+MEMORY_MAX_TOKENS = 1500
+MEMORY_KEEP_TURNS = 3
+
+# потоковая отдача ответа правкой сообщения в Telegram
+STREAM_ANSWERS = True
+STREAM_EDIT_INTERVAL = 1.0  # сек., Telegram ограничивает частоту правок в одном чате
+STREAM_PLACEHOLDER = "…"
+
+# параллельная обработка апдейтов бота
+MAX_CONCURRENT_UPDATES = 32
+MAX_PENDING_UPDATES = 256
+
+# JSONL лог вопросов и ответов: пишется фоновым потоком пачками
+JSON_LOG_PATH = str(pathlib.Path(__file__).parent.parent / "deposit_bot.json")
+LOG_QUEUE_SIZE = 10_000
+LOG_BATCH_SIZE = 100
+LOG_FLUSH_INTERVAL = 1.0  # сек.
+LOG_MAX_BYTES = 50 * 1024 * 1024
+LOG_ROTATE_INTERVAL = 24 * 60 * 60  # сек.
+
+# общий на процесс клиент GigaChat для каждого стенда (src.client_pool)
+GIGACHAT_MAX_CONNECTIONS = 50
+GIGACHAT_MAX_KEEPALIVE_CONNECTIONS = 20
+GIGACHAT_KEEPALIVE_EXPIRY = 60.0  # сек.
+GIGACHAT_HTTP2 = True  # только если установлен пакет h2
+GIGACHAT_TOKEN_REFRESH_AHEAD = 120.0  # сек. до истечения токена, когда он обновляется в фоне
+
+# метрики в формате Prometheus: http://METRICS_HOST:METRICS_PORT/metrics
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108
+
+# хранилище состояния чатов бота
+PERSISTENCE_PATH = str(pathlib.Path(__file__).parent.parent.parent.parent / "storage.sqlite")
+# файл прежней PicklePersistence: переносится в PERSISTENCE_PATH при первом запуске
+LEGACY_PERSISTENCE_PATH = str(pathlib.Path(__file__).parent.parent.parent.parent / "storage")
+PERSISTENCE_COMPACT_INTERVAL = 60 * 60  # сек.
 
 TEST_CP_GOOD_PATH = str(pathlib.Path(__file__).parent / "mocks" / "cp_good.json")
 TEST_CP_NOT_CACL_PATH = str(pathlib.Path(__file__).parent / "mocks" / "cp_not_calc.json")
@@ -26,7 +121,23 @@ TEST_CP_BAD_PATH = str(pathlib.Path(__file__).parent / "mocks" / "cp_bad.json")
 
 @dataclass
 class GigaSettings:
-    stand: str = "ext"  # "ext" - внешний(для тестов), "ift", "uat", "prod"
+    stand: str = "ext"  # "ext" - внешний(для тестов), "ift", "uat", "prod", "fake" - без сети
+
+    # повторы запросов к модели, см. src.resilience.ResiliencePolicy
+    retry_attempts: int = 3
+    retry_base_delay: float = 1.0  # сек., задержка растет как base * 2^попытка
+    retry_max_delay: float = 8.0
+    request_deadline: float = 90.0  # сек. на весь запрос пользователя
+    hedge_requests: bool = False  # дублировать запрос, если ответ дольше p95
+    breaker_failure_threshold: int = 5
+    breaker_reset_timeout: float = 30.0
+
+    # задержки заменителей GigaChat для stand="fake" (src.fakes): медиана и разброс
+    # логнормального распределения, сек.
+    fake_llm_latency: float = 5.0
+    fake_llm_latency_sigma: float = 0.5
+    fake_embeddings_latency: float = 0.3
+    fake_embeddings_latency_sigma: float = 0.3
 
     def __post_init__(self):
         model_options: Dict[str, Any] = {
@@ -40,6 +151,11 @@ class GigaSettings:
         }
 
         self.stand = self.stand.lower()
+        self._model_options: Dict[str, Any] = {}
+        self._embeddings_options: Dict[str, Any] = {}
+        if self.stand == "fake":
+            return
+
         if self.stand == "ext":
             base_url = "https://gigachat.devices.sberbank.ru/api/v1"
             auth_url = "https://ngw.devices.sberbank.ru:9443/api/v2/oauth"
@@ -90,5 +206,36 @@ class GigaSettings:
                 "key_file": cert_key_path,
             }
 
-        self.chat_model = GigaChat(**model_options)
-        self.embeddings = GigaChatEmbeddings(**embdeddings_options)
+        self._model_options = model_options
+        self._embeddings_options = embdeddings_options
+
+    # клиенты и их модули создаются при первом обращении; чат и эмбеддинги одного
+    # стенда работают через общий клиент SDK: соединения и токен одни на процесс
+
+    @cached_property
+    def chat_model(self):
+        if self.stand == "fake":
+            from src.fakes import FakeChatModel
+
+            return FakeChatModel(
+                latency_median=self.fake_llm_latency, latency_sigma=self.fake_llm_latency_sigma
+            )
+        from src.client_pool import PooledGigaChat
+
+        return PooledGigaChat(stand=self.stand, **self._model_options)
+
+    @cached_property
+    def embeddings(self):
+        from src.embeddings_cache import CachedEmbeddings
+
+        if self.stand == "fake":
+            from src.fakes import FakeEmbeddings
+
+            embeddings = FakeEmbeddings(
+                self.fake_embeddings_latency, self.fake_embeddings_latency_sigma
+            )
+        else:
+            from src.client_pool import PooledGigaChatEmbeddings
+
+            embeddings = PooledGigaChatEmbeddings(stand=self.stand, **self._embeddings_options)
+        return CachedEmbeddings(embeddings, namespace=self.stand)
@@ -0,0 +1,138 @@
+import asyncio
+from collections import OrderedDict
+from logging import getLogger
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+import src.settings as settings
+from src import metrics
+
+_logger = getLogger(__name__)
+
+T = TypeVar("T")
+
+FAN_IN_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class LeaderCancelled(Exception):
+    """Запрос, результат которого ждали, был отменен."""
+
+
+class SingleFlight:
+    """Одновременные запросы с одинаковым ключом получают один общий результат.
+
+    Первый запрос по ключу выполняет работу, остальные ждут его результат не
+    дольше max_wait и не дольше срока самого ожидающего. Если первый запрос
+    завершился ошибкой или вернул пустой результат (так factory сообщает о
+    неудаче, не бросая исключение), работу выполняет один из ожидающих, а
+    остальные ждут уже его. Если истекло max_wait, ожидающий выполняет работу сам.
+    """
+
+    def __init__(self, max_wait: float = None, max_keys: int = 1000):
+        self.max_wait = settings.SINGLE_FLIGHT_MAX_WAIT if max_wait is None else max_wait
+        self.max_keys = max_keys
+        self.leaders = 0
+        self.shared = 0
+        self.timeouts = 0
+
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._waiting: Dict[str, int] = {}
+        # суммарное число присоединившихся запросов по ключам, последние max_keys
+        self._fan_in: "OrderedDict[str, int]" = OrderedDict()
+
+    async def run(
+        self, key: str, factory: Callable[[], Awaitable[T]], timeout: Optional[float] = None
+    ) -> Tuple[T, bool]:
+        """Результат factory и признак того, что он получен от другого запроса.
+
+        timeout - оставшийся срок вызывающего: если он истек в ожидании чужого
+        результата, бросается asyncio.TimeoutError.
+        """
+        loop = asyncio.get_running_loop()
+        deadline_at = None if timeout is None else loop.time() + timeout
+        while True:
+            future = self._inflight.get(key)
+            if future is None:
+                return await self._lead(key, factory), False
+            max_wait = self.max_wait
+            if deadline_at is not None:
+                max_wait = min(max_wait, max(deadline_at - loop.time(), 0))
+            try:
+                result = await self._follow(key, future, max_wait)
+            except asyncio.TimeoutError:
+                if deadline_at is not None and loop.time() >= deadline_at:
+                    raise
+                # первый запрос завис, ждать его дальше нет смысла
+                return await factory(), False
+            if result is not None:
+                return result[0], True
+            # первый запрос не удался: новым первым становится тот, кто проснулся раньше
+
+    async def _follow(
+        self, key: str, future: asyncio.Future, max_wait: float
+    ) -> Optional[Tuple[Any]]:
+        self._waiting[key] += 1
+        try:
+            result = await asyncio.wait_for(asyncio.shield(future), max_wait)
+        except asyncio.TimeoutError as e:
+            if future.done():
+                # TimeoutError самого первого запроса, а не истекшее ожидание
+                _logger.debug("Общий запрос завершился ошибкой %r: %r", e, key)
+                return None
+            self.timeouts += 1
+            metrics.inc("single_flight_timeouts_total")
+            _logger.debug("Не дождались общего ответа за %.0f сек.: %r", max_wait, key)
+            raise
+        except Exception as e:
+            _logger.debug("Общий запрос завершился ошибкой %r: %r", e, key)
+            return None
+        if not result:
+            _logger.debug("Общий запрос вернул пустой результат: %r", key)
+            return None
+        self.shared += 1
+        metrics.inc("single_flight_shared_total")
+        return (result,)
+
+    async def _lead(self, key: str, factory: Callable[[], Awaitable[T]]) -> T:
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        self._waiting[key] = 0
+        self.leaders += 1
+        try:
+            result = await factory()
+        except asyncio.CancelledError:
+            future.set_exception(LeaderCancelled())
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            # исключение помечается прочитанным, даже если ждущих не было
+            if future.done() and not future.cancelled():
+                future.exception()
+            del self._inflight[key]
+            self._record(key, self._waiting.pop(key))
+        return result
+
+    def _record(self, key: str, followers: int):
+        metrics.observe("single_flight_fan_in", followers + 1, FAN_IN_BUCKETS)
+        if not followers:
+            return
+        _logger.info("Один запрос к модели на %d одинаковых вопросов: %r", followers + 1, key)
+        self._fan_in[key] = self._fan_in.get(key, 0) + followers
+        self._fan_in.move_to_end(key)
+        while len(self._fan_in) > self.max_keys:
+            self._fan_in.popitem(last=False)
+
+    def top_keys(self, n: int = 10) -> List[Tuple[str, int]]:
+        """Ключи с наибольшим числом присоединившихся запросов."""
+        return sorted(self._fan_in.items(), key=lambda item: item[1], reverse=True)[:n]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self._inflight),
+            "leaders": self.leaders,
+            "shared": self.shared,
+            "timeouts": self.timeouts,
+        }
@@ -0,0 +1,85 @@
+import asyncio
+from logging import getLogger
+from typing import Any, Awaitable, Dict
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+import src.settings as settings
+
+_logger = getLogger(__name__)
+
+OVERLOAD_TEXT = "Подождите, пожалуйста: сейчас много обращений. Повторите вопрос через минуту."
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка апдейтов разных чатов с сохранением порядка внутри чата.
+
+    Одновременно выполняется не больше max_concurrent_updates апдейтов, в очереди
+    ждут не больше max_pending_updates. Сверх этого пользователю сразу отвечаем
+    просьбой подождать, а апдейт не обрабатываем.
+    """
+
+    def __init__(self, max_concurrent_updates: int = None, max_pending_updates: int = None):
+        self._concurrent = max_concurrent_updates or settings.MAX_CONCURRENT_UPDATES
+        self.max_pending_updates = max_pending_updates or settings.MAX_PENDING_UPDATES
+        # семафор базового класса берется в process_update до блокировки чата и
+        # ограничивает только очередь (плюс слот для ответа о перегрузке);
+        # одновременную обработку ограничивает _slots уже после блокировки чата
+        super().__init__(self.max_pending_updates + 1)
+        self._slots = asyncio.BoundedSemaphore(self._concurrent)
+        self._pending = 0
+        self._chat_locks: Dict[int, asyncio.Lock] = {}
+        self._chat_waiters: Dict[int, int] = {}
+
+    @property
+    def max_concurrent_updates(self) -> int:
+        return self._concurrent
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        # порядок внутри чата важнее общего лимита, поэтому блокировка чата
+        # берется до слота: ожидающие сообщения одного чата не занимают слоты
+        if self._pending >= self.max_pending_updates:
+            coroutine.close()
+            await self._reply_overloaded(update)
+            return
+
+        chat_id = None
+        if isinstance(update, Update) and update.effective_chat:
+            chat_id = update.effective_chat.id
+
+        self._pending += 1
+        try:
+            if chat_id is None:
+                async with self._slots:
+                    await coroutine
+                return
+
+            lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+            self._chat_waiters[chat_id] = self._chat_waiters.get(chat_id, 0) + 1
+            try:
+                async with lock:
+                    async with self._slots:
+                        await coroutine
+            finally:
+                self._chat_waiters[chat_id] -= 1
+                if not self._chat_waiters[chat_id]:
+                    del self._chat_waiters[chat_id]
+                    del self._chat_locks[chat_id]
+        finally:
+            self._pending -= 1
+
+    async def _reply_overloaded(self, update: object):
+        _logger.warning("Очередь апдейтов переполнена (%s), запрос отклонен", self._pending)
+        if not isinstance(update, Update) or not update.effective_message:
+            return
+        try:
+            await update.effective_message.reply_text(OVERLOAD_TEXT)
+        except Exception as e:
+            _logger.error("Не удалось отправить сообщение о перегрузке: %s", e)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
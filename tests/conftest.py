@@ -0,0 +1,33 @@
+import pytest
+
+import src.settings as config
+from src.settings import GigaSettings
+
+# индексы и кэши тестов - во временном каталоге, рабочий index/ не трогаем
+_PATHS = {
+    "INDEX_PATH": "index",
+    "LOCAL_INDEX_PATH": "index/local",
+    "INGEST_CACHE_PATH": "index/parsed",
+    "EMBEDDINGS_CACHE_PATH": "index/embeddings.sqlite",
+    "PERSISTENCE_PATH": "storage.sqlite",
+    "LEGACY_PERSISTENCE_PATH": "storage",
+    "JSON_LOG_PATH": "deposit_bot.json",
+}
+
+
+@pytest.fixture(scope="session", autouse=True)
+def workdir(tmp_path_factory):
+    path = tmp_path_factory.mktemp("deposit")
+    patch = pytest.MonkeyPatch()
+    for name, relative in _PATHS.items():
+        patch.setattr(config, name, str(path / relative))
+    yield path
+    patch.undo()
+
+
+@pytest.fixture(scope="session")
+def fake_settings():
+    """Заменители GigaChat из src.fakes без искусственных задержек."""
+    return GigaSettings(
+        stand="fake", fake_llm_latency=0.01, fake_llm_latency_sigma=0, fake_embeddings_latency=0
+    )
@@ -0,0 +1,31 @@
+import asyncio
+
+import src.settings as config
+from src.bounded_memory import SummaryBufferMemory
+from src.chat_state import ChatState
+
+
+def test_helper_restores_summary_memory(fake_settings, monkeypatch):
+    monkeypatch.setattr(config, "MEMORY_MODE", "summary")
+    helper = ChatState().restore(fake_settings.chat_model, fake_settings.embeddings, {})
+
+    assert isinstance(helper.memory, SummaryBufferMemory)
+    assert helper.memory._llm is fake_settings.chat_model
+
+
+def test_fold_moves_old_turns_to_summary(fake_settings):
+    memory = SummaryBufferMemory(memory_key="history", input_key="question", keep_last_turns=1)
+    memory.bind_llm(fake_settings.chat_model)
+    folded = []
+    memory.set_fold_listener(lambda summary, messages: folded.extend(messages))
+
+    async def talk():
+        for i in range(3):
+            memory.save_context({"question": f"вопрос {i}"}, {"text": f"ответ {i}"})
+            if memory.fold_task is not None:
+                await memory.fold_task
+
+    asyncio.run(talk())
+    assert [m.content for m in folded] == ["вопрос 0", "ответ 0", "вопрос 1", "ответ 1"]
+    assert memory.moving_summary_buffer
+    assert [m.content for m in memory.chat_memory.messages] == ["вопрос 2", "ответ 2"]
@@ -0,0 +1,43 @@
+from langchain_core.documents import Document
+
+from src.context_compressor import ContextCompressor, split_passages
+
+BODY = """Минимальная гарантированная ставка: Будет начислена на деньги, которые вы в течение \
+последних 2 месяцев сняли или перевели с действующих вкладов. Если не будете снимать деньги до \
+конца срока вклада.
+Открыть вклад можно:
+На свое имя
+На имя другого человека
+Кто может распоряжаться Накопительным счетом?
+Распоряжаться счетом может только тот, на имя которого открыт счет."""
+
+
+def test_continuations_and_lists_stay_with_their_sentence():
+    passages = split_passages(BODY)
+    assert passages[0].endswith("Если не будете снимать деньги до конца срока вклада.")
+    assert passages[1] == "Открыть вклад можно:\nНа свое имя\nНа имя другого человека"
+    assert passages[2:] == [
+        "Кто может распоряжаться Накопительным счетом?",
+        "Распоряжаться счетом может только тот, на имя которого открыт счет.",
+    ]
+
+
+def test_list_is_kept_whole():
+    doc = Document(page_content="Все о накопительном счете.docx\n" + BODY)
+    compressed = ContextCompressor(token_budget=40, mode="lexical").compress(
+        "Как открыть вклад на имя другого человека?", [doc]
+    )
+    content = compressed[0].page_content
+    assert "Открыть вклад можно:\nНа свое имя\nНа имя другого человека" in content
+
+
+def test_heads_are_kept_when_budget_is_exhausted():
+    docs = [
+        Document(page_content="Все о накопительном счете.docx\n" + BODY),
+        Document(page_content="Все о Лучшем.docx\nВклад без пополнения."),
+    ]
+    compressed = ContextCompressor(token_budget=5, mode="lexical").compress("вклад", docs)
+    assert [doc.page_content for doc in compressed] == [
+        "Все о накопительном счете.docx",
+        "Все о Лучшем.docx",
+    ]
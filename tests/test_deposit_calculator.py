@@ -0,0 +1,82 @@
+import pytest
+from langchain_core.documents import Document
+
+from src.deposit_calculator import RateTable, calculate, parse_question
+
+# строки условий в том виде, в каком они лежат в data/
+ACCOUNT = """Все о накопительном счете.docx
+Максимальная ставка по счету: до 16% годовых
+Минимальная сумма счета: без ограничений
+Срок счета: бессрочный
+Условия начисления процентов по счету на выбор клиента: Банк начисляет проценты на сумму \
+остатка на вашем счёте на конец каждого дня в расчётном периоде
+Минимальная гарантированная ставка: 10% базовая ставка
+Максимальная гарантированная ставка: 16% первые 3 месяца, при открытии первого Накопительного счета
+"""
+MANAGE = """RAG Giga.Сбережения на 26.09.docx
+Максимальная ставка по вкладу Управляй +: до 10% годовых
+Минимальная сумма вклада: от 30 000 рублей
+Срок вклада: 3 месяца, 6 месяцев и 1 год
+"""
+SBER = """Все о СберВкладе.docx
+Максимальная ставка по вкладу СберВклад: до 16% годовых
+Минимальная сумма вклада: от 100 000 рублей
+Срок вклада: от 1 месяца до 36 месяцев
+Условия начисления процентов по вкладу на выбор клиента: единовременно, в конце срока вклада \
+или ежемесячно
+Минимальная гарантированная ставка: Равна ставке без учета капитализации на сумму открытия вклада
+"""
+
+
+@pytest.fixture(scope="module")
+def table():
+    return RateTable.from_documents(Document(page_content=text) for text in (ACCOUNT, MANAGE, SBER))
+
+
+@pytest.mark.parametrize(
+    "question",
+    [
+        "Какой доход я получу с 500 000 на 12 месяцев?",
+        "Сколько заработаю на вкладе с 100 тыс. за полгода?",
+        "Сколько процентов набежит на 300 000 за 2 года?",
+    ],
+)
+def test_income_questions_are_calculated(question):
+    assert parse_question(question) is not None
+
+
+@pytest.mark.parametrize(
+    "question",
+    [
+        "Можно ли пополнять вклад на 1000 рублей в течение 6 месяцев? сколько раз?",
+        "сколько стоит открыть вклад СберВклад на 5000 на 3 месяца",
+        "Какой процент по вкладу Лучший процент на 200 000 на 6 месяцев?",
+        "Когда я получу проценты по вкладу?",
+    ],
+)
+def test_other_questions_fall_through_to_rag(question):
+    assert parse_question(question) is None
+
+
+def test_promo_rate_applies_only_to_first_months(table):
+    account = next(p for p in table.products if p.name == "Накопительный счет")
+    assert (account.rate, account.promo_months, account.base_rate) == (16.0, 3.0, 10.0)
+    assert account.promo_condition == "при открытии первого Накопительного счета"
+
+    income = calculate([500_000], [12], [16.0], [3.0], [10.0])[0, 0, 0]
+    assert income[0] == pytest.approx(500_000 * (0.16 * 3 + 0.10 * 9) / 12)
+    assert income[1] == pytest.approx(500_000 * ((1 + 0.16 / 12) ** 3 * (1 + 0.10 / 12) ** 9 - 1))
+
+    answer = table.answer("Какой доход на накопительном счете с 500 000 за 12 месяцев?")
+    assert "первые 3 мес. при открытии первого Накопительного счета, затем 10%" in answer
+    assert "доход 57 500 ₽" in answer
+
+
+def test_capitalization_only_where_offered(table):
+    answer = table.answer("Сколько заработаю на Управляй + с 100 000 рублей на 6 месяцев?")
+    assert "без капитализации" in answer
+    assert "с ежемесячной капитализацией" not in answer
+
+    answer = table.answer("Какой доход по вкладу 200 тыс на 1 год с капитализацией?")
+    assert "Управляй" not in answer
+    assert "«СберВклад»" in answer
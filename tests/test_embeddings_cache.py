@@ -0,0 +1,67 @@
+import asyncio
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+from src import metrics
+from src.embeddings_cache import CachedEmbeddings
+
+
+class RecordingEmbeddings(Embeddings):
+    """Векторы запросов и документов различаются, как у моделей с разными префиксами."""
+
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls.append(("documents", texts))
+        return [[0.0, float(len(text))] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self.calls.append(("query", text))
+        return [1.0, float(len(text))]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        await asyncio.sleep(0)
+        if text == "ошибка":
+            raise ValueError(text)
+        return self.embed_query(text)
+
+
+def test_async_queries_use_query_embedding_and_share_cache(workdir):
+    inner = RecordingEmbeddings()
+    cache = CachedEmbeddings(inner, cache_path=workdir / "queries.sqlite", batch_delay=0.001)
+
+    async def ask():
+        return await asyncio.gather(
+            cache.aembed_query("Ставка"),
+            cache.aembed_query(" ставка "),
+            cache.aembed_query("ошибка"),
+            return_exceptions=True,
+        )
+
+    vector, same, error = asyncio.run(ask())
+    assert vector == same == [1.0, 6.0]
+    assert isinstance(error, ValueError)
+    assert inner.calls == [("query", "Ставка")]
+
+    # синхронный путь берет тот же вектор запроса с диска
+    restored = CachedEmbeddings(RecordingEmbeddings(), cache_path=workdir / "queries.sqlite")
+    assert restored.embed_query("ставка") == [1.0, 6.0]
+    assert restored.embeddings.calls == []
+
+
+def test_only_misses_are_timed(workdir):
+    histogram = metrics.REGISTRY.histograms.get("query_embedding_seconds")
+    before = histogram.count if histogram else 0
+    cache = CachedEmbeddings(RecordingEmbeddings(), cache_path=workdir / "timed.sqlite")
+
+    async def ask():
+        await cache.aembed_query("Срок вклада")
+        await cache.aembed_query("срок вклада")
+
+    asyncio.run(ask())
+    cache.embed_query("Срок вклада")
+    cache.embed_query("Досрочное снятие")
+
+    assert metrics.REGISTRY.histograms["query_embedding_seconds"].count - before == 2
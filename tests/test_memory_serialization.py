@@ -0,0 +1,94 @@
+from langchain.memory import ConversationBufferMemory
+from langchain_core.messages import AIMessage, HumanMessage
+
+from src.bounded_memory import SummaryBufferMemory
+from src.memory_serialization import (
+    HISTORY_VERSION,
+    append_messages,
+    decode,
+    drop_turns,
+    encode,
+    read_turns,
+    serialize,
+)
+
+
+def build_memory(turns: int, memory_class=ConversationBufferMemory, **kwargs):
+    memory = memory_class(memory_key="history", input_key="question", **kwargs)
+    for i in range(turns):
+        memory.save_context({"question": f"вопрос {i}"}, {"text": f"ответ {i}"})
+    return memory
+
+
+def contents(memory):
+    return [(m.type, m.content) for m in memory.chat_memory.messages]
+
+
+def test_encode_decode_round_trip():
+    memory = build_memory(3)
+    state = encode(memory)
+    assert state["version"] == HISTORY_VERSION
+    assert state["count"] == 6
+
+    restored = decode(state)
+    assert type(restored) is ConversationBufferMemory
+    assert contents(restored) == contents(memory)
+    assert restored.load_memory_variables({})["history"] == memory.buffer
+    assert all(isinstance(m, (HumanMessage, AIMessage)) for m in restored.chat_memory.messages)
+
+
+def test_summary_memory_fields_survive():
+    memory = build_memory(2, SummaryBufferMemory, keep_last_turns=1)
+    memory.moving_summary_buffer = "клиент спрашивал про СберВклад"
+    restored = decode(encode(memory))
+    assert isinstance(restored, SummaryBufferMemory)
+    assert restored.moving_summary_buffer == memory.moving_summary_buffer
+    assert restored.keep_last_turns == 1
+    assert contents(restored) == contents(memory)
+
+
+def test_append_does_not_touch_old_turns():
+    state = encode(build_memory(1))
+    old = state["messages"]
+    state = append_messages(state, [HumanMessage("вопрос 1"), AIMessage("ответ 1")])
+    assert state["messages"].startswith(old)
+    assert state["count"] == 4
+    assert contents(decode(state)) == contents(build_memory(2))
+
+
+def test_drop_turns():
+    state = drop_turns(encode(build_memory(3)), 2)
+    assert state["count"] == 4
+    assert [content for _, content, _ in read_turns(state)] == [
+        "вопрос 1",
+        "ответ 1",
+        "вопрос 2",
+        "ответ 2",
+    ]
+    assert drop_turns(state, 10)["count"] == 0
+    assert decode(state).chat_memory.messages == []
+
+
+def test_legacy_dict_format():
+    memory = build_memory(2)
+    legacy = serialize(memory)
+    assert "version" not in legacy
+
+    assert contents(decode(legacy)) == contents(memory)
+    assert [(role, content) for role, content, _ in read_turns(legacy)] == contents(memory)
+
+    state = append_messages(legacy, [HumanMessage("вопрос 2"), AIMessage("ответ 2")])
+    assert state["version"] == HISTORY_VERSION
+    assert contents(decode(state)) == contents(build_memory(3))
+    assert drop_turns(serialize(memory), 2)["count"] == 2
+
+
+def test_reencode_keeps_timestamps():
+    state = append_messages(
+        encode(build_memory(0)),
+        [
+            HumanMessage("вопрос", additional_kwargs={"ts": 100.0}),
+            AIMessage("ответ", additional_kwargs={"ts": 101.0}),
+        ],
+    )
+    assert [ts for _, _, ts in read_turns(encode(decode(state)))] == [100.0, 101.0]
@@ -0,0 +1,51 @@
+import asyncio
+from typing import List
+
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from src.metrics import REGISTRY, MetricsHandler
+
+
+class InnerRetriever(BaseRetriever):
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return [Document(page_content=query)]
+
+
+class OuterRetriever(BaseRetriever):
+    """Вложенные ретриверы, как запасной поверх гибридного."""
+
+    inner: BaseRetriever
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return self.inner.invoke(query, config={"callbacks": run_manager.get_child()})
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return await self.inner.ainvoke(query, config={"callbacks": run_manager.get_child()})
+
+
+def observed(name: str) -> int:
+    histogram = REGISTRY.histograms.get(name)
+    return histogram.count if histogram else 0
+
+
+def test_nested_retrievers_are_timed_once():
+    retriever = OuterRetriever(inner=OuterRetriever(inner=InnerRetriever()))
+    handler = MetricsHandler()
+    before = observed("retrieval_seconds")
+
+    retriever.invoke("ставка", config={"callbacks": [handler]})
+    asyncio.run(retriever.ainvoke("ставка", config={"callbacks": [handler]}))
+
+    assert observed("retrieval_seconds") - before == 2
+    assert handler._starts == {} and handler._retrievers == set()
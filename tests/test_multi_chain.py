@@ -0,0 +1,64 @@
+import asyncio
+from typing import Any, Dict, List
+
+from langchain.chains.router.base import RouterChain
+
+from src.local_embeddings import HashingEmbeddings
+from src.multi_chain import LocalRouterChain
+
+PROTOTYPES = {
+    "deposits": ["Какая ставка по вкладу?", "Как открыть вклад?"],
+    "cards": ["Как заказать дебетовую карту?", "Сколько стоит обслуживание карты?"],
+}
+
+
+class FixedRouter(RouterChain):
+    """Заменитель LLMRouterChain: всегда выбирает одну цепочку."""
+
+    destination: str
+    calls: int = 0
+
+    @property
+    def input_keys(self) -> List[str]:
+        return ["question"]
+
+    def _call(self, inputs: Dict[str, Any], run_manager=None) -> Dict[str, Any]:
+        self.calls += 1
+        return {"destination": self.destination, "next_inputs": dict(inputs)}
+
+
+def build_router(**kwargs):
+    return LocalRouterChain(
+        prototypes=PROTOTYPES,
+        keywords={"deposits": ["вклад"], "cards": ["карта"]},
+        embeddings=HashingEmbeddings(),
+        fallback=FixedRouter(destination="cards"),
+        **kwargs,
+    )
+
+
+def route(router, question):
+    return router.route({"question": question}).destination
+
+
+def test_keywords_route_without_embeddings():
+    router = build_router()
+    assert route(router, "Можно ли пополнить вклад?") == "deposits"
+    assert router._matrix is None
+    assert router.fallback.calls == 0
+
+
+def test_embeddings_route_when_keywords_are_silent():
+    router = build_router(threshold=0.3)
+    assert route(router, "Какая сейчас ставка?") == "deposits"
+    assert router._names == ["deposits", "deposits", "cards", "cards"]
+    assert router._matrix.shape[0] == 4
+    assert asyncio.run(router.aroute({"question": "Стоимость обслуживания"})).destination == "cards"
+    assert router.fallback.calls == 0
+
+
+def test_llm_fallback_when_unsure():
+    router = build_router(threshold=0.99)
+    assert route(router, "Что такое эскроу?") == "cards"
+    assert router.fallback.calls == 1
+    assert router.fallbacks == router.routed == 1
@@ -0,0 +1,55 @@
+import asyncio
+import pickle
+from types import SimpleNamespace
+
+from langchain.memory import ConversationBufferMemory
+
+from src.chat_state import STATE_KEY, ChatState
+from src.memory_serialization import read_turns
+from src.persistence import SQLitePersistence
+
+
+def write_pickle_persistence(path, chat_data):
+    # формат PicklePersistence(single_file=True)
+    data = {
+        "user_data": {},
+        "chat_data": chat_data,
+        "bot_data": {},
+        "callback_data": None,
+        "conversations": {},
+    }
+    path.write_bytes(pickle.dumps(data))
+
+
+def legacy_helper(question: str):
+    memory = ConversationBufferMemory(memory_key="history", input_key="question")
+    memory.save_context({"question": question}, {"text": "ответ"})
+    return SimpleNamespace(memory=memory)
+
+
+def load_chat(persistence, chat_id):
+    async def load():
+        chat_data = {}
+        await persistence.refresh_chat_data(chat_id, chat_data)
+        await persistence.flush()
+        return chat_data
+
+    return asyncio.run(load())
+
+
+def test_pickle_storage_is_imported_once(tmp_path):
+    legacy = tmp_path / "storage"
+    write_pickle_persistence(legacy, {42: {"giga": legacy_helper("Какая ставка?")}})
+
+    persistence = SQLitePersistence(tmp_path / "storage.sqlite", legacy_path=legacy)
+    chat_data = load_chat(persistence, 42)
+    state = ChatState.load(chat_data)
+    assert "giga" not in chat_data and STATE_KEY not in chat_data
+    assert [content for _, content, _ in read_turns(state.memory)] == ["Какая ставка?", "ответ"]
+
+    # повторный запуск не перезаписывает базу старым файлом
+    write_pickle_persistence(legacy, {42: {"giga": legacy_helper("Другой вопрос")}, 7: {}})
+    persistence = SQLitePersistence(tmp_path / "storage.sqlite", legacy_path=legacy)
+    assert load_chat(persistence, 7) == {}
+    turns = read_turns(ChatState.load(load_chat(persistence, 42)).memory)
+    assert turns[0][1] == "Какая ставка?"
@@ -0,0 +1,41 @@
+import asyncio
+
+import pytest
+
+from src.resilience import CircuitBreaker, CircuitOpenError, EmptyAnswerError, ResiliencePolicy
+
+
+def fail_with(policy, exc):
+    async def factory():
+        raise exc
+
+    with pytest.raises(type(exc)):
+        asyncio.run(policy.run(factory))
+
+
+def test_non_retryable_error_does_not_reset_failures():
+    policy = ResiliencePolicy(max_attempts=1, breaker=CircuitBreaker(3, 30.0))
+    fail_with(policy, EmptyAnswerError())
+    fail_with(policy, EmptyAnswerError())
+    fail_with(policy, ValueError("ошибка в цепочке"))
+    assert policy.breaker.failures == 2
+
+    fail_with(policy, EmptyAnswerError())
+    assert policy.breaker.state == "open"
+
+    async def answer():
+        return "ответ"
+
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(policy.run(answer))
+
+
+def test_non_retryable_error_keeps_breaker_half_open():
+    policy = ResiliencePolicy(max_attempts=1, breaker=CircuitBreaker(1, 0.0))
+    fail_with(policy, EmptyAnswerError())
+    assert policy.breaker.state == "half_open"
+
+    fail_with(policy, ValueError("ошибка в цепочке"))
+    assert policy.breaker.state == "half_open"
+    # пробная попытка завершена, следующую размыкатель пропускает
+    assert policy.breaker.allow()
@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+
+from src.single_flight import SingleFlight
+
+
+def follow(leader_factory, max_wait=1.0):
+    """Лидер и ожидающий с тем же ключом; результат ожидающего и число его вызовов."""
+    flight = SingleFlight(max_wait=max_wait)
+    own_calls = []
+
+    async def own():
+        own_calls.append(1)
+        return "свой ответ"
+
+    async def scenario():
+        leader = asyncio.ensure_future(flight.run("ключ", leader_factory))
+        await asyncio.sleep(0)
+        follower = await flight.run("ключ", own)
+        await asyncio.gather(leader, return_exceptions=True)
+        return follower
+
+    return asyncio.run(scenario()), len(own_calls), flight
+
+
+def test_follower_shares_leader_result():
+    async def leader():
+        await asyncio.sleep(0.01)
+        return "общий ответ"
+
+    result, own_calls, flight = follow(leader)
+    assert result == ("общий ответ", True)
+    assert own_calls == 0
+    assert flight.stats()["shared"] == 1
+
+
+@pytest.mark.parametrize("empty", [None, ""])
+def test_follower_runs_own_factory_on_empty_leader_result(empty):
+    async def leader():
+        await asyncio.sleep(0.01)
+        return empty
+
+    result, own_calls, flight = follow(leader)
+    assert result == ("свой ответ", False)
+    assert own_calls == 1
+    assert flight.stats()["shared"] == 0
+
+
+def test_follower_runs_own_factory_when_leader_fails():
+    async def leader():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("GigaChat недоступен")
+
+    result, own_calls, _ = follow(leader)
+    assert result == ("свой ответ", False)
+    assert own_calls == 1
+
+
+def test_follower_stops_waiting_after_max_wait():
+    async def leader():
+        await asyncio.sleep(0.5)
+        return "поздний ответ"
+
+    result, own_calls, flight = follow(leader, max_wait=0.01)
+    assert result == ("свой ответ", False)
+    assert own_calls == 1
+    assert flight.stats()["timeouts"] == 1
+
+
+def test_one_follower_takes_over_after_leader_failure():
+    flight = SingleFlight(max_wait=1.0)
+    calls = []
+
+    async def leader():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("GigaChat недоступен")
+
+    async def own():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "свой ответ"
+
+    async def scenario():
+        first = asyncio.ensure_future(flight.run("ключ", leader))
+        await asyncio.sleep(0)
+        followers = await asyncio.gather(*(flight.run("ключ", own) for _ in range(5)))
+        await asyncio.gather(first, return_exceptions=True)
+        return followers
+
+    followers = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert sorted(followers) == [("свой ответ", False)] + [("свой ответ", True)] * 4
+    assert flight.stats()["leaders"] == 2
+
+
+def test_follower_wait_is_capped_by_caller_timeout():
+    flight = SingleFlight(max_wait=60)
+    own_calls = []
+
+    async def leader():
+        await asyncio.sleep(0.5)
+        return "поздний ответ"
+
+    async def own():
+        own_calls.append(1)
+        return "свой ответ"
+
+    async def scenario():
+        first = asyncio.ensure_future(flight.run("ключ", leader))
+        await asyncio.sleep(0)
+        try:
+            with pytest.raises(asyncio.TimeoutError):
+                await flight.run("ключ", own, timeout=0.01)
+        finally:
+            first.cancel()
+
+    asyncio.run(scenario())
+    assert own_calls == []
+    assert flight.stats()["timeouts"] == 1